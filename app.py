@@ -1,19 +1,47 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, send_from_directory
 from flask_mail import Mail, Message
+from assets import AssetManifest
+from card_pool import CardPool, RESERVED as CARD_RESERVED
+from journal import Journal
+from waitlist import Waitlist
+from customers import FIELDS as CUSTOMER_FIELDS, CustomerStore
+from ledger import Ledger, FIELDNAMES as LEDGER_FIELDS, PERIODS as LEDGER_PERIODS
+from export import FORMATS as EXPORT_FORMATS, attachment_name, encode_rows, parse_flag, parse_time
+import serial_capture
+import ratelimit
+from ratelimit import rate_limit
+import credentials
+import idempotency
+from idempotency import idempotent
+import tracing
+from tracing import span, traced
+import kiosk
+from serial_protocol import CommandChannel
+from linkhealth import LinkHealth
+from filewatch import FileWatcher
+import eventlog
+from eventlog import log_event
+import profiling
 from functools import wraps
+from concurrent.futures import Future
 import serial
 import serial.tools.list_ports
 import threading
+import atexit
 import time
 import random
 import string
 import csv
+import json
 import os
 from datetime import datetime
 
 app = Flask(__name__)
 app.secret_key = "change-this-secret-key"
 
+# Structured JSON-lines event log, written off-thread (PARKING_LOG_LEVEL=DEBUG shows every serial command)
+eventlog.configure(level=os.environ.get("PARKING_LOG_LEVEL", "INFO"))
+
 # Email configuration
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
 app.config['MAIL_PORT'] = 587
@@ -22,17 +50,54 @@ app.config['MAIL_USERNAME'] = 'spradax20@gmail.com'  # Change this
 app.config['MAIL_PASSWORD'] = 'tzro xfyy fyvj nnwz'     # Change this
 mail = Mail(app)
 
+# Admission control: token buckets per user and per client IP, checked
+# before any SMTP send, CSV rewrite or serial command. Rates are per second.
+app.config['RATE_LIMITS'] = {
+    "email": {"rate": 1 / 30, "burst": 3, "ip_rate": 0.2, "ip_burst": 10},
+    "reserve": {"rate": 0.5, "burst": 5, "ip_rate": 2, "ip_burst": 20},
+    "arrival": {"rate": 1, "burst": 5, "ip_rate": 5, "ip_burst": 20},
+}
+# Max concurrent requests per scarce resource class
+app.config['CONCURRENCY_LIMITS'] = {"smtp": 2, "serial": 4, "disk": 4}
+ratelimit.init_app(app)
+
+# Retried reservations/arrivals carrying the same Idempotency-Key replay the
+# first response instead of running again (see idempotency.py)
+app.config['IDEMPOTENCY_TTL'] = 600  # seconds
+app.config['IDEMPOTENCY_MAX_KEYS'] = 10000
+idempotency.init_app(app)
+
+# Passwords are stored as salted scrypt hashes and checked on a small worker
+# pool, so a rush of logins queues there instead of tying up CPU everywhere
+# (see credentials.py). Changing the cost rehashes each account at its next login.
+app.config['PASSWORD_HASH_N'] = int(os.environ.get("PARKING_PASSWORD_HASH_N", 2 ** 14))
+app.config['CREDENTIAL_WORKERS'] = int(os.environ.get("PARKING_CREDENTIAL_WORKERS", 2))
+app.config['CREDENTIAL_MAX_PENDING'] = 32  # queued logins beyond the workers before answering 503
+app.config['CREDENTIAL_CACHE_TTL'] = 300  # seconds a successful login skips re-hashing
+credentials.init_app(app)
+
+# Gate kiosks keep one WebSocket open (/ws/kiosk, served by the asyncio gateway)
+# and authenticate with a per-device token: PARKING_KIOSK_TOKENS="gate-1=secret,..."
+app.config['KIOSK_TOKENS'] = kiosk.parse_tokens(os.environ.get("PARKING_KIOSK_TOKENS", ""))
+
+# Gate latency tracing: every scan/arrival is a trace of timed stages, from the
+# HTTP request to the device's DISP answer, kept in data/traces.jsonl
+app.config['TRACE_FILE'] = os.environ.get("PARKING_TRACE_FILE", "data/traces.jsonl")
+app.config['GATE_SLO_MS'] = 2000  # scan to card dispensed
+tracing.init_app(app)
+
 # CSV Database files
 CUSTOMERS_CSV = "data/customers.csv"
 VERIFICATION_CSV = "data/verification_codes.csv"
 PENDING_CSV = "data/pending_accounts.csv"
+LEDGER_CSV = os.environ.get("PARKING_LEDGER_CSV", "data/sessions.csv")
 
 # Create data directory if it doesn't exist
 os.makedirs("data", exist_ok=True)
 
 # In-memory users and verification codes
 USERS = {
-    "admin": "admin123"  # Default admin account
+    "admin": "admin123"  # Default admin account; replaced by its hash at the first login
 }
 
 # Parking spots state: O=open, X=occupied, R=reserved
@@ -44,45 +109,275 @@ spots = [
     {"id": 4, "state": "O", "reserved_by": None, "reserved_at": None, "arrival_ts": None, "assigned_slot": None},
 ]
 
-# Server-side card queue to match Arduino round-robin behavior
-# This mirrors the Arduino's availableQueue[4] = {0, 1, 2, 3} and queueHead = 0, queueSize = 4
-server_card_queue = [0, 1, 2, 3]  # Card indices 0-3 (1-4 in 1-based)
-server_queue_head = 0
-server_queue_size = 4
+# Guards multi-field changes to `spots`, the card pool and card timers so
+# bulk admin edits apply as one unit
+state_lock = threading.RLock()
+RESERVATION_FIELDS = ("reserved_by", "reserved_at", "arrival_ts", "assigned_slot", "arrived")
+
+
+def clear_reservation(spot):
+    """Drop the reservation on `spot`; keep X if the device reports it occupied"""
+    for key in RESERVATION_FIELDS:
+        spot[key] = None
+    if spot["state"] != 'X':
+        spot["state"] = 'O'
+
+
+# Users waiting for a spot while the lot is full, promoted as spots free up
+waitlist = Waitlist()
+
+# Server-side card pool mirroring the Arduino's round-robin availableQueue.
+# The device's QUEUE report is authoritative; reconcile against it periodically.
+CARD_COUNT = 4
+CARD_RECONCILE_INTERVAL = 30.0
+card_pool = CardPool(CARD_COUNT)
+last_card_reconcile = 0.0
+
+# Live spot updates: streaming clients wait on this instead of polling.
+# Extra listeners (e.g. the asyncio gateway) register callables here.
+spots_version = 0
+spots_changed = threading.Condition()
+spot_listeners = []
+shutting_down = threading.Event()
+# Each Flask stream holds a worker thread for as long as the page is open, so only a
+# few are served; the rest get 204 and poll. The asyncio gateway streams without limit.
+app.config['STREAM_MAX'] = int(os.environ.get("PARKING_STREAM_MAX", 4))
+open_streams = 0
+open_streams_lock = threading.Lock()
+
+# Gate events (spot assigned, card dispensed, payment complete) for the kiosk
+# sockets; listeners are called as listener(event, data) and must not block
+gate_listeners = [kiosk.hub.broadcast]
+
+
+def publish_gate_event(event, **data):
+    for listener in list(gate_listeners):
+        try:
+            listener(event, data)
+        except Exception:
+            pass
+
+
+def notify_spots_changed():
+    """Wake every streaming client after a change to `spots`"""
+    global spots_version
+    with spots_changed:
+        spots_version += 1
+        spots_changed.notify_all()
+    for listener in list(spot_listeners):
+        try:
+            listener()
+        except Exception:
+            pass
+
+
+def begin_shutdown():
+    """End long-lived responses (the spot stream) so the server can drain its workers"""
+    shutting_down.set()
+    with spots_changed:
+        spots_changed.notify_all()
 
 # Arduino serial connection
 arduino_serial = None
 last_resv_line = None
 last_cap_sent = None
 
+# Serial link supervision (hot-plug reconnect)
+ARDUINO_BAUDRATE = 9600
+RECONNECT_BACKOFF_INITIAL = 0.5  # seconds before the first rescan
+RECONNECT_BACKOFF_MAX = 8.0      # cap for exponential backoff
+serial_write_lock = threading.RLock()  # one writer at a time on the UART
+supervisor_thread = None
+supervisor_stop = threading.Event()
+arduino_port = None  # last port we successfully opened
+
+# Cards whose parking timer is running on the device: card index -> start time.
+# Kept so a reconnect can restart the timers with the elapsed time preserved.
+active_card_timers = {}
+
+# Acknowledged command protocol (@seq:CMD -> ACK:seq / NAK:seq). Negotiated per
+# connection with a PROTO probe; older firmware never answers and stays on the
+# legacy fire-and-forget path with fixed pacing sleeps.
+ACK_WINDOW = 4           # max commands in flight
+ACK_TIMEOUT = 1.0        # seconds before a command is resent
+ACK_RETRIES = 2
+READ_BURST = 64          # inbound lines handled per reader pass before the periodic checks run again
+ack_protocol = False
+reader_thread_ident = None
+
+
+def write_serial_bytes(data):
+    """Raw write used by the command channel; raises if the link is down"""
+    with serial_write_lock:
+        ser = arduino_serial
+        if not (ser and ser.is_open):
+            raise ConnectionError("Arduino not connected")
+        ser.write(data)
+        ser.flush()
+
+
+command_channel = CommandChannel(write_serial_bytes, window=ACK_WINDOW, ack_timeout=ACK_TIMEOUT, retries=ACK_RETRIES)
+
+# SLOTS reporting rate by local hour: (start_hour, end_hour, interval_ms), first
+# match wins. In change-only mode the device still sends a full keyframe
+# every SLOTS_KEYFRAME_MS.
+app.config['SLOTS_REPORT_SCHEDULE'] = [(7, 10, 200), (16, 19, 200), (22, 24, 2000), (0, 6, 2000)]
+app.config['SLOTS_REPORT_DEFAULT_MS'] = 500
+app.config['SLOTS_CHANGE_ONLY'] = True
+app.config['SLOTS_KEYFRAME_MS'] = 10000
+SLOTS_RATE_CHECK_INTERVAL = 30.0
+slots_rate_override = None  # (interval_ms, change_only, keyframe_ms) set by an admin
+last_rate_line = None
+last_rate_check = 0.0
+last_slots_applied = None  # (payload, spots_version) of the last SLOTS applied
+
+
+def current_slots_rate(now=None):
+    if slots_rate_override is not None:
+        return slots_rate_override
+    hour = (now or datetime.now()).hour
+    interval = app.config['SLOTS_REPORT_DEFAULT_MS']
+    for start, end, ms in app.config['SLOTS_REPORT_SCHEDULE']:
+        if start <= hour < end:
+            interval = ms
+            break
+    return interval, app.config['SLOTS_CHANGE_ONLY'], app.config['SLOTS_KEYFRAME_MS']
+
+
+def compose_rate_line():
+    interval, change_only, keyframe = current_slots_rate()
+    return f"RATE:{int(interval)},{'CHANGE' if change_only else 'ALL'},{int(keyframe)}\n"
+
+
+def note_slots_rate(line):
+    """Remember the rate the device runs at and size the stall alarm to it"""
+    global last_rate_line
+    last_rate_line = line
+    interval, change_only, keyframe = current_slots_rate()
+    longest_gap_ms = max(interval, keyframe) if change_only else interval
+    link_health.slots_stall_after = longest_gap_ms / 1000 * 1.5 + 1.0
+
+
+def push_slots_rate(force=False):
+    """Send RATE when the schedule or an admin override changes it (checked every 30s)"""
+    global last_rate_check
+    now = time.monotonic()
+    if not force and now - last_rate_check < SLOTS_RATE_CHECK_INTERVAL:
+        return
+    last_rate_check = now
+    if not (arduino_serial and arduino_serial.is_open):
+        return
+    line = compose_rate_line()
+    if line != last_rate_line and send_command_to_arduino(line, "SLOTS rate"):
+        note_slots_rate(line)
+
+
+# Heartbeat: PING/PONG round trips and SLOTS cadence grade the link
+# healthy/degraded/down; a link that stops answering is reopened.
+link_health = LinkHealth(ping_interval=2.0)
+
+
+def send_link_ping():
+    """Write a PING when one is due (raw line, outside the acknowledged channel)"""
+    line = link_health.next_ping()
+    if line is None:
+        return
+    try:
+        write_serial_bytes(line.encode())
+    except Exception:
+        pass
+
+
+def legacy_pacing(seconds):
+    """Sleep between commands only when the firmware cannot acknowledge them"""
+    if not ack_protocol:
+        time.sleep(seconds)
+
+
+def send_command_async(command, description="command"):
+    """Send a command and return a Future that resolves once the device applied it"""
+    if ack_protocol:
+        return command_channel.submit(command, description, callback=lambda f: log_command_result(f, description))
+    future = Future()
+    future.set_result(send_command_to_arduino(command, description))
+    return future
+
+
+def log_command_result(future, description):
+    exc = future.exception()
+    if exc is not None:
+        log_event("serial.send_failed", description=description, error=str(exc))
+
+
+def negotiate_ack_protocol(then=None):
+    """Probe the firmware for acknowledged-command support, then call `then()` (e.g. start the state replay)"""
+    def on_probe(future):
+        global ack_protocol
+        ack_protocol = future.exception() is None
+        log_event("serial.link", status="protocol", protocol="acknowledged" if ack_protocol else "legacy")
+        if then is not None:
+            then()
+    command_channel.submit("PROTO", "protocol probe", callback=on_probe)
+
+
 def send_command_to_arduino(command, description="command"):
     """Safe wrapper for sending commands to Arduino with proper error handling"""
     global arduino_serial
     if not (arduino_serial and arduino_serial.is_open):
-        print(f"Arduino not connected - cannot send {description}")
+        log_event("serial.send_failed", description=description, error="not connected")
         return False
     
+    if ack_protocol:
+        # Multi-line bursts are pipelined: every line goes out within the window
+        futures = [
+            command_channel.submit(line, description, callback=lambda f: log_command_result(f, description))
+            for line in command.splitlines() if line.strip()
+        ]
+        if threading.get_ident() == reader_thread_ident:
+            # The reader is the one who sees the ACK, so it must not wait for it
+            return True
+        tracing.annotate(serial_seq=[future.seq for future in futures])
+        if len(futures) == 1:
+            tracing.device_command(futures[0].seq)
+        try:
+            with span("serial.ack_wait"):
+                for future in futures:
+                    future.result(timeout=ACK_TIMEOUT * (ACK_RETRIES + 1) + 0.5)
+            log_event("serial.ack", description=description, command=command.strip(), trace=tracing.current_id())
+            return True
+        except Exception:
+            return False
+    
     try:
-        # Clear buffers before sending
-        arduino_serial.reset_input_buffer()
-        arduino_serial.reset_output_buffer()
-        
-        # Send command
-        arduino_serial.write(command.encode())
-        arduino_serial.flush()  # Force send immediately
+        with span("serial.write"), serial_write_lock:
+            # Clear buffers before sending
+            arduino_serial.reset_input_buffer()
+            arduino_serial.reset_output_buffer()
+            
+            # Send command
+            arduino_serial.write(command.encode())
+            arduino_serial.flush()  # Force send immediately
         
-        print(f"{description} sent successfully: {command.strip()}")
-        time.sleep(0.15)  # Wait 150ms between commands
+        log_event("serial.send", description=description, command=command.strip(), trace=tracing.current_id())
+        with span("serial.pacing"):
+            time.sleep(0.15)  # Wait 150ms between commands
         return True
     except serial.SerialTimeoutException:
-        print(f"Timeout sending {description}: {command.strip()}")
+        log_event("serial.send_failed", description=description, command=command.strip(), error="timeout")
+        return False
+    except (serial.SerialException, OSError) as e:
+        log_event("serial.link", status="lost", description=description, error=str(e))
+        mark_arduino_disconnected()
         return False
     except Exception as e:
-        print(f"Error sending {description}: {e}")
+        log_event("serial.send_failed", description=description, error=str(e))
         return False
 
-def find_arduino_port():
+def find_arduino_port(preferred=None):
+    """Return the Arduino's serial device, preferring the last known port"""
     ports = serial.tools.list_ports.comports()
+    if preferred and any(p.device == preferred for p in ports):
+        return preferred
     for p in ports:
         if any(x in p.description.lower() for x in ["arduino", "ch340", "cp210", "ftdi", "usb serial"]):
             return p.device
@@ -92,153 +387,370 @@ def find_arduino_port():
 # Server-side card queue management (mirrors Arduino behavior)
 def pop_next_card_from_queue():
     """Pop next card from server queue (mirrors Arduino popNextCardFromQueue)"""
-    global server_queue_head, server_queue_size
-    if server_queue_size == 0:
-        return -1
-    card_idx = server_card_queue[server_queue_head]
-    server_queue_head = (server_queue_head + 1) % 4
-    server_queue_size -= 1
-    return card_idx
+    return card_pool.pop_next()
 
 
 def push_returned_card_to_queue(card_idx):
     """Push returned card to end of server queue (mirrors Arduino pushReturnedCardToQueue)"""
-    global server_queue_head, server_queue_size
-    if server_queue_size >= 4:
-        return  # should not happen
-    insert_pos = (server_queue_head + server_queue_size) % 4
-    server_card_queue[insert_pos] = card_idx
-    server_queue_size += 1
+    card_pool.push_returned(card_idx)
 
 
 def remove_card_from_queue_if_present(card_idx):
     """Remove card from server queue if present (mirrors Arduino removeCardFromQueueIfPresent)"""
-    global server_queue_head, server_queue_size
-    if server_queue_size == 0:
+    card_pool.remove(card_idx)
+
+
+def request_card_queue(force=False):
+    """Ask the device for its card queue (answered with QUEUE:...) at most every CARD_RECONCILE_INTERVAL"""
+    global last_card_reconcile
+    now = time.monotonic()
+    if not force and now - last_card_reconcile < CARD_RECONCILE_INTERVAL:
         return
-    new_queue = []
-    for i in range(server_queue_size):
-        pos = (server_queue_head + i) % 4
-        val = server_card_queue[pos]
-        if val != card_idx:
-            new_queue.append(val)
-    # Write back
-    for i in range(len(new_queue)):
-        server_card_queue[i] = new_queue[i]
-    server_queue_head = 0
-    server_queue_size = len(new_queue)
-
-
-def connect_arduino(port=None, baudrate=9600):
-    global arduino_serial
+    last_card_reconcile = now
+    if arduino_serial is None:
+        return
+    if ack_protocol:
+        send_command_async("QUEUE?\n", "Card queue query")
+        return
+    # Runs on the reader thread: a legacy send would clear the input buffer (losing
+    # DISP/PAID lines already received) and pace with a sleep, so write the line directly
+    try:
+        write_serial_bytes(b"QUEUE?\n")
+    except Exception:
+        pass
+
+
+def reconcile_card_queue(payload):
+    """Realign the card pool with the device's 1-based QUEUE report"""
+    try:
+        device_queue = [int(p) - 1 for p in payload.split(",") if p.strip()]
+    except ValueError:
+        return
+    drift = card_pool.reconcile(device_queue)
+    if drift:
+        record_state_change("reconcile", cards=True)
+        log_event("cards.drift", **drift)
+
+
+def open_arduino_serial(port, baudrate=ARDUINO_BAUDRATE):
+    """Open the serial port and wait for the Arduino to come out of reset"""
+    ser = serial.Serial(
+        port=port,
+        baudrate=baudrate,
+        timeout=1,
+        write_timeout=2,  # Add write timeout
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        # One owner per port: a second server process fails to open it instead of
+        # interleaving commands (Windows COM ports are exclusive already)
+        **({"exclusive": True} if os.name == "posix" else {})
+    )
+    
+    time.sleep(2)  # Wait for Arduino to reset
+    
+    # Clear any pending data
+    ser.reset_input_buffer()
+    ser.reset_output_buffer()
+    link_health.reset()
+    return wrap_capture(ser)
+
+
+def connect_arduino(port=None, baudrate=ARDUINO_BAUDRATE):
+    global arduino_serial, arduino_port, ARDUINO_BAUDRATE
     try:
         if port is None:
-            port = find_arduino_port()
+            port = find_arduino_port(arduino_port)
         if not port:
+            # Keep looking in the background so a late plug-in still connects
+            start_arduino_supervisor()
             return False, "No Arduino found"
         
-        arduino_serial = serial.Serial(
-            port=port,
-            baudrate=baudrate,
-            timeout=1,
-            write_timeout=2,  # Add write timeout
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE
-        )
-        
-        time.sleep(2)  # Wait for Arduino to reset
+        ARDUINO_BAUDRATE = baudrate
+        arduino_serial = open_arduino_serial(port, baudrate)
+        arduino_port = port
         
-        # Clear any pending data
-        arduino_serial.reset_input_buffer()
-        arduino_serial.reset_output_buffer()
-        
-        threading.Thread(target=read_arduino_loop, daemon=True).start()
+        # Opening the port resets the board; the reader restores host state once the protocol is known
+        start_arduino_supervisor()
         return True, f"Connected: {port}"
     except Exception as e:
+        start_arduino_supervisor()
         return False, str(e)
 
 
+def mark_arduino_disconnected():
+    """Drop the current serial handle so the supervisor starts reconnecting"""
+    global arduino_serial, last_resv_line, last_cap_sent, ack_protocol, last_card_reconcile
+    global last_rate_line, last_slots_applied
+    with serial_write_lock:
+        ser = arduino_serial
+        arduino_serial = None
+        # The device forgets everything on reset; force fresh pushes next time
+        last_resv_line = None
+        last_cap_sent = None
+        ack_protocol = False
+        # ...and its card queue may have changed while we were away
+        last_card_reconcile = 0.0
+        last_rate_line = None
+        last_slots_applied = None
+    link_health.reset()
+    command_channel.reset()
+    if ser is not None:
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+
+def start_arduino_supervisor():
+    """Start the connection supervisor thread once per process"""
+    global supervisor_thread
+    if supervisor_thread and supervisor_thread.is_alive():
+        return
+    supervisor_stop.clear()
+    supervisor_thread = threading.Thread(target=supervise_arduino_link, name="arduino-supervisor", daemon=True)
+    supervisor_thread.start()
+
+
+def supervise_arduino_link():
+    """Run the reader while connected; rescan and reopen with backoff when the link drops"""
+    global arduino_serial, arduino_port
+    delay = RECONNECT_BACKOFF_INITIAL
+    while not supervisor_stop.is_set():
+        if arduino_serial and arduino_serial.is_open:
+            read_arduino_loop()  # returns once the link is gone
+            if supervisor_stop.is_set():
+                break
+            log_event("serial.link", status="lost")
+            mark_arduino_disconnected()
+            delay = RECONNECT_BACKOFF_INITIAL
+            continue
+        
+        port = find_arduino_port(arduino_port)
+        if port:
+            try:
+                ser = open_arduino_serial(port, ARDUINO_BAUDRATE)
+                arduino_serial = ser
+                arduino_port = port
+                log_event("serial.link", status="connected", port=port)
+                delay = RECONNECT_BACKOFF_INITIAL
+                continue
+            except Exception as e:
+                log_event("serial.link", status="connect_failed", port=port, error=str(e))
+        
+        supervisor_stop.wait(delay)
+        delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+
+def stop_arduino_supervisor():
+    """Stop supervising and close the port (used on shutdown)"""
+    supervisor_stop.set()
+    mark_arduino_disconnected()
+
+
+def shutdown_arduino(drain_timeout=3.0):
+    """Graceful stop: let queued and in-flight commands be acknowledged, then close the port"""
+    deadline = time.monotonic() + drain_timeout
+    while (command_channel.pending() and arduino_serial and arduino_serial.is_open
+           and time.monotonic() < deadline):
+        time.sleep(0.05)
+    undelivered = command_channel.pending()
+    stop_arduino_supervisor()
+    if supervisor_thread and supervisor_thread is not threading.current_thread():
+        supervisor_thread.join(timeout=2.0)
+    log_event("serial.link", status="closed", undelivered=undelivered)
+
+
+def replay_state_to_arduino():
+    """Push the authoritative host state to a freshly reset device in one burst"""
+    global last_resv_line, last_cap_sent
+    resv_line = compose_resv_line()
+    cap_line = compose_cap_line(count_capacity_holds())
+    rate_line = compose_rate_line()
+    lines = [resv_line, cap_line, compose_rfid_line(), rate_line]
+    now = time.time()
+    for card_idx, started in sorted(active_card_timers.items()):
+        elapsed = max(0, int(now - started))
+        lines.append(f"START:{card_idx + 1},{elapsed}\n")
+    
+    if send_command_to_arduino("".join(lines), "State replay"):
+        last_resv_line = resv_line
+        last_cap_sent = cap_line
+        note_slots_rate(rate_line)
+        return True
+    return False
+
+
+def start_state_replay():
+    """Replay host state off the reader thread, so an acknowledged replay can wait for its ACKs"""
+    threading.Thread(target=replay_state_to_arduino, name="state-replay", daemon=True).start()
+
+
 def read_arduino_loop():
-    global arduino_serial, spots
-    while arduino_serial and arduino_serial.is_open:
+    global arduino_serial, spots, reader_thread_ident
+    ser = arduino_serial
+    reader_thread_ident = threading.get_ident()
+    # The board was just reset: learn whether it acknowledges commands, then replay state
+    # (acknowledged when it can be, so a lost burst is resent instead of leaving stale state)
+    negotiate_ack_protocol(then=start_state_replay)
+    while ser is not None and ser is arduino_serial and ser.is_open and not supervisor_stop.is_set():
         try:
+            # Resend or fail commands whose acknowledgement is overdue
+            command_channel.check_timeouts()
             # Enforce 10-minute hold policy periodically
             enforce_holds()
-            if arduino_serial.in_waiting > 0:
-                line = arduino_serial.readline().decode(errors='ignore').strip()
-                if line.startswith("SLOTS:"):
-                    payload = line.split(":", 1)[1]
-                    parts = [x.strip() for x in payload.split(",")]
-                    for i in range(min(4, len(parts))):
-                        # Device-reported states: X=occupied, R=reserved/session-active, O=open
-                        if parts[i] == 'X':
-                            spots[i]["state"] = 'X'
-                        elif parts[i] == 'R':
-                            # Mark as reserved/session-active without overwriting ownership
-                            spots[i]["state"] = 'R'
-                        elif parts[i] == 'O':
-                            # Only open if not reserved by a user
-                            if spots[i]["state"] != 'R' or not spots[i]["reserved_by"]:
-                                spots[i]["state"] = 'O'
-                elif line.startswith("PAID:"):
-                    try:
-                        idx = int(line.split(":", 1)[1]) - 1
-                        if 0 <= idx < len(spots):
-                            # Clear reservation server-side
-                            spots[idx]["reserved_by"] = None
-                            spots[idx]["reserved_at"] = None
-                            spots[idx]["arrival_ts"] = None
-                            spots[idx]["assigned_slot"] = None
-                            spots[idx]["arrived"] = None  # Clear arrived flag
-                            # Force clear R on system side; keep X if occupied
-                            if spots[idx]["state"] != 'X':
-                                spots[idx]["state"] = 'O'
-                            # Return card to end of server queue (sync with Arduino)
-                            push_returned_card_to_queue(idx)
-                            # Push updated overlay to device (no R for this spot)
-                            push_reservations_to_arduino()
-                            # Update capacity holds since reservation is cleared
-                            enforce_holds()
-                    except Exception:
-                        pass
-                elif line.startswith("DISP:"):
-                    try:
-                        # Arduino dispensed a card - sync server queue
-                        payload = line.split(":", 1)[1]
-                        if payload == "NONE":
-                            pass  # No card dispensed
-                        else:
-                            card_num = int(payload)
-                            card_idx = card_num - 1  # Convert 1-based to 0-based
-                            if 0 <= card_idx < 4:
-                                # Remove this card from server queue (it was dispensed by Arduino)
-                                remove_card_from_queue_if_present(card_idx)
-                    except Exception:
-                        pass
+            # Catch lost DISP/PAID lines before they skew card allocation
+            request_card_queue()
+            send_link_ping()
+            push_slots_rate()
+            if link_health.should_reconnect():
+                log_event("serial.link", status="unresponsive")
+                break
+            # Drain everything buffered so an ACK never waits behind SLOTS/PONG chatter;
+            # the bound keeps the timeout checks above running under a flood
+            drained = 0
+            while drained < READ_BURST and ser.in_waiting > 0:
+                dispatch_arduino_line(ser.readline().decode(errors='ignore').strip())
+                drained += 1
+        except (serial.SerialException, OSError):
+            # Cable pulled or device reset: hand control back to the supervisor
+            break
         except Exception:
+            drained = 0
             time.sleep(0.1)
-        time.sleep(0.05)
+        if not drained:
+            time.sleep(0.05)
+
+
+def dispatch_arduino_line(line):
+    """Route one inbound line: ACK/NAK to the command channel, everything else to the state handler"""
+    if not command_channel.handle_line(line):
+        handle_arduino_line(line)
+
+
+def handle_arduino_line(line):
+    """Apply one status line from the device (SLOTS/PAID/DISP) to the host state"""
+    global last_slots_applied
+    if line.startswith("PONG:"):
+        link_health.record_pong(line[5:])
+    elif line.startswith("SLOTS:"):
+        link_health.record_slots()
+        payload = line.split(":", 1)[1]
+        # Keyframes repeat the last report; nothing to do unless the host changed spots since
+        if (payload, spots_version) == last_slots_applied:
+            return
+        parts = [x.strip() for x in payload.split(",")]
+        before = [s["state"] for s in spots]
+        for i in range(min(4, len(parts))):
+            # Device-reported states: X=occupied, R=reserved/session-active, O=open
+            if parts[i] == 'X':
+                spots[i]["state"] = 'X'
+            elif parts[i] == 'R':
+                # Mark as reserved/session-active without overwriting ownership
+                spots[i]["state"] = 'R'
+            elif parts[i] == 'O':
+                # Only open if not reserved by a user
+                if spots[i]["state"] != 'R' or not spots[i]["reserved_by"]:
+                    spots[i]["state"] = 'O'
+        if before != [s["state"] for s in spots]:
+            notify_spots_changed()
+        last_slots_applied = (payload, spots_version)
+    elif line.startswith("PAID:"):
+        try:
+            # PAID:n or PAID:n,amountDue,amountPaid,seconds (firmware with billing)
+            fields = [f.strip() for f in line.split(":", 1)[1].split(",")]
+            idx = int(fields[0]) - 1
+            if 0 <= idx < len(spots):
+                session_row = record_paid_session(idx, fields[1:])
+                with state_lock:
+                    # Clear reservation server-side (force clear R; keep X if occupied)
+                    clear_reservation(spots[idx])
+                    # Card is back in the dispenser; its timer is over
+                    active_card_timers.pop(idx, None)
+                    # Return card to end of server queue (sync with Arduino)
+                    push_returned_card_to_queue(idx)
+                    record_state_change("paid", spot_ids=(idx + 1,), timer_cards=(idx,), cards=True)
+                promoted = promote_waitlist()
+                notify_spots_changed()
+                # Push updated overlay to device (no R for this spot)
+                push_reservations_to_arduino()
+                if promoted:
+                    push_rfid_data_to_arduino()
+                # Update capacity holds since reservation is cleared
+                enforce_holds()
+                publish_gate_event("payment_complete", spot=idx + 1, card=idx + 1,
+                                   amount_paid=session_row["amount_paid"] if session_row else None)
+        except Exception:
+            pass
+    elif line.startswith("QUEUE:"):
+        reconcile_card_queue(line.split(":", 1)[1])
+    elif line.startswith("DISP:"):
+        try:
+            # Arduino dispensed a card - sync server queue
+            # DISP:<card>@<seq> answers host command <seq>; plain DISP:<card> is a walk-in or VIP-card dispense
+            payload, _, seq = line.split(":", 1)[1].partition("@")
+            # Closes the dispense stage of the gate scan that asked for it
+            trace = tracing.sink.device_response(payload, int(seq) if seq else None)
+            card = None if payload == "NONE" else int(payload)
+            if trace is not None:
+                publish_gate_event("card_dispensed", card=card, trace_id=trace.trace_id, kiosk=trace.attrs.get("kiosk"))
+            else:
+                # Walk-in button or VIP card at the reader: no scan asked for this card
+                publish_gate_event("card_dispensed", card=card)
+            if payload == "NONE":
+                pass  # No card dispensed
+            else:
+                card_num = int(payload)
+                card_idx = card_num - 1  # Convert 1-based to 0-based
+                if 0 <= card_idx < 4:
+                    with state_lock:
+                        # Remove this card from server queue (it was dispensed by Arduino)
+                        remove_card_from_queue_if_present(card_idx)
+                        # The device starts this card's parking timer on dispense
+                        active_card_timers[card_idx] = time.time()
+                        record_state_change("disp", timer_cards=(card_idx,), cards=True)
+        except Exception:
+            pass
+
+
+def record_paid_session(idx, billing):
+    """Write the completed session for card/spot `idx` to the billing ledger; returns the row"""
+    end = time.time()
+    started = active_card_timers.get(idx)
+    try:
+        amount_due, amount_paid, seconds = (int(v) for v in billing[:3])
+    except ValueError:
+        # Older firmware reports only the card; derive what it would have charged
+        seconds = int(end - started) if started else 0
+        amount_due = amount_paid = ((seconds + 4) // 5) * 5
+    try:
+        return billing_ledger.record(
+            spot=idx + 1, card=idx + 1, customer=spots[idx].get("reserved_by"),
+            start=end - seconds, end=end, amount_due=amount_due, amount_paid=amount_paid,
+        )
+    except OSError as e:
+        log_event("csv.error", file=LEDGER_CSV, op="append", error=str(e))
+        return None
+
+
+def count_capacity_holds():
+    """Number of slots/cards to hold for imminent reservations (no side effects)"""
+    now = time.time()
+    hold_count = 0
+    for s in spots:
+        if s.get("reserved_by") and not s.get("arrived"):
+            arrival = s.get("arrival_ts")
+            # No arrival time set, or arrival within 10 minutes: hold capacity
+            if arrival is None or (arrival - now) <= 10 * 60:
+                hold_count += 1
+    return hold_count
+
+
 def enforce_holds():
     """Compute how many slots/cards to hold for imminent reservations; do not mark any slot reserved."""
     try:
-        now = time.time()
-        hold_count = 0
         for s in spots:
-            if s.get("reserved_by"):
-                # Don't hold capacity for users who have already arrived
-                if s.get("arrived"):
-                    continue
-                    
-                arrival = s.get("arrival_ts")
-                if arrival is None:
-                    # No arrival time set, hold capacity
-                    hold_count += 1
-                else:
-                    # Check if arrival is within 10 minutes
-                    if (arrival - now) <= 10 * 60:
-                        hold_count += 1
-            else:
+            if not s.get("reserved_by"):
                 # No reservation, ensure arrival and assignment cleared
                 if s.get("arrival_ts"):
                     s["arrival_ts"] = None
@@ -248,7 +760,7 @@ def enforce_holds():
                     s["arrived"] = None
 
         # Push capacity hold (cached to avoid spamming)
-        push_capacity_hold_to_arduino(hold_count)
+        push_capacity_hold_to_arduino(count_capacity_holds())
     except Exception:
         pass
 
@@ -257,66 +769,183 @@ def generate_verification_code():
     """Generate a 4-digit verification code"""
     return ''.join(random.choices(string.digits, k=4))
 
+VERIFICATION_SUBJECT = 'Parking System - Email Verification'
+
+
+def verification_email_body(code):
+    return f'Your verification code is: {code}\n\nThis code will expire in 10 minutes.'
+
+
 def send_verification_email(email, code):
     """Send verification code to email"""
     try:
         msg = Message(
-            'Parking System - Email Verification',
+            VERIFICATION_SUBJECT,
             sender=app.config['MAIL_USERNAME'],
             recipients=[email]
         )
-        msg.body = f'Your verification code is: {code}\n\nThis code will expire in 10 minutes.'
+        msg.body = verification_email_body(code)
         mail.send(msg)
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        log_event("email.error", email=email, error=str(e))
         return False
 
 # CSV Database Helper Functions
+# Hash of each customer's CSV row as last loaded or saved, so a reload after an
+# external edit only has to rebuild the rows that differ
+customers_file_rows = {}
+customers_file_lock = threading.Lock()
+
+# RFID (spaces removed) -> customer email, so a gate scan is one lookup
+RFID_INDEX = {}
+
+# Edits to the customers CSV by other tools are applied live; 0 disables the watcher
+app.config['CUSTOMERS_RELOAD_INTERVAL'] = float(os.environ.get("PARKING_CUSTOMERS_RELOAD", 2))
+customer_watcher = None
+
+
+def customer_csv_rows(file):
+    """Row tuples in CUSTOMER_FIELDS order from an open customers CSV; None for a row cut short"""
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    positions = [header.index(name) for name in CUSTOMER_FIELDS]
+    for values in reader:
+        if values:
+            yield tuple(values[i] for i in positions) if len(values) >= len(header) else None
+
+
 def load_customers_from_csv():
     """Load customers from CSV file"""
-    customers = {}
+    global customers_file_rows
+    customers = CustomerStore()
+    rows = {}
     if os.path.exists(CUSTOMERS_CSV):
         try:
             with open(CUSTOMERS_CSV, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    customers[row['email']] = {
-                        'surname': row['surname'],
-                        'name': row['name'],
-                        'middle_name': row['middle_name'],
-                        'phone': row['phone'],
-                        'email': row['email'],
-                        'rfid': row['rfid'],
-                        'password': row['password'] if row['password'] else None,
-                        'created_by': row['created_by'],
-                        'created_at': row['created_at']
-                    }
+                for row in customer_csv_rows(file):
+                    if row is None:
+                        continue
+                    customers.put_row(row)
+                    rows[row[0]] = hash(row)
         except Exception as e:
-            print(f"Error loading customers from CSV: {e}")
+            log_event("csv.error", file=CUSTOMERS_CSV, op="load", error=str(e))
+    customers_file_rows = rows
     return customers
 
 def save_customers_to_csv():
-    """Save customers to CSV file"""
+    """Save customers to CSV file (written aside and renamed, so readers never see half a file)"""
+    global customers_file_rows
     try:
-        with open(CUSTOMERS_CSV, 'w', newline='', encoding='utf-8') as file:
-            fieldnames = ['email', 'surname', 'name', 'middle_name', 'phone', 'rfid', 'password', 'created_by', 'created_at']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            for email, customer in CUSTOMERS.items():
-                writer.writerow({
-                    'email': email,
-                    'surname': customer['surname'],
-                    'name': customer['name'],
-                    'middle_name': customer['middle_name'],
-                    'phone': customer['phone'],
-                    'rfid': customer['rfid'],
-                    'password': customer['password'] or '',
-                    'created_by': customer['created_by'],
-                    'created_at': customer['created_at']
-                })
+        with customers_file_lock:
+            rows = {}
+            partial = CUSTOMERS_CSV + ".tmp"
+            with open(partial, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(CUSTOMER_FIELDS)
+                for email in list(CUSTOMERS):
+                    try:
+                        row = CUSTOMERS.row(email)
+                    except KeyError:
+                        continue  # deleted while we were writing
+                    writer.writerow(row)
+                    rows[email] = hash(row)
+            os.replace(partial, CUSTOMERS_CSV)
+            customers_file_rows = rows
     except Exception as e:
-        print(f"Error saving customers to CSV: {e}")
+        log_event("csv.error", file=CUSTOMERS_CSV, op="save", error=str(e))
+
+
+def read_changed_customer_rows():
+    """Diff the CSV against the last load/save: (row hashes, changed rows by email, removed emails).
+
+    Returns None while the file is unreadable or a row is cut short (a writer
+    is mid-save); the watcher then tries again on its next check.
+    """
+    hashes, changed = {}, {}
+    try:
+        if os.path.getsize(CUSTOMERS_CSV) == 0:
+            return None
+        with open(CUSTOMERS_CSV, 'r', newline='', encoding='utf-8') as file:
+            for row in customer_csv_rows(file):
+                if row is None:
+                    return None
+                email = row[0]
+                hashes[email] = hash(row)
+                if customers_file_rows.get(email) != hashes[email]:
+                    changed[email] = row
+    except FileNotFoundError:
+        # A deleted file is not a request to delete every customer
+        return hashes, {}, []
+    except (OSError, ValueError, csv.Error) as e:
+        log_event("csv.error", file=CUSTOMERS_CSV, op="reload", error=str(e))
+        return None
+    removed = [email for email in customers_file_rows if email not in hashes]
+    return hashes, changed, removed
+
+
+def reload_customers_from_csv():
+    """Apply external edits to the customers CSV without a restart; False means try again later"""
+    global customers_file_rows
+    with customers_file_lock:
+        diff = read_changed_customer_rows()
+        if diff is None:
+            return False
+        hashes, changed, removed = diff
+        if not changed and not removed:
+            customers_file_rows = hashes
+            return True
+        with state_lock:
+            reserved = {s.get("reserved_by") for s in spots if s.get("reserved_by")}
+            added = 0
+            for email, row in changed.items():
+                old = CUSTOMERS.get(email)
+                added += old is None
+                reindex_rfid(email, old and old["rfid"], row[CUSTOMER_FIELDS.index("rfid")])
+                CUSTOMERS.put_row(row)
+            for email in removed:
+                old = CUSTOMERS.pop(email, None)
+                if old is not None:
+                    reindex_rfid(email, old.get("rfid"), None)
+            customers_file_rows = hashes
+        whitelist_changed = any(email in reserved for email in changed) or any(email in reserved for email in removed)
+    log_event("customers.reload", added=added, updated=len(changed) - added, removed=len(removed),
+              whitelist=whitelist_changed)
+    if whitelist_changed:
+        push_rfid_data_to_arduino()
+    return True
+
+
+def reindex_rfid(email, old_rfid, new_rfid):
+    """Move `email` in RFID_INDEX from its old card to its new one"""
+    old_key = (old_rfid or "").replace(" ", "")
+    new_key = (new_rfid or "").replace(" ", "")
+    if old_key and RFID_INDEX.get(old_key) == email:
+        del RFID_INDEX[old_key]
+    if new_key:
+        RFID_INDEX[new_key] = email
+
+
+def rebuild_rfid_index():
+    """Recompute RFID_INDEX from CUSTOMERS (after loading or replacing the whole store)"""
+    with state_lock:
+        RFID_INDEX.clear()
+        for email, customer in CUSTOMERS.items():
+            key = (customer.get("rfid") or "").replace(" ", "")
+            if key:
+                RFID_INDEX.setdefault(key, email)  # first customer wins, as the old linear scan did
+
+
+def start_customer_watcher():
+    """Reload customers.csv edits made by other tools while the app runs (once per process)"""
+    global customer_watcher
+    interval = app.config['CUSTOMERS_RELOAD_INTERVAL']
+    if customer_watcher is not None or not interval:
+        return
+    customer_watcher = FileWatcher(CUSTOMERS_CSV, reload_customers_from_csv, interval=interval, name="customers-watcher")
+    customer_watcher.start()
 
 def load_verification_codes_from_csv():
     """Load verification codes from CSV file"""
@@ -333,7 +962,7 @@ def load_verification_codes_from_csv():
                             'timestamp': float(row['timestamp'])
                         }
         except Exception as e:
-            print(f"Error loading verification codes from CSV: {e}")
+            log_event("csv.error", file=VERIFICATION_CSV, op="load", error=str(e))
     return codes
 
 def save_verification_codes_to_csv():
@@ -350,7 +979,7 @@ def save_verification_codes_to_csv():
                     'timestamp': data['timestamp']
                 })
     except Exception as e:
-        print(f"Error saving verification codes to CSV: {e}")
+        log_event("csv.error", file=VERIFICATION_CSV, op="save", error=str(e))
 
 def load_pending_accounts_from_csv():
     """Load pending accounts from CSV file"""
@@ -364,7 +993,7 @@ def load_pending_accounts_from_csv():
                     if float(row['timestamp']) > time.time() - 1800:  # 30 minutes
                         accounts[row['email']] = float(row['timestamp'])
         except Exception as e:
-            print(f"Error loading pending accounts from CSV: {e}")
+            log_event("csv.error", file=PENDING_CSV, op="load", error=str(e))
     return accounts
 
 def save_pending_accounts_to_csv():
@@ -380,12 +1009,92 @@ def save_pending_accounts_to_csv():
                     'timestamp': timestamp
                 })
     except Exception as e:
-        print(f"Error saving pending accounts to CSV: {e}")
+        log_event("csv.error", file=PENDING_CSV, op="save", error=str(e))
 
 # Load data from CSV files after function definitions
 CUSTOMERS = load_customers_from_csv()
+rebuild_rfid_index()
 VERIFICATION_CODES = load_verification_codes_from_csv()
 PENDING_ACCOUNTS = load_pending_accounts_from_csv()
+billing_ledger = Ledger(LEDGER_CSV)
+
+
+# Reservation state journal: every mutation of spots, card timers or the card
+# pool is appended to a write-ahead log; snapshots keep restart replay short.
+STATE_DIR = os.environ.get("PARKING_STATE_DIR", "data/state")
+
+
+def capture_state():
+    """Full reservation state in journal form (the snapshot payload)"""
+    return {
+        "spots": {str(s["id"]): dict(s) for s in spots},
+        "timers": {str(idx): started for idx, started in active_card_timers.items()},
+        "cards": {"pool": card_pool.dump()},
+        "waitlist": waitlist.dump(),
+    }
+
+
+def restore_state(state):
+    """Apply recovered journal state to the in-memory structures"""
+    for s in spots:
+        saved = state.get("spots", {}).get(str(s["id"]))
+        if saved:
+            s.update(saved)
+    active_card_timers.clear()
+    active_card_timers.update({int(idx): started for idx, started in state.get("timers", {}).items()})
+    if "pool" in state.get("cards", {}):
+        card_pool.load(state["cards"]["pool"])
+    waitlist.clear()
+    for user, entry in state.get("waitlist", {}).items():
+        waitlist.join(user, entry["arrival_ts"], entry["joined_at"])
+
+
+def record_state_change(event, spot_ids=(), timer_cards=(), cards=False, waitlist_users=()):
+    """Journal the current values of what `event` changed (never blocks; flush() for durability)"""
+    changes = {}
+    if waitlist_users:
+        queued = waitlist.dump()
+        changes["waitlist"] = {user: queued.get(user) for user in waitlist_users}
+    if spot_ids:
+        changes["spots"] = {str(s["id"]): dict(s) for s in spots if s["id"] in spot_ids}
+    if timer_cards:
+        changes["timers"] = {str(idx): active_card_timers.get(idx) for idx in timer_cards}
+    if cards:
+        changes["cards"] = {"pool": card_pool.dump()}
+    capture_line(serial_capture.STATE, f"{event} {json.dumps(changes, separators=(',', ':'))}")
+    try:
+        return state_journal.append(event, changes)
+    except Exception as e:
+        log_event("journal.error", event_name=event, error=str(e))
+
+
+state_journal = Journal(STATE_DIR)
+try:
+    restore_state(state_journal.recover())
+except Exception as e:
+    log_event("journal.error", op="recover", error=str(e))
+state_journal.start(capture_state)
+atexit.register(state_journal.close)
+
+
+# Optional serial traffic capture for off-site replay (see replay_serial.py)
+SERIAL_CAPTURE = os.environ.get("PARKING_SERIAL_CAPTURE")
+serial_capture_writer = None
+if SERIAL_CAPTURE:
+    serial_capture_writer = serial_capture.CaptureWriter(SERIAL_CAPTURE, header={"state": capture_state()})
+    atexit.register(serial_capture_writer.close)
+
+
+def wrap_capture(ser):
+    """Return `ser` wrapped to record its traffic when capture is enabled"""
+    if serial_capture_writer is None:
+        return ser
+    return serial_capture.CapturingSerial(ser, serial_capture_writer)
+
+
+def capture_line(direction, text):
+    if serial_capture_writer is not None:
+        serial_capture_writer.record(direction, text)
 
 def admin_required(view):
     @wraps(view)
@@ -404,23 +1113,79 @@ def login_required(view):
     return wrapped
 
 
+def form_email():
+    """Rate-limit key for the unauthenticated email-verification forms"""
+    return request.form.get("email", "").strip().lower() or None
+
+
+def scanned_rfid():
+    """Rate-limit key for gate scans: the card being presented"""
+    data = request.get_json(force=True, silent=True)
+    return scan_rfid_code(data) if isinstance(data, dict) else None
+
+
+def parse_json_body(raw):
+    """Decode a JSON request body into a dict; ValueError (with a message for the client) otherwise"""
+    try:
+        data = json.loads(raw or b"{}")
+    except ValueError:
+        raise ValueError("Request body must be JSON") from None
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return data
+
+
+def requested_arrival_ts(data):
+    try:
+        return float(data.get("arrival_ts", 0))
+    except (TypeError, ValueError):
+        raise ValueError("arrival_ts must be a number") from None
+
+
+def requested_spot_id(data):
+    try:
+        return int(data["id"]) if data.get("id") is not None else 0
+    except (TypeError, ValueError):
+        raise ValueError("id must be a number") from None
+
+
+def scan_rfid_code(data):
+    return str(data.get("rfid") or "").strip().replace(" ", "")  # Remove spaces
+
+
+def check_login(username, password):
+    """Verify admin then customer credentials; upgrades plaintext or outdated hashes on success"""
+    if username in USERS:
+        ok, replacement = credentials.verifier.verify(username, USERS[username], password)
+        if ok and replacement:
+            USERS[username] = replacement
+        return ok
+    customer = CUSTOMERS.get(username)
+    ok, replacement = credentials.verifier.verify(username, customer and customer["password"], password)
+    if ok and replacement:
+        customer["password"] = replacement
+        save_customers_to_csv()
+        log_event("auth.rehash", user=username)
+    return ok
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
         
-        # Check admin login
-        if username in USERS and USERS[username] == password:
+        try:
+            ok = check_login(username, password)
+        except credentials.Busy:
+            log_event("auth.busy", user=username)
+            return render_template("login.html", error="Too many sign-ins right now. Please try again in a moment."), 503
+        
+        if ok:
             session["user"] = username
             if username == "admin":
                 return redirect(url_for("admin_dashboard"))
             return redirect(url_for("index"))
-        
-        # Check customer login
-        if username in CUSTOMERS and CUSTOMERS[username]["password"] == password:
-            session["user"] = username
-            return redirect(url_for("index"))
             
         return render_template("login.html", error="Invalid credentials")
     return render_template("login.html")
@@ -435,7 +1200,275 @@ def logout():
 @app.route("/admin")
 @admin_required
 def admin_dashboard():
-    return render_template("admin_dashboard.html", customers=CUSTOMERS)
+    today = datetime.now().strftime("%Y-%m-%d")
+    return render_template(
+        "admin_dashboard.html", customers=CUSTOMERS,
+        revenue_today=billing_ledger.lookup("day", today), revenue_total=billing_ledger.summary(),
+        revenue_by_spot={s["id"]: billing_ledger.lookup("spot", str(s["id"])) for s in spots},
+    )
+
+
+@app.route("/admin/reports/revenue")
+@admin_required
+def admin_revenue_report():
+    """Sessions, revenue and dwell per hour, day or spot (?by=...&key=... for one bucket)"""
+    period = request.args.get("by", "day")
+    if period not in LEDGER_PERIODS:
+        return jsonify({"success": False, "message": f"by must be one of {', '.join(LEDGER_PERIODS)}"}), 400
+    key = request.args.get("key")
+    if key:
+        return jsonify({"by": period, "key": key, "totals": billing_ledger.lookup(period, key)})
+    return jsonify({"by": period, "buckets": billing_ledger.report(period), "total": billing_ledger.summary()})
+
+
+# Streaming exports. Rows are produced lazily and sent in chunks, so an export
+# never holds a whole dataset in memory or keeps state_lock beyond a snapshot.
+CUSTOMER_EXPORT_FIELDS = ["email", "surname", "name", "middle_name", "phone", "rfid", "activated",
+                          "created_by", "created_at"]
+RESERVATION_EXPORT_FIELDS = ["type", "customer", "spot", "state", "reserved_at", "arrival_ts", "arrived",
+                             "position", "joined_at"]
+
+
+def export_customers(args):
+    """?q=substring of email/name, ?activated=yes|no, ?has_rfid=yes|no"""
+    query = (args.get("q") or "").strip().lower()
+    activated = parse_flag(args.get("activated"))
+    has_rfid = parse_flag(args.get("has_rfid"))
+
+    def rows():
+        # Walk a snapshot of the keys so concurrent account changes cannot break the iteration
+        for email in list(CUSTOMERS):
+            customer = CUSTOMERS.get(email)
+            if customer is None:
+                continue
+            if query and query not in f"{email} {customer['name']} {customer['surname']}".lower():
+                continue
+            if activated is not None and bool(customer.get("password")) != activated:
+                continue
+            if has_rfid is not None and bool(customer.get("rfid")) != has_rfid:
+                continue
+            row = {key: customer.get(key) for key in CUSTOMER_EXPORT_FIELDS}
+            row.update(email=email, activated=bool(customer.get("password")))
+            yield row
+    return rows()
+
+
+def export_reservations(args):
+    """Current reservations and waitlist; ?customer=email, ?spot=n"""
+    customer = args.get("customer")
+    try:
+        spot_id = int(args["spot"]) if args.get("spot") else None
+    except ValueError:
+        raise ValueError("spot must be a number")
+    with state_lock:
+        held = [dict(s) for s in spots if s.get("reserved_by")]
+        queued = waitlist.dump()
+    # Same order as the waitlist heap: requested arrival (join time for ASAP), then join time
+    in_line = sorted(queued.items(), key=lambda item: (item[1]["arrival_ts"] or item[1]["joined_at"], item[1]["joined_at"]))
+
+    def rows():
+        for s in held:
+            if (customer and s["reserved_by"] != customer) or (spot_id and s["id"] != spot_id):
+                continue
+            yield {"type": "reservation", "customer": s["reserved_by"], "spot": s["id"], "state": s["state"],
+                   "reserved_at": s["reserved_at"], "arrival_ts": s.get("arrival_ts"), "arrived": bool(s.get("arrived"))}
+        if spot_id:
+            return
+        for position, (user, entry) in enumerate(in_line, 1):
+            if customer and user != customer:
+                continue
+            yield {"type": "waitlist", "customer": user, "position": position,
+                   "arrival_ts": entry["arrival_ts"] or None, "joined_at": entry["joined_at"]}
+    return rows()
+
+
+def export_history(args):
+    """Completed sessions from the billing ledger; ?since=&until= (session end), ?spot=n, ?customer=email"""
+    since = parse_time(args.get("since"))
+    until = parse_time(args.get("until"))
+    spot_id = args.get("spot")
+    customer = args.get("customer")
+
+    def rows():
+        for row in billing_ledger.iter_rows():
+            if (spot_id and row["spot"] != spot_id) or (customer and row["customer"] != customer):
+                continue
+            try:
+                # Typed values, so JSON lines carry numbers rather than CSV strings
+                row.update({key: int(row[key]) for key in ("spot", "card", "seconds", "amount_due", "amount_paid")})
+                row.update(start=float(row["start"]), end=float(row["end"]))
+            except (TypeError, ValueError):
+                continue
+            if (since is not None and row["end"] < since) or (until is not None and row["end"] >= until):
+                continue
+            yield row
+    return rows()
+
+
+EXPORTS = {
+    "customers": (CUSTOMER_EXPORT_FIELDS, export_customers),
+    "reservations": (RESERVATION_EXPORT_FIELDS, export_reservations),
+    "history": (LEDGER_FIELDS, export_history),
+}
+
+
+@app.route("/admin/export/<dataset>")
+@admin_required
+def admin_export(dataset):
+    """Stream customers, reservations or session history as CSV or JSON lines (?format=csv|jsonl)"""
+    if dataset not in EXPORTS:
+        return jsonify({"success": False, "message": f"Unknown export; choose one of {', '.join(EXPORTS)}"}), 404
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    fieldnames, source = EXPORTS[dataset]
+    try:
+        rows = source(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    log_event("admin.export", dataset=dataset, format=fmt)
+    return Response(encode_rows(rows, fieldnames, fmt), content_type=EXPORT_FORMATS[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{attachment_name(dataset, fmt)}"',
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+
+# On-demand profiling (admin only). Requests are profiled when an admin sends
+# an X-Profile header, or automatically at PROFILE_SAMPLE_RATE.
+app.config['PROFILE_SAMPLE_RATE'] = 0.0
+app.config['PROFILE_INTERVAL'] = 0.002  # seconds between stack samples
+PROFILE_WINDOW_MAX = 120  # seconds
+
+
+@app.before_request
+def start_request_profile():
+    requested = request.headers.get("X-Profile") and session.get("user") == "admin"
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if requested or (rate > 0 and random.random() < rate):
+        g.profiler = profiling.StackSampler(
+            interval=app.config['PROFILE_INTERVAL'], thread_ids={threading.get_ident()}
+        ).start()
+
+
+@app.after_request
+def finish_request_profile(response):
+    sampler = g.pop("profiler", None)
+    if sampler is not None:
+        sampler.stop()
+        profile_id = profiling.store.add(
+            "request", sampler, method=request.method, path=request.path, status=response.status_code
+        )
+        response.headers["X-Profile-Id"] = str(profile_id)
+    return response
+
+
+@app.route("/admin/link")
+@admin_required
+def admin_link_health():
+    """Serial link health: state, ping RTT and SLOTS cadence histograms"""
+    connected = bool(arduino_serial and arduino_serial.is_open)
+    interval, change_only, keyframe = current_slots_rate()
+    return jsonify({"connected": connected, "port": arduino_port, "protocol": "acknowledged" if ack_protocol else "legacy",
+                    "slots_rate": {"interval_ms": interval, "change_only": change_only, "keyframe_ms": keyframe},
+                    **link_health.report(connected)})
+
+
+@app.route("/admin/traces")
+@admin_required
+def admin_traces():
+    """Gate latency: per-stage percentiles (ms), SLO hit rate and the most recent traces (?recent=N)"""
+    recent = max(0, min(50, request.args.get("recent", 10, type=int)))
+    return jsonify({**tracing.sink.summary(), "recent": tracing.sink.recent_traces(recent) if recent else []})
+
+
+@app.route("/admin/link/slots_rate", methods=["POST"])
+@admin_required
+def admin_slots_rate():
+    """Override the SLOTS reporting schedule: {"interval_ms", "change_only", "keyframe_ms"} or {"auto": true}"""
+    global slots_rate_override
+    data = request.get_json(force=True)
+    if data.get("auto"):
+        slots_rate_override = None
+    else:
+        try:
+            interval = max(0, int(data.get("interval_ms", app.config['SLOTS_REPORT_DEFAULT_MS'])))
+            keyframe = max(1000, int(data.get("keyframe_ms", app.config['SLOTS_KEYFRAME_MS'])))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "interval_ms and keyframe_ms must be integers"}), 400
+        slots_rate_override = (interval, bool(data.get("change_only", app.config['SLOTS_CHANGE_ONLY'])), keyframe)
+    push_slots_rate(force=True)
+    interval, change_only, keyframe = current_slots_rate()
+    return jsonify({"success": True, "interval_ms": interval, "change_only": change_only, "keyframe_ms": keyframe,
+                    "override": slots_rate_override is not None})
+
+
+@app.route("/admin/cards")
+@admin_required
+def admin_cards():
+    """Card pool: dispenser queue order and per-card state (1-based)"""
+    return jsonify(card_pool.snapshot())
+
+
+@app.route("/admin/cards/reconcile", methods=["POST"])
+@admin_required
+def admin_cards_reconcile():
+    """Query the device's card queue now; the QUEUE reply realigns the pool"""
+    if arduino_serial is None:
+        return jsonify({"success": False, "message": "Arduino not connected"}), 500
+    request_card_queue(force=True)
+    return jsonify({"success": True}), 202
+
+
+@app.route("/admin/profiling")
+@admin_required
+def admin_profiling():
+    return jsonify({
+        "sample_rate": app.config['PROFILE_SAMPLE_RATE'],
+        "interval": app.config['PROFILE_INTERVAL'],
+        "profiles": profiling.store.summaries()
+    })
+
+
+@app.route("/admin/profiling/config", methods=["POST"])
+@admin_required
+def admin_profiling_config():
+    data = request.get_json(force=True)
+    try:
+        rate = float(data.get("sample_rate", app.config['PROFILE_SAMPLE_RATE']))
+        interval = float(data.get("interval", app.config['PROFILE_INTERVAL']))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "sample_rate and interval must be numbers"}), 400
+    app.config['PROFILE_SAMPLE_RATE'] = max(0.0, min(1.0, rate))
+    app.config['PROFILE_INTERVAL'] = max(0.0005, interval)
+    return jsonify({"success": True, "sample_rate": app.config['PROFILE_SAMPLE_RATE'], "interval": app.config['PROFILE_INTERVAL']})
+
+
+@app.route("/admin/profiling/window", methods=["POST"])
+@admin_required
+def admin_profiling_window():
+    """Sample every thread (request workers, serial reader, ...) for a window of seconds"""
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = max(1.0, min(PROFILE_WINDOW_MAX, float(data.get("seconds", 10))))
+        interval = max(0.001, float(data.get("interval", 0.005)))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "seconds and interval must be numbers"}), 400
+    profile_id = profiling.profile_window(seconds, interval)
+    return jsonify({"success": True, "id": profile_id, "seconds": seconds}), 202
+
+
+@app.route("/admin/profiling/<int:profile_id>")
+@admin_required
+def admin_profiling_result(profile_id):
+    """Collapsed stacks for one profile (feed to flamegraph.pl or speedscope)"""
+    profile = profiling.store.get(profile_id)
+    if not profile:
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+    summary = profiling.summarize(profile)
+    if summary["running"]:
+        return jsonify(summary), 202
+    return Response(profile["sampler"].collapsed(), mimetype="text/plain")
+
 
 @app.route("/admin/create_customer", methods=["POST"])
 @admin_required
@@ -469,46 +1502,197 @@ def create_customer():
         "created_by": session.get("user"),
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
+    reindex_rfid(username, None, rfid)
     
     # Save to CSV
     save_customers_to_csv()
     
     return jsonify({"success": True, "message": "Customer account created successfully"})
 
+
+# Admin bulk operations. Every item is validated against a working copy first;
+# if all pass, the copy is committed under state_lock in one step and the
+# device gets a single coalesced RESV/CAP/RFID burst.
+def bulk_release(work, rfids, item):
+    spot = work.get(item)
+    if spot is None:
+        return f"Unknown spot {item}"
+    if not spot.get("reserved_by"):
+        return f"Spot {item} is not reserved"
+    clear_reservation(spot)
+
+
+def bulk_reassign(work, rfids, item):
+    if not isinstance(item, dict):
+        return "Each move needs a spot and a target spot and/or user"
+    spot = work.get(item.get("spot"))
+    if spot is None or not spot.get("reserved_by"):
+        return f"Spot {item.get('spot')} is not reserved"
+    if "user" in item:
+        if item["user"] not in CUSTOMERS:
+            return f"Unknown customer {item['user']}"
+        # One reservation per customer, counting moves made earlier in this batch
+        if any(other is not spot and other.get("reserved_by") == item["user"] for other in work.values()):
+            return f"Customer {item['user']} already holds a reservation"
+        spot["reserved_by"] = item["user"]
+    if "to" in item and item["to"] != spot["id"]:
+        target = work.get(item["to"])
+        if target is None:
+            return f"Unknown spot {item['to']}"
+        if target.get("reserved_by"):
+            return f"Spot {item['to']} is already reserved"
+        for key in RESERVATION_FIELDS:
+            target[key] = spot.get(key)
+        target["assigned_slot"] = target["id"]
+        clear_reservation(spot)
+
+
+def bulk_change_rfid(work, rfids, item):
+    if not isinstance(item, dict):
+        return "Each change needs an email and an rfid"
+    email = item.get("email")
+    rfid = str(item.get("rfid", "")).strip()
+    if email not in CUSTOMERS:
+        return f"Unknown customer {email}"
+    if not rfid:
+        return f"RFID for {email} is empty"
+    clean = rfid.replace(" ", "")
+    if any(other != email and code.replace(" ", "") == clean for other, code in rfids.items()):
+        return f"RFID {rfid} already belongs to another customer"
+    rfids[email] = rfid
+
+
+def run_admin_batch(event, items, apply_item):
+    """Validate and apply `items` all-or-nothing; returns a Flask response"""
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "Provide a non-empty list"}), 400
+    with state_lock:
+        work = {s["id"]: dict(s) for s in spots}
+        rfids = {email: c.get("rfid", "") for email, c in CUSTOMERS.items()}
+        for i, item in enumerate(items):
+            error = apply_item(work, rfids, item)
+            if error:
+                return jsonify({"success": False, "message": error, "index": i}), 400
+        held_before = {s["assigned_slot"] for s in spots if s.get("assigned_slot") and not s.get("arrived")}
+        held_after = {s["assigned_slot"] for s in work.values() if s.get("assigned_slot") and not s.get("arrived")}
+        changed = [s["id"] for s in spots if work[s["id"]] != s]
+        for s in spots:
+            s.update(work[s["id"]])
+        # Keep the card pool in step: freed reserved cards go back, newly held ones come out
+        for card in held_before - held_after:
+            if card_pool.state_of(card - 1) == CARD_RESERVED:
+                card_pool.push_returned(card - 1)
+        for card in held_after - held_before:
+            card_pool.remove(card - 1, state=CARD_RESERVED)
+        rfid_changed = [email for email, code in rfids.items() if CUSTOMERS[email].get("rfid", "") != code]
+        for email in rfid_changed:
+            reindex_rfid(email, CUSTOMERS[email].get("rfid"), rfids[email])
+            CUSTOMERS[email]["rfid"] = rfids[email]
+        if changed:
+            record_state_change(event, spot_ids=changed, cards=True)
+    if rfid_changed:
+        save_customers_to_csv()
+    if changed:
+        promote_waitlist()
+        notify_spots_changed()
+    synced = sync_device_state()
+    log_event("admin.bulk", op=event, items=len(items), spots=changed, synced=synced)
+    return jsonify({"success": True, "applied": len(items), "changed_spots": changed,
+                    "changed_customers": len(rfid_changed), "synced": synced})
+
+
+@app.route("/admin/spots/release", methods=["POST"])
+@admin_required
+def admin_bulk_release():
+    """Release many reservations at once: {"spots": [1, 3]}"""
+    data = request.get_json(force=True)
+    return run_admin_batch("bulk_release", data.get("spots"), bulk_release)
+
+
+@app.route("/admin/spots/reassign", methods=["POST"])
+@admin_required
+def admin_bulk_reassign():
+    """Move reservations and/or hand them to other customers:
+    {"moves": [{"spot": 1, "to": 3}, {"spot": 2, "user": "a@b.com"}]}"""
+    data = request.get_json(force=True)
+    return run_admin_batch("bulk_reassign", data.get("moves"), bulk_reassign)
+
+
+@app.route("/admin/customers/rfid", methods=["POST"])
+@admin_required
+def admin_bulk_rfid():
+    """Change many customers' RFID codes: {"changes": [{"email": ..., "rfid": ...}]}"""
+    data = request.get_json(force=True)
+    return run_admin_batch("bulk_rfid", data.get("changes"), bulk_change_rfid)
+
+def issue_verification_code(email):
+    """Generate, store and persist a fresh verification code for `email`"""
+    code = generate_verification_code()
+    VERIFICATION_CODES[email] = {
+        "code": code,
+        "timestamp": time.time()
+    }
+    
+    # Save verification code to CSV
+    save_verification_codes_to_csv()
+    return code
+
+
+def prepare_verification(email, resend=False):
+    """Validate a (re)send request. Returns (page, None) when a page should be
+    rendered right away, or (None, code) when `code` must be emailed first."""
+    if resend:
+        if not email or email not in CUSTOMERS:
+            return ("verify_email.html", {"email": email, "error": "Invalid email address"}), None
+        
+        if CUSTOMERS[email]["password"] is not None:
+            return ("verify_email.html", {"email": email, "error": "Password already set for this account"}), None
+        
+        # Generate new verification code
+        return None, issue_verification_code(email)
+
+    if not email:
+        return ("create_password.html", {"error": "Email is required"}), None
+    
+    if email not in CUSTOMERS:
+        return ("create_password.html", {"error": "Account not found. Please contact admin."}), None
+    
+    if CUSTOMERS[email]["password"] is not None:
+        return ("create_password.html", {"error": "Password already set for this account"}), None
+    
+    # Check if verification code already exists and is still valid
+    if email in VERIFICATION_CODES:
+        stored_data = VERIFICATION_CODES[email]
+        # If code is still valid (less than 10 minutes old), don't send new email
+        if time.time() - stored_data["timestamp"] < 600:  # 10 minutes
+            return ("verify_email.html", {"email": email, "message": "Verification code already sent. Please check your email."}), None
+    
+    # Generate and send verification code only if no valid code exists
+    return None, issue_verification_code(email)
+
+
+def verification_sent_page(email, sent, resend=False):
+    """Page to show once the verification email was (or failed to be) sent"""
+    if resend:
+        if sent:
+            return "verify_email.html", {"email": email, "message": "New verification code sent successfully!"}
+        return "verify_email.html", {"email": email, "error": "Failed to send verification email"}
+    if sent:
+        return "verify_email.html", {"email": email}
+    return "create_password.html", {"error": "Failed to send verification email"}
+
+
 @app.route("/create_password", methods=["GET", "POST"])
+@rate_limit("email", user_key=form_email, resources=("smtp", "disk"), template="create_password.html")
 def create_password():
     if request.method == "POST":
         email = request.form.get("email", "").strip()
-        if not email:
-            return render_template("create_password.html", error="Email is required")
-        
-        if email not in CUSTOMERS:
-            return render_template("create_password.html", error="Account not found. Please contact admin.")
-        
-        if CUSTOMERS[email]["password"] is not None:
-            return render_template("create_password.html", error="Password already set for this account")
-        
-        # Check if verification code already exists and is still valid
-        if email in VERIFICATION_CODES:
-            stored_data = VERIFICATION_CODES[email]
-            # If code is still valid (less than 10 minutes old), don't send new email
-            if time.time() - stored_data["timestamp"] < 600:  # 10 minutes
-                return render_template("verify_email.html", email=email, message="Verification code already sent. Please check your email.")
+        page, code = prepare_verification(email)
+        if page:
+            return render_template(page[0], **page[1])
         
-        # Generate and send verification code only if no valid code exists
-        code = generate_verification_code()
-        VERIFICATION_CODES[email] = {
-            "code": code,
-            "timestamp": time.time()
-        }
-        
-        # Save verification code to CSV
-        save_verification_codes_to_csv()
-        
-        if send_verification_email(email, code):
-            return render_template("verify_email.html", email=email)
-        else:
-            return render_template("create_password.html", error="Failed to send verification email")
+        template, context = verification_sent_page(email, send_verification_email(email, code))
+        return render_template(template, **context)
     
     return render_template("create_password.html")
 
@@ -575,8 +1759,11 @@ def set_password():
     if len(password) < 6:
         return render_template("set_password.html", email=email, error="Password must be at least 6 characters long")
     
-    # Set password for customer
-    CUSTOMERS[email]["password"] = password
+    # Set password for customer (only its salted hash is kept)
+    try:
+        CUSTOMERS[email]["password"] = credentials.verifier.hash(password)
+    except credentials.Busy:
+        return render_template("set_password.html", email=email, error="Server is busy. Please try again in a moment.")
     
     # Remove from pending accounts if it exists
     if email in PENDING_ACCOUNTS:
@@ -589,34 +1776,33 @@ def set_password():
     return render_template("password_success.html")
 
 @app.route("/resend_verification", methods=["POST"])
+@rate_limit("email", user_key=form_email, resources=("smtp", "disk"), template="verify_email.html")
 def resend_verification():
     email = request.form.get("email", "").strip()
+    page, code = prepare_verification(email, resend=True)
+    if page:
+        return render_template(page[0], **page[1])
     
-    if not email or email not in CUSTOMERS:
-        return render_template("verify_email.html", email=email, error="Invalid email address")
-    
-    if CUSTOMERS[email]["password"] is not None:
-        return render_template("verify_email.html", email=email, error="Password already set for this account")
-    
-    # Generate new verification code
-    code = generate_verification_code()
-    VERIFICATION_CODES[email] = {
-        "code": code,
-        "timestamp": time.time()
-    }
-    
-    # Save verification code to CSV
-    save_verification_codes_to_csv()
-    
-    if send_verification_email(email, code):
-        return render_template("verify_email.html", email=email, message="New verification code sent successfully!")
-    else:
-        return render_template("verify_email.html", email=email, error="Failed to send verification email")
+    template, context = verification_sent_page(email, send_verification_email(email, code), resend=True)
+    return render_template(template, **context)
 
 
 # Static assets (serve images from templates folder for simplicity)
+# Fingerprinted names are content-addressed, so they can be cached forever.
+ASSET_MANIFEST = AssetManifest(os.path.join(app.root_path, "templates")).build()
+
+
+@app.url_defaults
+def fingerprint_asset_urls(endpoint, values):
+    if endpoint == "assets" and "filename" in values:
+        values["filename"] = ASSET_MANIFEST.url_name(values["filename"])
+
+
 @app.route("/assets/<path:filename>")
 def assets(filename):
+    resp = ASSET_MANIFEST.response(filename, request)
+    if resp is not None:
+        return resp
     return send_from_directory("templates", filename)
 
 
@@ -626,11 +1812,9 @@ def index():
     return render_template("index.html")
 
 
-@app.route("/api/spots")
-@login_required
-def api_spots():
-    current_user = session.get("user")
-    return jsonify({
+def spots_payload(current_user):
+    """Per-user view of the lot for /api/spots and the live stream"""
+    return {
         "spots": [
             {
                 "id": s["id"],
@@ -639,23 +1823,138 @@ def api_spots():
                 "reserved_at": s["reserved_at"],
                 "arrival_ts": s.get("arrival_ts")
             } for s in spots
-        ]
-    })
+        ],
+        "waitlist_position": waitlist.position(current_user)
+    }
 
 
-@app.route("/api/reserve", methods=["POST"])
+@app.route("/api/spots")
 @login_required
-def api_reserve():
+def api_spots():
+    current_user = session.get("user")
+    return jsonify(spots_payload(current_user))
+
+
+@app.route("/api/spots/stream")
+@login_required
+def api_spots_stream():
+    """Server-sent events: push the lot whenever it changes (heartbeat every 15s)"""
+    global open_streams
+    current_user = session.get("user")
+    with open_streams_lock:
+        if open_streams >= app.config['STREAM_MAX']:
+            # 204 tells EventSource not to reconnect; the page falls back to polling
+            return "", 204
+        open_streams += 1
+
+    released = threading.Event()
+
+    def release():
+        # Runs from the generator and from response close; Werkzeug skips the latter when the client resets
+        global open_streams
+        with open_streams_lock:
+            if not released.is_set():
+                released.set()
+                open_streams -= 1
+
+    def events():
+        seen = -1
+        try:
+            while not shutting_down.is_set():
+                with spots_changed:
+                    # Checked under the condition so a shutdown notified just before we wait is not missed
+                    if seen == spots_version and not shutting_down.is_set():
+                        spots_changed.wait(timeout=15)
+                    version = spots_version
+                if shutting_down.is_set():
+                    return
+                if version == seen:
+                    yield ": keep-alive\n\n"
+                    continue
+                seen = version
+                yield f"data: {json.dumps(spots_payload(current_user))}\n\n"
+        finally:
+            release()
+
+    response = Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    response.call_on_close(release)
+    return response
+
+
+def reserved_spot_id(user):
+    return next((s["id"] for s in spots if s.get("reserved_by") == user), None)
+
+
+def reserve_spot(current_user, arrival_ts):
+    """Apply the reservation policy for one user; returns (body, status, reserved_now)"""
+    with state_lock:
+        body, status, reserved = apply_reservation_policy(current_user, arrival_ts)
+        if reserved:
+            left_waitlist = waitlist.leave(current_user)
+            record_state_change("reserve", spot_ids=(reserved_spot_id(current_user),), cards=True,
+                                waitlist_users=(current_user,) if left_waitlist else ())
+        if status != 400:
+            if reserved:
+                notify_spots_changed()
+            return body, status, reserved
+        # Lot is full: queue the user instead of making them retry
+        position = waitlist.join(current_user, arrival_ts)
+        record_state_change("waitlist_join", waitlist_users=(current_user,))
+    notify_spots_changed()
+    return {
+        "success": False, "waitlisted": True, "position": position,
+        "message": f"{body['message'].rstrip('.')}. You are #{position} on the waitlist and will be notified when a spot frees up."
+    }, 202, False
+
+
+WAITLIST_SUBJECT = 'Parking System - A Spot Is Ready For You'
+
+
+def send_waitlist_email(email, spot_id):
+    """Tell a waitlisted customer their reservation went through (runs off the reader thread)"""
+    with app.app_context():
+        try:
+            msg = Message(WAITLIST_SUBJECT, sender=app.config['MAIL_USERNAME'], recipients=[email])
+            msg.body = f'A spot freed up and has been reserved for you (spot {spot_id}).\n\nPlease arrive on time.'
+            mail.send(msg)
+        except Exception as e:
+            log_event("email.error", email=email, error=str(e))
+
+
+def promote_waitlist():
+    """Reserve freed spots for the head of the waitlist; returns the promoted users"""
+    promoted = []
+    with state_lock:
+        while waitlist and any(not s.get("reserved_by") for s in spots):
+            user, arrival_ts, joined_at = waitlist.pop_next()
+            body, status, reserved = apply_reservation_policy(user, arrival_ts)
+            if status == 400:
+                # Spot free but no card to give: keep their place and try again next time
+                waitlist.join(user, arrival_ts, joined_at)
+                break
+            if reserved:
+                promoted.append(user)
+            record_state_change("waitlist_promote", waitlist_users=(user,), cards=reserved,
+                                spot_ids=(reserved_spot_id(user),) if reserved else ())
+    if promoted:
+        notify_spots_changed()
+    for user in promoted:
+        spot_id = reserved_spot_id(user)
+        log_event("waitlist.promoted", user=user, spot=spot_id)
+        if user in CUSTOMERS:
+            threading.Thread(target=send_waitlist_email, args=(user, spot_id), daemon=True).start()
+    return promoted
+
+
+def apply_reservation_policy(current_user, arrival_ts):
+    # Caller holds state_lock, journals the change and notifies listeners
     # Auto-assign next card in queue (same as Arduino round-robin behavior)
-    data = request.get_json(force=True)
-    arrival_ts = float(data.get("arrival_ts", 0))
     now = time.time()
-    current_user = session.get("user")
 
     # If user already holds a reservation, return success idempotently
     mine = next((s for s in spots if s.get("reserved_by") == current_user), None)
     if mine:
-        return jsonify({"success": True})
+        return {"success": True}, 200, False
 
     # TIME-BASED RESERVATION POLICY: 1-hour rule
     is_advance_reservation = False
@@ -668,10 +1967,10 @@ def api_reserve():
             # For last-minute reservations, check if parking is full
             available_spots = sum(1 for s in spots if not s.get("reserved_by"))
             if available_spots == 0:
-                return jsonify({
+                return {
                     "success": False, 
                     "message": "Reservation rejected: Less than 1 hour notice and parking is full. Please book at least 1 hour in advance."
-                }), 400
+                }, 400, False
         else:
             # This is an advance reservation (more than 1 hour ahead)
             is_advance_reservation = True
@@ -681,7 +1980,7 @@ def api_reserve():
     
     # For advance reservations, allow even if no cards currently available
     if next_card == -1 and not is_advance_reservation:
-        return jsonify({"success": False, "message": "No available cards"}), 400
+        return {"success": False, "message": "No available cards"}, 400, False
     
     # For advance reservations with no cards, assign to next available spot
     if next_card == -1 and is_advance_reservation:
@@ -693,7 +1992,7 @@ def api_reserve():
                 break
         
         if next_card == -1:
-            return jsonify({"success": False, "message": "No available spots for advance reservation"}), 400
+            return {"success": False, "message": "No available spots for advance reservation"}, 400, False
 
     # Assign the next card in queue to the user
     spot = spots[next_card]  # next_card is 0-based, spots are 1-based
@@ -701,15 +2000,115 @@ def api_reserve():
     spot["reserved_at"] = now
     spot["arrival_ts"] = arrival_ts if arrival_ts > 0 else None
     spot["assigned_slot"] = next_card + 1  # Store the assigned card number (1-based)
+    return {"success": True}, 200, True
+
 
-    # Send commands with delays
+@app.route("/api/reserve", methods=["POST"])
+@login_required
+@idempotent("reserve")
+@rate_limit("reserve", resources=("serial",))
+def api_reserve():
+    try:
+        arrival_ts = requested_arrival_ts(parse_json_body(request.get_data()))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    body, status, reserved = reserve_spot(session.get("user"), arrival_ts)
+    # Never acknowledge a reservation (or waitlist place) that is not on disk yet
+    state_journal.flush()
+    if not reserved:
+        return jsonify(body), status
+
+    # Send commands with delays (acknowledged firmware needs no pacing)
     push_reservations_to_arduino()
-    time.sleep(0.2)  # Wait 200ms between commands
+    legacy_pacing(0.2)  # Wait 200ms between commands
     push_rfid_data_to_arduino()
-    time.sleep(0.1)
+    legacy_pacing(0.1)
     
     # Enforce holds will be called in background read loop
     
+    return jsonify(body), status
+
+
+BATCH_RESERVE_MAX = 200
+
+
+def batch_item_arrival(item):
+    """Arrival timestamp for a batch item: arrival_ts, or the start of arrival_window [start, end]"""
+    window = item.get("arrival_window")
+    if window:
+        return float(window[0])
+    return float(item.get("arrival_ts", 0) or 0)
+
+
+@app.route("/admin/reservations/batch", methods=["POST"])
+@admin_required
+def admin_batch_reserve():
+    """Reserve for many customers at once, then sync the device once.
+
+    {"mode": "all_or_nothing" | "best_effort",
+     "reservations": [{"customer": email, "arrival_ts": ts} | {"customer": email, "arrival_window": [start, end]}]}
+    """
+    data = request.get_json(force=True)
+    mode = data.get("mode", "all_or_nothing")
+    items = data.get("reservations")
+    if mode not in ("all_or_nothing", "best_effort"):
+        return jsonify({"success": False, "message": "mode must be all_or_nothing or best_effort"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "Provide a non-empty reservations list"}), 400
+    if len(items) > BATCH_RESERVE_MAX:
+        return jsonify({"success": False, "message": f"At most {BATCH_RESERVE_MAX} reservations per batch"}), 400
+
+    results = []
+    with state_lock:
+        saved_spots = [dict(s) for s in spots]
+        saved_cards = card_pool.dump()
+        for item in items:
+            customer = item.get("customer") if isinstance(item, dict) else None
+            if customer not in CUSTOMERS:
+                results.append({"customer": customer, "status": "failed", "message": "Unknown customer"})
+                continue
+            try:
+                arrival_ts = batch_item_arrival(item)
+            except (TypeError, ValueError, IndexError):
+                results.append({"customer": customer, "status": "failed", "message": "Invalid arrival time"})
+                continue
+            body, status, reserved = apply_reservation_policy(customer, arrival_ts)
+            if status != 200:
+                results.append({"customer": customer, "status": "failed", "message": body.get("message")})
+            else:
+                results.append({"customer": customer, "status": "reserved" if reserved else "already_reserved",
+                                "spot": reserved_spot_id(customer)})
+        failed = any(r["status"] == "failed" for r in results)
+        if failed and mode == "all_or_nothing":
+            # Nothing was journaled or announced yet; put memory back as it was
+            for s, saved in zip(spots, saved_spots):
+                s.update(saved)
+            card_pool.load(saved_cards)
+            for r in results:
+                if r["status"] != "failed":
+                    r.update(status="rolled_back", spot=None)
+            return jsonify({"success": False, "message": "No reservations were made", "results": results}), 409
+        booked = [r["customer"] for r in results if r["status"] == "reserved"]
+        left = [user for user in booked if waitlist.leave(user)]
+        if booked:
+            record_state_change("batch_reserve", spot_ids=[r["spot"] for r in results if r["status"] == "reserved"],
+                                cards=True, waitlist_users=left)
+    if booked:
+        state_journal.flush()
+        notify_spots_changed()
+    synced = sync_device_state() if booked else False
+    log_event("admin.batch_reserve", mode=mode, items=len(items), reserved=len(booked))
+    return jsonify({"success": not failed, "reserved": len(booked), "synced": synced, "results": results})
+
+
+@app.route("/api/waitlist/leave", methods=["POST"])
+@login_required
+def api_waitlist_leave():
+    user = session.get("user")
+    if not waitlist.leave(user):
+        return jsonify({"success": False, "message": "You are not on the waitlist"}), 404
+    record_state_change("waitlist_leave", waitlist_users=(user,))
+    notify_spots_changed()
     return jsonify({"success": True})
 
 
@@ -720,20 +2119,47 @@ def api_cancel():
     return jsonify({"success": False, "message": "Cancellation is not allowed after reserving."}), 400
 
 
+def compose_resv_line():
+    """Build the RESV overlay line for the current spots"""
+    codes = []
+    for s in spots:
+        codes.append('O')
+    return "RESV:" + ",".join(codes) + "\n"
+
+
+def compose_cap_line(hold_count):
+    """Build the CAP line, clamping the hold count to the device's range"""
+    try:
+        hold_count = max(0, min(4, int(hold_count)))
+    except Exception:
+        hold_count = 0
+    return f"CAP:{hold_count}\n"
+
+
+def compose_rfid_line():
+    """Build the VIP RFID whitelist line (rfid:email pairs for reserved customers)"""
+    reserved = [s.get("reserved_by") for s in spots if s.get("reserved_by")]
+    rfid_pairs = []
+    for email in dict.fromkeys(reserved):
+        customer = CUSTOMERS.get(email)
+        if customer and customer.get("rfid") and customer.get("password"):
+            # Format: rfid:email (remove any spaces from RFID)
+            rfid_clean = customer['rfid'].replace(" ", "")
+            rfid_pairs.append(f"{rfid_clean}:{email}")
+    return "RFID:" + ",".join(rfid_pairs) + "\n"
+
+
 def push_reservations_to_arduino():
     global arduino_serial, spots, last_resv_line
     if not (arduino_serial and arduino_serial.is_open):
-        print("Arduino not connected - cannot send RESV command")
+        log_event("serial.send_failed", description="RESV command", error="not connected")
         return
     
     # Compose RESV overlay
-    codes = []
-    for s in spots:
-        codes.append('O')
-    line = "RESV:" + ",".join(codes) + "\n"
+    line = compose_resv_line()
     
     if line != last_resv_line:
-        print(f"Sending RESV command: {line.strip()}")
+        log_event("serial.push", command=line.strip())
         if send_command_to_arduino(line, "RESV command"):
             last_resv_line = line
 
@@ -743,14 +2169,9 @@ def push_capacity_hold_to_arduino(hold_count: int):
     if not (arduino_serial and arduino_serial.is_open):
         return
     
-    try:
-        hold_count = max(0, min(4, int(hold_count)))
-    except Exception:
-        hold_count = 0
-    
-    line = f"CAP:{hold_count}\n"
+    line = compose_cap_line(hold_count)
     if line != last_cap_sent:
-        print(f"Sending CAP command: {line.strip()}")
+        log_event("serial.push", command=line.strip())
         if send_command_to_arduino(line, "CAP command"):
             last_cap_sent = line
 
@@ -761,153 +2182,268 @@ def push_rfid_data_to_arduino():
         return
     
     # Get all RFID codes from customers with reservations
-    rfid_pairs = []
-    for email, customer in CUSTOMERS.items():
-        if customer.get("rfid") and customer.get("password"):
-            # Check if this customer has a reservation
-            for spot in spots:
-                if spot.get("reserved_by") == email:
-                    # Format: rfid:email (remove any spaces from RFID)
-                    rfid_clean = customer['rfid'].replace(" ", "")
-                    rfid_pairs.append(f"{rfid_clean}:{email}")
-                    break
-    
-    if rfid_pairs:
-        rfid_data = ",".join(rfid_pairs)
-        line = f"RFID:{rfid_data}\n"
-        print(f"Sending VIP RFID data: {line.strip()}")
+    line = compose_rfid_line()
+    
+    if line != "RFID:\n":
+        log_event("serial.push", command=line.strip())
         send_command_to_arduino(line, "VIP RFID data")
     else:
         # Send empty RFID list to clear Arduino
-        line = "RFID:\n"
-        print("Sending empty VIP RFID data to clear Arduino")
+        log_event("serial.push", command=line.strip())
         send_command_to_arduino(line, "Empty VIP RFID data")
 
 
+def sync_device_state():
+    """Push RESV, CAP and RFID as one burst: one pipelined window, or one write on legacy firmware"""
+    global last_resv_line, last_cap_sent
+    if not (arduino_serial and arduino_serial.is_open):
+        return False
+    resv_line = compose_resv_line()
+    cap_line = compose_cap_line(count_capacity_holds())
+    lines = [line for line, sent in ((resv_line, last_resv_line), (cap_line, last_cap_sent)) if line != sent]
+    lines.append(compose_rfid_line())
+    log_event("serial.push", description="Bulk state sync", lines=len(lines))
+    if send_command_to_arduino("".join(lines), "Bulk state sync"):
+        last_resv_line = resv_line
+        last_cap_sent = cap_line
+        return True
+    return False
+
+
 def start_timer_on_arduino(spot_id: int):
     global arduino_serial
     if not (arduino_serial and arduino_serial.is_open):
         return
     cmd = f"START:{spot_id}\n"
     try:
-        arduino_serial.write(cmd.encode())
+        with serial_write_lock:
+            arduino_serial.write(cmd.encode())
     except Exception:
         pass
 
 
-@app.route("/api/rfid_scan", methods=["POST"])
-def api_rfid_scan():
-    """Handle RFID card scanning for gate opening and card dispensing"""
-    global arduino_serial, spots
-    data = request.get_json(force=True)
-    rfid_code = data.get("rfid", "").strip().replace(" ", "")  # Remove spaces
-    
+def find_customer_by_rfid(rfid_code):
+    """Return the customer record whose RFID matches (spaces ignored), or None"""
+    email = RFID_INDEX.get(rfid_code.replace(" ", ""))
+    customer = CUSTOMERS.get(email) if email else None
+    if customer is None:
+        return None
+    customer["email"] = email
+    return customer
+
+
+def resolve_rfid_arrival(rfid_code):
+    """Look up the customer and reserved spot for a gate scan; returns (customer, spot, error)"""
     if not rfid_code:
-        return jsonify({"success": False, "message": "RFID code is required"}), 400
+        return None, None, ({"success": False, "message": "RFID code is required"}, 400)
     
     # Find customer by RFID code (compare without spaces)
-    customer = None
-    for email, customer_data in CUSTOMERS.items():
-        customer_rfid = customer_data.get("rfid", "").replace(" ", "")
-        if customer_rfid == rfid_code:
-            customer = customer_data
-            customer["email"] = email
-            break
+    with span("customer_lookup"):
+        customer = find_customer_by_rfid(rfid_code)
     
     if not customer:
-        return jsonify({"success": False, "message": "RFID card not recognized"}), 404
+        return None, None, ({"success": False, "message": "RFID card not recognized"}, 404)
     
     # Check if customer has a password set
     if not customer.get("password"):
-        return jsonify({"success": False, "message": "Account not activated. Please complete account setup first."}), 403
+        return None, None, ({"success": False, "message": "Account not activated. Please complete account setup first."}, 403)
     
     # Find the customer's reserved spot
     spot = None
-    for s in spots:
-        if s.get("reserved_by") == customer["email"]:
-            spot = s
-            break
+    with span("spot_lookup"):
+        for s in spots:
+            if s.get("reserved_by") == customer["email"]:
+                spot = s
+                break
     
     if not spot:
-        return jsonify({"success": False, "message": "No reservation found for this RFID card"}), 404
+        return None, None, ({"success": False, "message": "No reservation found for this RFID card"}, 404)
+    return customer, spot, None
+
+
+def resolve_imhere_spot(current_user, spot_id):
+    """Find the spot an I'm-here request refers to; returns (spot, error)"""
+    # If no id provided, infer the user's reserved spot
+    spot = None
+    if spot_id:
+        spot = next((s for s in spots if s["id"] == spot_id), None)
+    else:
+        # Find the user's own reserved spot
+        spot = next((s for s in spots if s.get("reserved_by") == current_user), None)
+    if not spot:
+        return None, ({"success": False, "message": "No reserved spot found"}, 404)
+    if spot.get("reserved_by") != current_user:
+        return None, ({"success": False, "message": "Not your reservation"}, 403)
+    return spot, None
+
+
+def mark_spot_arrived(spot):
+    """Record the driver's arrival and return the HERE command for the device"""
+    # Mark user as arrived (they've been assigned a card); under the lock so bulk admin edits never interleave
+    with state_lock:
+        spot["arrived"] = True
+        spot["arrival_ts"] = time.time()  # Mark actual arrival time
+        record_state_change("arrive", spot_ids=(spot["id"],))
+    notify_spots_changed()
+    publish_gate_event("spot_assigned", spot=spot["id"], trace_id=tracing.current_id())
+    
+    # Use HERE command for reserved users
+    cmd = f"HERE:{spot['id']}\n"
+    log_event("gate.here", spot=spot["id"], user=spot.get("reserved_by"), trace=tracing.current_id())
+    return cmd
+
+
+def send_here_command(cmd):
+    """Send HERE for an arrival, then update capacity holds; False if the device did not take it"""
+    if ack_protocol:
+        # Legacy firmware's DISP does not say which command it answers, so only acknowledged HERE waits for it
+        tracing.device_sent()
+    if not send_command_to_arduino(cmd, "HERE command"):
+        tracing.device_cancelled()
+        return False
+    # Immediately update capacity holds since user has arrived
+    with span("legacy_pacing"):
+        legacy_pacing(0.1)
+    with span("enforce_holds"):
+        enforce_holds()
+    return True
+
+
+def log_slow_gate(trace):
+    """Warn with the stage breakdown whenever a gate trace misses the latency SLO"""
+    if trace.name != "gate" or trace.total_ms <= app.config['GATE_SLO_MS']:
+        return
+    stages = {}
+    for name, _, duration in trace.spans:
+        stages[name] = round(stages.get(name, 0) + duration, 3)
+    log_event("gate.slow", trace=trace.trace_id, total_ms=trace.total_ms, device=trace.attrs.get("device"), stages=stages)
+
+
+tracing.sink.listeners.append(log_slow_gate)
+
+
+def rfid_welcome(customer):
+    return {
+        "success": True, 
+        "message": f"Welcome {customer['name']}! Gate opening and card dispensing...",
+        "customer_name": f"{customer['name']} {customer['surname']}"
+    }
+
+
+@app.route("/api/rfid_scan", methods=["POST"])
+@traced("gate")
+@idempotent("arrival", user_key=scanned_rfid)
+@rate_limit("arrival", user_key=scanned_rfid, resources=("serial",))
+def api_rfid_scan():
+    """Handle RFID card scanning for gate opening and card dispensing"""
+    try:
+        rfid_code = scan_rfid_code(parse_json_body(request.get_data()))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    body, status = gate_scan(rfid_code)
+    return jsonify(body), status
+
+
+@app.route("/ws/kiosk")
+def kiosk_socket_unavailable():
+    """The kiosk WebSocket needs the asyncio gateway; say so instead of a bare 404"""
+    return jsonify({"success": False, "message": "Kiosk sockets are served by the asyncio gateway "
+                                                 "(uvicorn gateway:asgi_app)"}), 426
+
+
+def gate_scan(rfid_code):
+    """Open the gate and dispense a card for a scanned RFID; returns (body, status)"""
+    customer, spot, error = resolve_rfid_arrival(rfid_code)
+    if error:
+        return error
     
     if not (arduino_serial and arduino_serial.is_open):
-        return jsonify({"success": False, "message": "Arduino not connected"}), 500
+        return {"success": False, "message": "Arduino not connected"}, 500
 
     try:
-        # Mark user as arrived (they've been assigned a card)
-        spot["arrived"] = True
-        spot["arrival_ts"] = time.time()  # Mark actual arrival time
-        
-        # Use HERE command for reserved users
-        cmd = f"HERE:{spot['id']}\n"
-        print(f"Sending HERE command: {cmd.strip()}")
+        with span("mark_arrived"):
+            cmd = mark_spot_arrived(spot)
         
-        if send_command_to_arduino(cmd, "HERE command"):
-            # Immediately update capacity holds since user has arrived
-            time.sleep(0.1)
-            enforce_holds()
-            
-            return jsonify({
-                "success": True, 
-                "message": f"Welcome {customer['name']}! Gate opening and card dispensing...",
-                "customer_name": f"{customer['name']} {customer['surname']}"
-            })
+        if send_here_command(cmd):
+            return rfid_welcome(customer), 200
         else:
-            return jsonify({"success": False, "message": "Failed to send command"}), 500
+            return {"success": False, "message": "Failed to send command"}, 500
             
     except Exception as e:
-        print(f"Error sending HERE command: {e}")
-        return jsonify({"success": False, "message": str(e)}), 500
+        log_event("serial.send_failed", description="HERE command", error=str(e))
+        return {"success": False, "message": str(e)}, 500
+
+
+def kiosk_scan(kiosk_name, rfid_code, trace_id=None):
+    """A scan sent over a kiosk socket: the same limits, tracing and gate logic as POST /api/rfid_scan.
+
+    Returns (body, status, trace_id). Runs on a worker thread, never on the event loop.
+    """
+    rejected = ratelimit.check_limits(app.config, "arrival", rfid_code or None, f"kiosk:{kiosk_name}")
+    slots = ratelimit.resource_slots
+    if rejected is None and slots is not None and slots.acquire(("serial",)):
+        rejected = ("Server is busy. Please try again shortly.", 1)
+    if rejected is not None:
+        message, retry_after = rejected
+        return {"success": False, "message": message, "retry_after": retry_after}, 429, None
+    try:
+        return traced_gate_scan(kiosk_name, rfid_code, trace_id)
+    finally:
+        if slots is not None:
+            slots.release(("serial",))
+
+
+def traced_gate_scan(kiosk_name, rfid_code, trace_id):
+    trace = tracing.Trace("gate", trace_id)
+    trace.attrs["kiosk"] = kiosk_name
+    token = tracing.current.set(trace)
+    try:
+        body, status = gate_scan(rfid_code)
+    finally:
+        tracing.current.reset(token)
+    trace.attrs["status"] = status
+    tracing.sink.end_request(trace)
+    return body, status, trace.trace_id
 
 @app.route("/api/imhere", methods=["POST"])
+@traced("gate")
 @login_required
+@idempotent("arrival")
+@rate_limit("arrival", resources=("serial",))
 def api_im_here():
     """Legacy I'm here endpoint - kept for backward compatibility"""
     global arduino_serial, spots
-    data = request.get_json(force=True)
-    spot_id = int(data.get("id", 0)) if data.get("id") is not None else 0
+    try:
+        spot_id = requested_spot_id(parse_json_body(request.get_data()))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     current_user = session.get("user")
 
-    # If no id provided, infer the user's reserved spot
-    spot = None
-    if spot_id:
-        spot = next((s for s in spots if s["id"] == spot_id), None)
-    else:
-        # Find the user's own reserved spot
-        spot = next((s for s in spots if s.get("reserved_by") == current_user), None)
-    if not spot:
-        return jsonify({"success": False, "message": "No reserved spot found"}), 404
-    if spot.get("reserved_by") != current_user:
-        return jsonify({"success": False, "message": "Not your reservation"}), 403
+    spot, error = resolve_imhere_spot(current_user, spot_id)
+    if error:
+        return jsonify(error[0]), error[1]
 
     if not (arduino_serial and arduino_serial.is_open):
         return jsonify({"success": False, "message": "Arduino not connected"}), 500
 
     try:
-        # Mark user as arrived (they've been assigned a card)
-        spot["arrived"] = True
-        spot["arrival_ts"] = time.time()  # Mark actual arrival time
+        with span("mark_arrived"):
+            cmd = mark_spot_arrived(spot)
         
-        # Use HERE command for reserved users
-        cmd = f"HERE:{spot['id']}\n"
-        print(f"Sending HERE command: {cmd.strip()}")
-        
-        if send_command_to_arduino(cmd, "HERE command"):
-            # Immediately update capacity holds since user has arrived
-            time.sleep(0.1)
-            enforce_holds()
+        if send_here_command(cmd):
             return jsonify({"success": True})
         else:
             return jsonify({"success": False, "message": "Failed to send command"}), 500
             
     except Exception as e:
-        print(f"Error sending HERE command: {e}")
+        log_event("serial.send_failed", description="HERE command", error=str(e))
         return jsonify({"success": False, "message": str(e)}), 500
 
 
 if __name__ == "__main__":
+    # Development server; use serve.py in production. PARKING_DEBUG=1 enables the debugger.
     # Connect to Arduino in the serving process (no reloader)
     ok, msg = connect_arduino()
     print(f"Arduino: {msg}")
-    app.run(debug=True, host="0.0.0.0", port=5000, use_reloader=False)
+    start_customer_watcher()
+    app.run(debug=os.environ.get("PARKING_DEBUG") == "1", host="0.0.0.0", port=5000, use_reloader=False)
@@ -64,6 +64,15 @@ bool counting[4] = {false, false, false, false};
 unsigned long startTime[4] = {0, 0, 0, 0};
 int paymentDue[4] = {0, 0, 0, 0};
 int coinsInserted[4] = {0, 0, 0, 0};
+unsigned long sessionSeconds[4] = {0, 0, 0, 0}; // parked duration of the session being paid
+
+// SLOTS reporting, tuned by the host with RATE:intervalMs,ALL|CHANGE,keyframeMs
+unsigned long slotsIntervalMs = 0;      // 0 = every loop (default until the host says otherwise)
+bool slotsChangeOnly = false;
+unsigned long slotsKeyframeMs = 10000;  // full report even without changes
+unsigned long lastSlotsReport = 0;
+unsigned long lastSlotsKeyframe = 0;
+char lastSlotsReported[4] = {0, 0, 0, 0};
 int currentPayingIndex = -1;
 char slotStatus[4] = {'O', 'O', 'O', 'O'};
 bool oledAvailable = false;
@@ -103,6 +112,37 @@ ServoState currentServoState = SERVO_IDLE;
 unsigned long servoStateStartTime = 0;
 int pendingCardDispense = -1;
 
+// ============================
+// Acknowledged host commands
+// ============================
+// "@<seq>:<CMD>" is applied once and answered "ACK:<seq>" or "NAK:<seq>".
+// Recent sequence numbers are remembered so a host retry is re-acknowledged
+// without being applied twice (e.g. a second HERE dispensing another card).
+#define SEEN_SEQ_SLOTS 8
+long seenSeq[SEEN_SEQ_SLOTS] = {-1, -1, -1, -1, -1, -1, -1, -1};
+bool seenSeqOk[SEEN_SEQ_SLOTS];
+int seenSeqNext = 0;
+bool commandOk = true;
+long activeSeq = -1;  // sequence number of the host command being applied, -1 outside one
+
+int findSeenSeq(long seq) {
+  for (int k = 0; k < SEEN_SEQ_SLOTS; k++) {
+    if (seenSeq[k] == seq) return k;
+  }
+  return -1;
+}
+
+void rememberSeq(long seq, bool ok) {
+  seenSeq[seenSeqNext] = seq;
+  seenSeqOk[seenSeqNext] = ok;
+  seenSeqNext = (seenSeqNext + 1) % SEEN_SEQ_SLOTS;
+}
+
+void sendAck(long seq, bool ok) {
+  Serial.print(ok ? F("ACK:") : F("NAK:"));
+  Serial.println(seq);
+}
+
 int popNextCardFromQueue() {
   if (queueSize == 0) return -1;
   int idx = availableQueue[queueHead];
@@ -215,6 +255,16 @@ void updateServoStateMachine() {
         
         int idx = pendingCardDispense;
         if (idx != -1) {
+          // PAID:n,amountDue,amountInserted,seconds feeds the host's billing ledger
+          Serial.print(F("PAID:"));
+          Serial.print(idx + 1);
+          Serial.print(',');
+          Serial.print(paymentDue[idx]);
+          Serial.print(',');
+          Serial.print(coinsInserted[idx] * 5);
+          Serial.print(',');
+          Serial.println(sessionSeconds[idx]);
+
           awaitingPayment[idx] = false;
           paymentDue[idx] = 0;
           coinsInserted[idx] = 0;
@@ -224,9 +274,7 @@ void updateServoStateMachine() {
           
           // Clear walk-in flag
           isWalkInCustomer[idx] = false;
-
-          Serial.print(F("PAID:"));
-          Serial.println(idx + 1);
+          sessionSeconds[idx] = 0;
 
           for (int i = 0; i < numCards; i++) {
             if (awaitingPayment[i]) {
@@ -254,22 +302,56 @@ void updateServoStateMachine() {
 // ============================
 // Start card dispense sequence
 // ============================
-void startCardDispense(int cardIndex) {
+bool startCardDispense(int cardIndex) {
   if (currentServoState != SERVO_IDLE) {
     Serial.println(F("Servo busy, cannot dispense"));
-    return;
+    return false;
   }
   
   Serial.print(F("Dispensed Card "));
   Serial.println(cardIndex + 1);
   
+  // DISP:<card>@<seq> when a host command (HERE) asked for it, so the host can
+  // tell it from walk-in and VIP-card dispenses, which print plain DISP:<card>
   Serial.print(F("DISP:"));
-  Serial.println(cardIndex + 1);
+  Serial.print(cardIndex + 1);
+  if (activeSeq >= 0) {
+    Serial.print('@');
+    Serial.print(activeSeq);
+  }
+  Serial.println();
   
   currentServoState = DISPENSER_ACTIVE;
   servoStateStartTime = millis();
   dispenserServo.write(90);
   Serial.println(F("Dispensing card..."));
+  return true;
+}
+
+// ============================
+// SLOTS Reporting
+// ============================
+void reportSlots() {
+  unsigned long now = millis();
+  if (now - lastSlotsReport < slotsIntervalMs) return;
+
+  bool changed = memcmp(slotStatus, lastSlotsReported, 4) != 0;
+  bool keyframeDue = (now - lastSlotsKeyframe) >= slotsKeyframeMs;
+  if (slotsChangeOnly && !changed && !keyframeDue) return;
+
+  Serial.print(F("SLOTS:"));
+  Serial.print(slotStatus[0]);
+  Serial.print(",");
+  Serial.print(slotStatus[1]);
+  Serial.print(",");
+  Serial.print(slotStatus[2]);
+  Serial.print(",");
+  Serial.println(slotStatus[3]);
+  Serial.flush();
+
+  memcpy(lastSlotsReported, slotStatus, 4);
+  lastSlotsReport = now;
+  if (keyframeDue || !slotsChangeOnly) lastSlotsKeyframe = now;
 }
 
 // ============================
@@ -280,6 +362,21 @@ void readHostCommands() {
     String line = Serial.readStringUntil('\n');
     line.trim();
     
+    long seq = -1;
+    if (line.startsWith("@")) {
+      int colon = line.indexOf(':');
+      if (colon < 2) continue;
+      seq = line.substring(1, colon).toInt();
+      line = line.substring(colon + 1);
+      int seen = findSeenSeq(seq);
+      if (seen != -1) {
+        sendAck(seq, seenSeqOk[seen]);
+        continue;
+      }
+    }
+    commandOk = true;
+    activeSeq = seq;
+    
     if (line.startsWith("RESV:")) {
       String payload = line.substring(5);
       Serial.print(F("Received RESV: "));
@@ -328,14 +425,21 @@ void readHostCommands() {
       Serial.println();
     } 
     else if (line.startsWith("START:")) {
+      // START:n or START:n,elapsedSeconds (host replays running timers after a reset)
       String idxStr = line.substring(6);
       idxStr.trim();
+      unsigned long elapsedMs = 0;
+      int comma = idxStr.indexOf(',');
+      if (comma != -1) {
+        elapsedMs = (unsigned long)idxStr.substring(comma + 1).toInt() * 1000UL;
+        idxStr = idxStr.substring(0, comma);
+      }
       int oneBased = idxStr.toInt();
       if (oneBased >= 1 && oneBased <= 4) {
         int i = oneBased - 1;
         if (!counting[i] && !awaitingPayment[i]) {
           counting[i] = true;
-          startTime[i] = millis();
+          startTime[i] = millis() - elapsedMs;
           removeCardFromQueueIfPresent(i);
           Serial.print(F("Started timer for Card "));
           Serial.println(i + 1);
@@ -353,6 +457,7 @@ void readHostCommands() {
         int allowedAvailable = queueSize - capacityHold;
         if (allowedAvailable <= 0) {
           Serial.println(F("No available card/slot (capacity held) for reserved user."));
+          commandOk = false;
         } else {
           int nextCard = -1;
           for (int attempt = 0; attempt < queueSize; attempt++) {
@@ -378,11 +483,14 @@ void readHostCommands() {
             Serial.print(nextCard + 1);
             Serial.println(F(" to reserved user"));
             
-            startCardDispense(nextCard);
+            commandOk = startCardDispense(nextCard);
           } else {
             Serial.println(F("No available card/slot for reserved user"));
+            commandOk = false;
           }
         }
+      } else {
+        commandOk = false;
       }
     } 
     else if (line.startsWith("CAP:")) {
@@ -448,6 +556,46 @@ void readHostCommands() {
       Serial.print(numReservedRFIDs);
       Serial.println(F(" VIP RFID cards"));
     }
+    else if (line == "QUEUE?") {
+      // Card queue report for host reconciliation: QUEUE:3,4,1 (1-based, head first)
+      Serial.print(F("QUEUE:"));
+      for (int k = 0; k < queueSize; k++) {
+        if (k > 0) Serial.print(',');
+        Serial.print(availableQueue[(queueHead + k) % 4] + 1);
+      }
+      Serial.println();
+    }
+    else if (line.startsWith("RATE:")) {
+      // RATE:intervalMs,ALL|CHANGE,keyframeMs
+      String payload = line.substring(5);
+      int c1 = payload.indexOf(',');
+      int c2 = payload.indexOf(',', c1 + 1);
+      if (c1 == -1 || c2 == -1) {
+        commandOk = false;
+      } else {
+        slotsIntervalMs = payload.substring(0, c1).toInt();
+        slotsChangeOnly = payload.substring(c1 + 1, c2) == "CHANGE";
+        slotsKeyframeMs = payload.substring(c2 + 1).toInt();
+        lastSlotsKeyframe = millis() - slotsKeyframeMs;  // next report is a full keyframe
+      }
+    }
+    else if (line.startsWith("PING:")) {
+      // Link heartbeat: echo straight back so the host can time the round trip
+      Serial.print(F("PONG:"));
+      Serial.println(line.substring(5));
+    }
+    else if (line == "PROTO") {
+      // Capability probe: acknowledging it enables the host's pipelined mode
+    }
+    else {
+      commandOk = false;
+    }
+    
+    activeSeq = -1;
+    if (seq >= 0) {
+      rememberSeq(seq, commandOk);
+      sendAck(seq, commandOk);
+    }
   }
 }
 
@@ -615,6 +763,7 @@ void handleVIPRFIDScan(String rfid) {
       counting[assignedSlot] = false;
 
       paymentDue[assignedSlot] = ((totalTime + 4) / 5) * 5;
+      sessionSeconds[assignedSlot] = totalTime;
       coinsInserted[assignedSlot] = 0;
       awaitingPayment[assignedSlot] = true;
 
@@ -728,15 +877,7 @@ void loop() {
   updateOLED();
   updateLCD();
 
-  Serial.print(F("SLOTS:"));
-  Serial.print(slotStatus[0]);
-  Serial.print(",");
-  Serial.print(slotStatus[1]);
-  Serial.print(",");
-  Serial.print(slotStatus[2]);
-  Serial.print(",");
-  Serial.println(slotStatus[3]);
-  Serial.flush();
+  reportSlots();
 
   // ENTRY BUTTON with debounce
   if (digitalRead(BUTTON_PIN) == LOW && (millis() - lastButtonPress) > DEBOUNCE_DELAY) {
@@ -805,6 +946,7 @@ void loop() {
           counting[cardIndex] = false;
 
           paymentDue[cardIndex] = ((totalTime + 4) / 5) * 5;
+          sessionSeconds[cardIndex] = totalTime;
           coinsInserted[cardIndex] = 0;
           awaitingPayment[cardIndex] = true;
 
@@ -0,0 +1,102 @@
+"""Fingerprinted, precompressed static assets.
+
+Files under the asset root are hashed by content at startup.
+``url_for('assets', filename='images/car.png')`` is rewritten to
+``images/car.<hash>.png``, and that name is served with an immutable,
+year-long cache header. Text assets are gzip- (and, when the optional
+``brotli`` package is installed, brotli-) compressed once up front.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+from flask import Response
+
+ASSET_EXTENSIONS = {".css", ".js", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp", ".woff", ".woff2"}
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt"}
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+HASH_LENGTH = 12
+MIN_COMPRESS_SIZE = 256  # smaller bodies are not worth an encoding header
+
+
+class Asset:
+    __slots__ = ("logical", "fingerprinted", "digest", "mimetype", "body", "gzip", "brotli")
+
+    def __init__(self, logical, fingerprinted, digest, mimetype, body):
+        self.logical = logical
+        self.fingerprinted = fingerprinted
+        self.digest = digest
+        self.mimetype = mimetype
+        self.body = body
+        self.gzip = None
+        self.brotli = None
+
+
+class AssetManifest:
+    """Maps logical asset paths to content-hashed names and holds their encodings"""
+
+    def __init__(self, root):
+        self.root = root
+        self.by_logical = {}
+        self.by_fingerprint = {}
+
+    def build(self):
+        """Scan the asset root, fingerprint every asset and precompress text files"""
+        by_logical = {}
+        by_fingerprint = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in ASSET_EXTENSIONS:
+                    continue
+                path = os.path.join(dirpath, name)
+                logical = os.path.relpath(path, self.root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+                fingerprinted = logical[: -len(name)] + f"{stem}.{digest}{ext}"
+                mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                asset = Asset(logical, fingerprinted, digest, mimetype, body)
+                if ext.lower() in COMPRESSIBLE_EXTENSIONS and len(body) >= MIN_COMPRESS_SIZE:
+                    asset.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+                    if brotli is not None:
+                        asset.brotli = brotli.compress(body, quality=11)
+                by_logical[logical] = asset
+                by_fingerprint[fingerprinted] = asset
+        # Swap in whole maps so concurrent readers never see a half-built manifest
+        self.by_logical = by_logical
+        self.by_fingerprint = by_fingerprint
+        return self
+
+    def url_name(self, filename):
+        """Return the fingerprinted name for a logical path (unchanged if unknown)"""
+        asset = self.by_logical.get(filename)
+        return asset.fingerprinted if asset else filename
+
+    def response(self, filename, request):
+        """Build a long-cache response for a fingerprinted name, or None if not one"""
+        asset = self.by_fingerprint.get(filename)
+        if asset is None:
+            return None
+
+        accepted = request.accept_encodings
+        body, encoding = asset.body, None
+        if asset.brotli is not None and accepted["br"]:
+            body, encoding = asset.brotli, "br"
+        elif asset.gzip is not None and accepted["gzip"]:
+            body, encoding = asset.gzip, "gzip"
+
+        resp = Response(body, mimetype=asset.mimetype)
+        resp.headers["Cache-Control"] = IMMUTABLE_CACHE
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        if asset.gzip is not None:
+            resp.headers["Vary"] = "Accept-Encoding"
+        resp.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+        return resp.make_conditional(request)
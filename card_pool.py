@@ -0,0 +1,116 @@
+"""Parking-card inventory: an ordered hash set of cards waiting in the dispenser.
+
+Mirrors the firmware's round-robin ``availableQueue``. Pop takes the head,
+push appends a returned card and remove drops a card anywhere, all in O(1).
+Each card also has an explicit state:
+
+* ``in_dispenser`` - queued, never handed out since startup/reconciliation
+* ``returned``     - queued again after a completed (PAID) session
+* ``reserved``     - taken out of the queue for a web reservation
+* ``issued``       - physically dispensed to a driver (DISP)
+
+The device's queue is the source of truth for what is physically in the
+dispenser. ``reconcile`` realigns the mirror with a ``QUEUE:`` report.
+"""
+import threading
+from collections import OrderedDict
+
+IN_DISPENSER = "in_dispenser"
+RETURNED = "returned"
+RESERVED = "reserved"
+ISSUED = "issued"
+
+
+class CardPool:
+    def __init__(self, card_count):
+        self.card_count = card_count
+        self.queue = OrderedDict((idx, None) for idx in range(card_count))
+        self.states = {idx: IN_DISPENSER for idx in range(card_count)}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, card_idx):
+        return card_idx in self.queue
+
+    def pop_next(self, state=RESERVED):
+        """Take the card at the head of the queue; -1 if the dispenser is empty"""
+        with self.lock:
+            if not self.queue:
+                return -1
+            card_idx, _ = self.queue.popitem(last=False)
+            self.states[card_idx] = state
+            return card_idx
+
+    def push_returned(self, card_idx):
+        """Put a card back at the end of the queue (no-op if it is already queued)"""
+        if not 0 <= card_idx < self.card_count:
+            return
+        with self.lock:
+            if card_idx not in self.queue:
+                self.queue[card_idx] = None
+            self.states[card_idx] = RETURNED
+
+    def remove(self, card_idx, state=ISSUED):
+        """Take a specific card out of the queue, wherever it is"""
+        if not 0 <= card_idx < self.card_count:
+            return
+        with self.lock:
+            self.queue.pop(card_idx, None)
+            self.states[card_idx] = state
+
+    def state_of(self, card_idx):
+        with self.lock:
+            return self.states.get(card_idx)
+
+    def order(self):
+        with self.lock:
+            return list(self.queue)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "queue": [idx + 1 for idx in self.queue],
+                "states": {idx + 1: state for idx, state in self.states.items()},
+            }
+
+    def dump(self):
+        """JSON-ready state (0-based) for persistence"""
+        with self.lock:
+            return {"queue": list(self.queue), "states": {str(idx): s for idx, s in self.states.items()}}
+
+    def load(self, data):
+        """Restore state written by dump()"""
+        with self.lock:
+            self.queue = OrderedDict((idx, None) for idx in data["queue"] if 0 <= idx < self.card_count)
+            for key, state in data["states"].items():
+                if 0 <= int(key) < self.card_count:
+                    self.states[int(key)] = state
+
+    def reconcile(self, device_queue):
+        """Realign with the device's reported queue (0-based card indices, in order).
+
+        Cards the host holds for reservations are in the device's queue (the
+        firmware does not know about them) and stay reserved. Returns a dict
+        describing the drift that was corrected; empty if none.
+        """
+        with self.lock:
+            expected = [idx for idx in device_queue
+                        if 0 <= idx < self.card_count and self.states.get(idx) != RESERVED]
+            before = list(self.queue)
+            if expected == before:
+                return {}
+            added = [idx for idx in expected if idx not in self.queue]
+            missing = [idx for idx in before if idx not in set(expected)]
+            self.queue = OrderedDict((idx, None) for idx in expected)
+            for idx in added:
+                self.states[idx] = RETURNED
+            for idx in missing:
+                self.states[idx] = ISSUED
+            return {
+                "before": [idx + 1 for idx in before],
+                "after": [idx + 1 for idx in expected],
+                "added": [idx + 1 for idx in added],
+                "removed": [idx + 1 for idx in missing],
+            }
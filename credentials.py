@@ -0,0 +1,178 @@
+"""Password hashing and verification for admin and customer logins.
+
+Passwords are stored as salted scrypt hashes (memory-hard, in the standard
+library), encoded as ``scrypt$<n>$<r>$<p>$<salt>$<hash>``. Hashing takes
+tens of milliseconds of CPU on purpose. It therefore runs on a small
+bounded worker pool rather than on the request thread, and when too many
+logins are already queued the caller is told to retry instead of piling
+up. hashlib.scrypt releases the GIL, so the pool hashes in parallel
+without slowing the rest of the app.
+
+A stored hash whose cost parameters differ from the current ones is
+rehashed after the next successful login. So is a legacy plaintext value
+from before hashing. Successful verifications are remembered for a few
+minutes, keyed by a per-process HMAC of the user, password and stored
+hash, so repeated logins from the same client skip the hash. A password
+change produces a new stored hash and so misses the cache.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 32
+DEFAULT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}  # ~16 MiB and ~50 ms per hash
+
+
+class Busy(Exception):
+    """Too many verifications are queued (or one timed out); answer 503 and let the client retry"""
+
+
+def b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def hash_password(password, params=DEFAULT_PARAMS):
+    """Salted scrypt hash of `password`, with its parameters, as one string"""
+    salt = os.urandom(SALT_BYTES)
+    digest = scrypt(password, salt, params)
+    return f"{SCHEME}${params['n']}${params['r']}${params['p']}${b64(salt)}${b64(digest)}"
+
+
+def scrypt(password, salt, params):
+    n, r, p = params["n"], params["r"], params["p"]
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def parse(stored):
+    """(params, salt, digest) of a stored hash, or None for a legacy plaintext value"""
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        params = {"n": int(parts[1]), "r": int(parts[2]), "p": int(parts[3])}
+        return params, unb64(parts[4]), unb64(parts[5])
+    except ValueError:
+        return None
+
+
+def check(stored, password, params=DEFAULT_PARAMS):
+    """(ok, replacement): replacement is a fresh hash when `stored` is plaintext or uses other parameters"""
+    parsed = parse(stored)
+    if parsed is None:
+        # Plaintext from before hashing: compare in constant time, then upgrade
+        ok = hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        return ok, hash_password(password, params) if ok else None
+    stored_params, salt, digest = parsed
+    ok = hmac.compare_digest(scrypt(password, salt, stored_params), digest)
+    if ok and stored_params != params:
+        return ok, hash_password(password, params)
+    return ok, None
+
+
+class VerifiedCache:
+    """Short-lived memory of successful verifications, keyed by an HMAC that never leaves the process"""
+
+    def __init__(self, ttl=300, max_keys=10000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.secret = os.urandom(32)
+        self.entries = OrderedDict()  # key -> expiry; insertion order == expiry order
+        self.lock = threading.Lock()
+
+    def key(self, user, stored, password):
+        message = "\0".join((user, stored, password)).encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).digest()
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest_key, expires = next(iter(self.entries.items()))
+                if expires > now:
+                    break
+                del self.entries[oldest_key]
+            return key in self.entries
+
+    def add(self, key):
+        with self.lock:
+            self.entries[key] = time.monotonic() + self.ttl
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Verifier:
+    def __init__(self, workers=2, max_pending=32, params=DEFAULT_PARAMS, cache_ttl=300, timeout=10.0):
+        self.params = dict(params)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="credentials")
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.cache = VerifiedCache(cache_ttl)
+        self.timeout = timeout
+        # Unknown users are checked against this, so they take as long as known ones
+        self.dummy = hash_password(os.urandom(8).hex(), self.params)
+
+    def run(self, fn, *args):
+        """fn(*args) on the pool, waiting for the result; Busy when the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            raise Busy()
+        try:
+            future = self.pool.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise Busy() from None
+
+    def hash(self, password):
+        """Hash a new password on the pool (blocks the caller, not other requests)"""
+        return self.run(hash_password, password, self.params)
+
+    def verify(self, user, stored, password):
+        """(ok, replacement) for a login; `stored` None means no such user or no password yet"""
+        if not stored:
+            self.run(check, self.dummy, password, self.params)
+            return False, None
+        key = self.cache.key(user, stored, password)
+        if self.cache.hit(key):
+            return True, None
+        ok, replacement = self.run(check, stored, password, self.params)
+        if ok:
+            self.cache.add(self.cache.key(user, replacement or stored, password))
+        return ok, replacement
+
+
+verifier = None
+
+
+def init_app(app):
+    """Create the verifier from app.config['PASSWORD_HASH_*'] / ['CREDENTIAL_*']"""
+    global verifier
+    params = {
+        "n": app.config.get("PASSWORD_HASH_N", DEFAULT_PARAMS["n"]),
+        "r": app.config.get("PASSWORD_HASH_R", DEFAULT_PARAMS["r"]),
+        "p": app.config.get("PASSWORD_HASH_P", DEFAULT_PARAMS["p"]),
+    }
+    verifier = Verifier(
+        workers=app.config.get("CREDENTIAL_WORKERS", 2),
+        max_pending=app.config.get("CREDENTIAL_MAX_PENDING", 32),
+        params=params,
+        cache_ttl=app.config.get("CREDENTIAL_CACHE_TTL", 300),
+    )
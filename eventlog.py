@@ -0,0 +1,152 @@
+"""Structured, non-blocking event logging (JSON lines).
+
+``log_event("serial.send", command="CAP:1")`` costs a level check, an
+optional sampling draw and a ``put_nowait`` on a bounded queue. A
+background listener thread does the JSON encoding, redaction and the
+actual write, so a slow journald or pipe never stalls request threads or
+the serial reader. When the queue is full, events are dropped and
+counted rather than blocking.
+
+Emails are masked to ``j***@example.com``. RFID values are masked to
+their last two characters. RFID whitelist commands are reduced to an
+entry count.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+
+LOGGER_NAME = "parking"
+QUEUE_SIZE = 10000
+
+# Per-event-type level; anything not listed logs at INFO
+EVENT_LEVELS = {
+    "serial.send": logging.DEBUG,
+    "serial.ack": logging.DEBUG,
+    "serial.push": logging.DEBUG,
+    "serial.send_failed": logging.WARNING,
+    "serial.link": logging.WARNING,
+    "gate.here": logging.INFO,
+    "gate.slow": logging.WARNING,
+    "email.error": logging.ERROR,
+    "csv.error": logging.ERROR,
+    "watch.error": logging.ERROR,
+    "kiosk.rejected": logging.WARNING,
+    "kiosk.push_failed": logging.WARNING,
+    "server.shed": logging.WARNING,
+    "watch.fallback": logging.WARNING,
+    "journal.error": logging.ERROR,
+}
+
+# Per-event-type sampling probability (1.0 = keep all); warnings and errors are never sampled
+EVENT_SAMPLE_RATES = {
+    "serial.send": 1.0,
+    "serial.ack": 1.0,
+    "serial.push": 1.0,
+}
+
+REDACT_FIELDS = {"email", "user", "customer", "rfid", "reserved_by"}
+EMAIL_RE = re.compile(r"([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})")
+RFID_LINE_RE = re.compile(r"RFID:([^\n]*)")
+
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+dropped_events = 0
+listener = None
+
+
+def mask_email(value):
+    return EMAIL_RE.sub(r"\1***@\2", value)
+
+
+def mask_rfid(value):
+    value = value.replace(" ", "")
+    return "*" * max(0, len(value) - 2) + value[-2:]
+
+
+def mask_rfid_line(match):
+    entries = [p for p in match.group(1).strip().split(",") if p]
+    return f"RFID:<{len(entries)} entries>"
+
+
+def redact(key, value):
+    if not isinstance(value, str):
+        return value
+    if key in REDACT_FIELDS:
+        if "@" in value:
+            local, _, domain = value.partition("@")
+            return f"{local[:1]}***@{domain}"
+        return mask_rfid(value)
+    if key == "command" and "RFID:" in value:
+        # Any RFID: line of a command, including inside multi-line RESV/CAP/RFID/START bursts
+        value = RFID_LINE_RE.sub(mask_rfid_line, value)
+    return mask_email(value)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "event": record.msg,
+            "thread": record.threadName,
+        }
+        for key, value in (record.args or {}).items():
+            event[key] = redact(key, value)
+        return json.dumps(event, default=str, separators=(",", ":"))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the raw record; formatting happens on the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global dropped_events
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_events += 1
+
+
+def configure(stream=None, level=logging.INFO, levels=None, sample_rates=None):
+    """Install the queue handler and start the background writer (idempotent)"""
+    global listener
+    if levels:
+        EVENT_LEVELS.update(levels)
+    if sample_rates:
+        EVENT_SAMPLE_RATES.update(sample_rates)
+    logger.setLevel(level)
+    if listener is not None:
+        return
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonLinesFormatter())
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=False)
+    listener.start()
+
+
+def shutdown():
+    """Flush queued events and stop the writer thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def log_event(event, **fields):
+    level = EVENT_LEVELS.get(event, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return
+    rate = EVENT_SAMPLE_RATES.get(event, 1.0)
+    if rate < 1.0 and level < logging.WARNING and random.random() >= rate:
+        return
+    # Fields ride in record.args and are only serialized by the listener
+    record = logger.makeRecord(LOGGER_NAME, level, "", 0, event, None, None)
+    record.args = fields
+    logger.handle(record)
@@ -0,0 +1,66 @@
+"""Streaming CSV and JSON-lines exports.
+
+Rows come from generators and are encoded into chunks of about 64 KiB.
+An export therefore holds one chunk in memory, however many rows it has,
+and the client starts receiving data right away (chunked transfer).
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+CHUNK_BYTES = 64 * 1024
+
+
+def encode_rows(rows, fieldnames, fmt, chunk_bytes=CHUNK_BYTES):
+    """Yield `rows` (dicts) as UTF-8 CSV (with header) or JSON lines, in chunks of ~chunk_bytes"""
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps({key: row.get(key) for key in fieldnames}, separators=(",", ":")))
+            buffer.write("\n")
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def parse_time(value):
+    """Epoch seconds, 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM[:SS]' (local time); None if empty"""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised time {value!r}; use epoch seconds or YYYY-MM-DD[THH:MM]")
+
+
+def parse_flag(value):
+    """'yes'/'no' style query flag; None when absent"""
+    if value in (None, ""):
+        return None
+    lowered = value.lower()
+    if lowered in ("1", "true", "yes"):
+        return True
+    if lowered in ("0", "false", "no"):
+        return False
+    raise ValueError(f"Expected yes or no, got {value!r}")
+
+
+def attachment_name(dataset, fmt):
+    return f"{dataset}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
@@ -0,0 +1,97 @@
+"""Watch one file for changes made by other processes.
+
+With ``inotify_simple`` installed (Linux), the watcher sleeps on inotify
+events for the file's directory. A file replaced by rename, as editors
+and atomic writers do, is still seen. Without it, the watcher polls the
+file's (inode, size, mtime) every ``interval`` seconds. inotify mode also
+checks on that interval, so a missed event only delays a change.
+
+A change is reported once the file has stopped changing for ``settle``
+seconds, so a writer is not caught halfway through. If the callback
+returns False ("not ready, try again"), the same change is offered again
+on the next check.
+"""
+import os
+import threading
+
+try:
+    import inotify_simple
+except ImportError:  # optional dependency
+    inotify_simple = None
+
+from eventlog import log_event
+
+
+class FileWatcher:
+    def __init__(self, path, on_change, interval=2.0, settle=0.3, name="file-watcher"):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.settle = settle
+        self.name = name
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def open_notifier(self):
+        if inotify_simple is None:
+            return None
+        flags = inotify_simple.flags
+        try:
+            notifier = inotify_simple.INotify()
+            notifier.add_watch(os.path.dirname(os.path.abspath(self.path)),
+                               flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+            return notifier
+        except OSError as e:
+            log_event("watch.fallback", path=self.path, error=str(e))
+            return None
+
+    def wait(self, notifier):
+        if notifier is None:
+            self.stopped.wait(self.interval)
+            return
+        # Any event in the directory wakes us; the stat comparison decides whether it was our file
+        notifier.read(timeout=int(self.interval * 1000))
+
+    def run(self):
+        notifier = self.open_notifier()
+        log_event("watch.start", path=self.path, mode="inotify" if notifier else "poll", interval=self.interval)
+        last = self.signature()
+        try:
+            while not self.stopped.is_set():
+                self.wait(notifier)
+                current = self.signature()
+                if current == last or current is None:
+                    continue
+                # Let the writer finish: wait until the file holds still
+                while not self.stopped.wait(self.settle):
+                    settled = self.signature()
+                    if settled == current:
+                        break
+                    current = settled
+                try:
+                    done = self.on_change() is not False
+                except Exception as e:
+                    log_event("watch.error", path=self.path, error=str(e))
+                    done = True
+                if done:
+                    last = current
+        finally:
+            if notifier is not None:
+                notifier.close()
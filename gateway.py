@@ -0,0 +1,766 @@
+"""asyncio gateway: an ASGI front end for the parking app.
+
+Run with any ASGI server, e.g.::
+
+    uvicorn gateway:asgi_app --host 0.0.0.0 --port 5000
+
+The hot routes run natively on the event loop, as does the gate kiosk
+WebSocket (/ws/kiosk, see kiosk.py). /api/spots and the
+/api/spots/stream event feed cost no thread per client. /api/reserve,
+/api/imhere and /api/rfid_scan await the device's acknowledgement
+instead of sleeping. The email-verification POSTs send mail with
+aiosmtplib. Every other route is served by the regular Flask app on a
+small thread pool, so both modes expose the same URLs. ``app.py`` keeps
+working on its own for simple deployments.
+
+Optional dependencies: ``pyserial-asyncio`` for non-blocking serial I/O
+(without it the threaded serial supervisor from app.py is used) and
+``aiosmtplib`` for async SMTP (without it mail is sent on the pool).
+"""
+import asyncio
+import contextvars
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, quote
+
+try:
+    import serial_asyncio
+except ImportError:  # optional dependency
+    serial_asyncio = None
+
+try:
+    import aiosmtplib
+except ImportError:  # optional dependency
+    aiosmtplib = None
+
+from flask import render_template
+
+import app as parking
+import idempotency
+import kiosk
+import ratelimit
+import serial_capture
+import tracing
+from eventlog import log_event
+from tracing import span
+
+WSGI_THREADS = 4           # threads serving the Flask-bridged routes
+STREAM_HEARTBEAT = 15      # seconds between keep-alive comments on idle streams
+TICK_INTERVAL = 0.05       # ACK timeout checks
+HOLDS_INTERVAL = 0.5       # capacity-hold enforcement
+KIOSK_OUTBOX = 100         # messages queued for a slow kiosk before events are dropped
+
+
+class AsyncSerialLink:
+    """pyserial-like facade over an asyncio StreamWriter.
+
+    Installed as ``app.arduino_serial`` so the existing synchronous senders
+    keep working; writes are handed to the event loop and never block.
+    """
+
+    in_waiting = 0
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()  # created on the event loop
+
+    @property
+    def is_open(self):
+        return not self.writer.is_closing()
+
+    def write(self, data):
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class Gateway:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+        # One thread owns every blocking serial call (legacy pacing sleeps, replays)
+        self.serial_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serial")
+        self.loop = None
+        self.changed = None
+        self.tasks = []
+        self.routes = {
+            ("GET", "/api/spots"): self.api_spots,
+            ("GET", "/api/spots/stream"): self.api_spots_stream,
+            ("POST", "/api/reserve"): self.api_reserve,
+            ("POST", "/api/imhere"): self.api_im_here,
+            ("POST", "/api/rfid_scan"): self.api_rfid_scan,
+            ("POST", "/create_password"): self.create_password,
+            ("POST", "/resend_verification"): self.resend_verification,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is None:
+                await self.call_wsgi(scope, receive, send)
+            else:
+                await handler(scope, receive, send)
+        elif scope["type"] == "websocket":
+            if scope["path"] == "/ws/kiosk":
+                await self.kiosk_socket(scope, receive, send)
+            else:
+                await send({"type": "websocket.close", "code": 1008})
+
+    # ---- lifecycle ------------------------------------------------------
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self):
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        parking.spot_listeners.append(self.notify_threadsafe)
+        # Sends made from the serial worker must not wait for their own ACK
+        parking.reader_thread_ident = await self.run_serial(threading.get_ident)
+        parking.start_customer_watcher()
+        if serial_asyncio is not None:
+            self.tasks.append(asyncio.create_task(self.supervise_serial()))
+        else:
+            ok, msg = await self.run_serial(parking.connect_arduino)
+            log_event("serial.link", status="connected" if ok else "connect_failed", detail=msg)
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        parking.stop_arduino_supervisor()
+        if self.notify_threadsafe in parking.spot_listeners:
+            parking.spot_listeners.remove(self.notify_threadsafe)
+        self.serial_worker.shutdown(wait=False)
+        self.wsgi_pool.shutdown(wait=False)
+
+    # Both carry the caller's context along, so spans and trace IDs reach the worker thread
+    def run_serial(self, fn, *args):
+        return self.loop.run_in_executor(self.serial_worker, contextvars.copy_context().run, fn, *args)
+
+    def run_blocking(self, fn, *args):
+        return self.loop.run_in_executor(self.wsgi_pool, contextvars.copy_context().run, fn, *args)
+
+    # ---- spot change fan-out ---------------------------------------------
+
+    def notify_threadsafe(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.bump)
+
+    def bump(self):
+        # Wake everyone waiting on the current event, then arm a fresh one
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    # ---- non-blocking serial link ----------------------------------------
+
+    async def supervise_serial(self):
+        delay = parking.RECONNECT_BACKOFF_INITIAL
+        while True:
+            port = await self.run_serial(parking.find_arduino_port, parking.arduino_port)
+            if port:
+                link = None
+                try:
+                    reader, writer = await serial_asyncio.open_serial_connection(
+                        url=port, baudrate=parking.ARDUINO_BAUDRATE
+                    )
+                    await asyncio.sleep(2)  # Wait for Arduino to reset
+                    link = parking.wrap_capture(AsyncSerialLink(writer, self.loop))
+                    parking.arduino_serial = link
+                    parking.arduino_port = port
+                    parking.link_health.reset()
+                    log_event("serial.link", status="connected", port=port, mode="async")
+                    # Replay once the protocol is known, so acknowledged firmware gets an acknowledged replay
+                    parking.negotiate_ack_protocol(
+                        then=lambda: self.serial_worker.submit(parking.replay_state_to_arduino))
+                    await self.read_serial(reader)
+                    log_event("serial.link", status="lost", mode="async")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log_event("serial.link", status="connect_failed", port=port, error=str(e))
+                finally:
+                    if link is not None and parking.arduino_serial is link:
+                        parking.mark_arduino_disconnected()
+                if link is not None:
+                    delay = parking.RECONNECT_BACKOFF_INITIAL
+                    continue
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, parking.RECONNECT_BACKOFF_MAX)
+
+    async def read_serial(self, reader):
+        ticker = asyncio.create_task(self.serial_ticks())
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    return
+                line = raw.decode(errors="ignore").strip()
+                parking.capture_line(serial_capture.INBOUND, line)
+                if not parking.command_channel.handle_line(line):
+                    self.serial_worker.submit(parking.handle_arduino_line, line)
+        finally:
+            ticker.cancel()
+
+    async def serial_ticks(self):
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            parking.command_channel.check_timeouts()
+            elapsed += TICK_INTERVAL
+            if elapsed >= HOLDS_INTERVAL:
+                elapsed = 0.0
+                self.serial_worker.submit(parking.enforce_holds)
+                self.serial_worker.submit(parking.request_card_queue)
+                self.serial_worker.submit(parking.send_link_ping)
+                self.serial_worker.submit(parking.push_slots_rate)
+                link = parking.arduino_serial
+                if link is not None and parking.link_health.should_reconnect():
+                    log_event("serial.link", status="unresponsive", mode="async")
+                    link.close()  # the reader sees EOF and the supervisor reconnects
+
+    async def send_here(self, cmd):
+        """Send HERE and wait for the device to apply it (or for legacy pacing)"""
+        if parking.ack_protocol:
+            try:
+                future = parking.command_channel.submit(cmd, "HERE command")
+                tracing.annotate(serial_seq=[future.seq])
+                tracing.device_command(future.seq)
+                with span("serial.ack_wait"):
+                    await asyncio.wrap_future(future)
+                return True
+            except Exception as e:
+                log_event("serial.send_failed", description="HERE command", error=str(e))
+                return False
+        with span("serial.send"):
+            return await self.run_serial(parking.send_command_to_arduino, cmd, "HERE command")
+
+    async def push_reservation(self):
+        def push():
+            parking.push_reservations_to_arduino()
+            parking.legacy_pacing(0.2)
+            parking.push_rfid_data_to_arduino()
+        await self.run_serial(push)
+
+    # ---- native routes -----------------------------------------------------
+
+    async def api_spots(self, scope, receive, send):
+        user = self.session_user(scope)
+        if not user:
+            return await self.redirect_to_login(scope, send)
+        await self.send_json(send, parking.spots_payload(user))
+
+    async def api_spots_stream(self, scope, receive, send):
+        user = self.session_user(scope)
+        if not user:
+            return await self.redirect_to_login(scope, send)
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            while not disconnected.done():
+                changed = self.changed
+                payload = json.dumps(parking.spots_payload(user))
+                await send({"type": "http.response.body", "body": f"data: {payload}\n\n".encode(), "more_body": True})
+                while not disconnected.done():
+                    waiter = asyncio.ensure_future(changed.wait())
+                    done, _ = await asyncio.wait(
+                        [waiter, disconnected], timeout=STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    waiter.cancel()
+                    if changed.is_set():
+                        break
+                    if not done:
+                        await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+        finally:
+            disconnected.cancel()
+
+    async def api_reserve(self, scope, receive, send):
+        user = self.session_user(scope)
+        if not user:
+            return await self.redirect_to_login(scope, send)
+        body = await self.read_body(receive)
+        await self.idempotent(scope, send, "reserve", user, body, lambda send: self.reserve(scope, send, user, body))
+
+    async def reserve(self, scope, send, user, raw_body):
+        async with self.admitted(scope, send, "reserve", user, ("serial",)) as ok:
+            if not ok:
+                return
+            try:
+                arrival_ts = parking.requested_arrival_ts(parking.parse_json_body(raw_body))
+            except ValueError as e:
+                return await self.send_json(send, {"success": False, "message": str(e)}, 400)
+            # reserve_spot takes state_lock and writes the journal: keep it off the event loop
+            body, status, reserved = await self.run_blocking(parking.reserve_spot, user, arrival_ts)
+            if reserved:
+                await self.run_blocking(parking.state_journal.flush)
+                await self.push_reservation()
+            await self.send_json(send, body, status)
+
+    async def api_im_here(self, scope, receive, send):
+        user = self.session_user(scope)
+        if not user:
+            return await self.redirect_to_login(scope, send)
+        body = await self.read_body(receive)
+        await self.traced(scope, send, "gate", lambda send: self.idempotent(
+            scope, send, "arrival", user, body, lambda send: self.im_here(scope, send, user, body)))
+
+    async def im_here(self, scope, send, user, raw_body):
+        async with self.admitted(scope, send, "arrival", user, ("serial",)) as ok:
+            if not ok:
+                return
+            try:
+                spot_id = parking.requested_spot_id(parking.parse_json_body(raw_body))
+            except ValueError as e:
+                return await self.send_json(send, {"success": False, "message": str(e)}, 400)
+            spot, error = parking.resolve_imhere_spot(user, spot_id)
+            if error:
+                return await self.send_json(send, *error)
+            await self.arrive(send, spot, {"success": True})
+
+    async def api_rfid_scan(self, scope, receive, send):
+        body = await self.read_body(receive)
+        try:
+            rfid_code = parking.scan_rfid_code(parking.parse_json_body(body))
+        except ValueError as e:
+            message = str(e)
+            return await self.traced(scope, send, "gate", lambda send: self.send_json(
+                send, {"success": False, "message": message}, 400))
+        await self.traced(scope, send, "gate", lambda send: self.idempotent(
+            scope, send, "arrival", rfid_code or None, body, lambda send: self.rfid_scan(scope, send, rfid_code)))
+
+    async def rfid_scan(self, scope, send, rfid_code):
+        async with self.admitted(scope, send, "arrival", rfid_code or None, ("serial",)) as ok:
+            if not ok:
+                return
+            customer, spot, error = parking.resolve_rfid_arrival(rfid_code)
+            if error:
+                return await self.send_json(send, *error)
+            await self.arrive(send, spot, parking.rfid_welcome(customer))
+
+    async def arrive(self, send, spot, success_body):
+        if not (parking.arduino_serial and parking.arduino_serial.is_open):
+            return await self.send_json(send, {"success": False, "message": "Arduino not connected"}, 500)
+        with span("mark_arrived"):
+            cmd = await self.run_blocking(parking.mark_spot_arrived, spot)
+        if parking.ack_protocol:
+            tracing.device_sent()  # legacy DISP lines cannot be matched to a command
+        if await self.send_here(cmd):
+            self.serial_worker.submit(parking.enforce_holds)
+            await self.send_json(send, success_body)
+        else:
+            tracing.device_cancelled()
+            await self.send_json(send, {"success": False, "message": "Failed to send command"}, 500)
+
+    async def kiosk_socket(self, scope, receive, send):
+        """Gate kiosk WebSocket: scans in, scan results and gate events out (see kiosk.py)"""
+        if (await receive())["type"] != "websocket.connect":
+            return
+        presented = kiosk.presented_token(self.header(scope, b"authorization"),
+                                          scope.get("query_string", b"").decode("latin-1"))
+        name = kiosk.authenticate(self.flask_app.config.get("KIOSK_TOKENS", {}), presented)
+        if name is None:
+            log_event("kiosk.rejected", ip=self.client_ip(scope))
+            return await send({"type": "websocket.close", "code": 4401})
+        await send({"type": "websocket.accept"})
+        outbox = asyncio.Queue(maxsize=KIOSK_OUTBOX)
+        connection = kiosk.Connection(name, lambda text: self.loop.call_soon_threadsafe(
+            self.enqueue_kiosk, outbox, name, text))
+        kiosk.hub.register(connection)
+        writer = asyncio.ensure_future(self.kiosk_writer(send, outbox))
+        replies = set()
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                raw = message.get("text") or (message.get("bytes") or b"").decode("utf-8", "replace")
+                # Answer each message on its own task so a slow scan never holds up a ping
+                reply = asyncio.ensure_future(self.kiosk_reply(connection, raw))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+        finally:
+            kiosk.hub.unregister(connection)
+            for reply in replies:
+                reply.cancel()
+            writer.cancel()
+
+    async def kiosk_reply(self, connection, raw):
+        reply = await self.run_blocking(kiosk.handle_message, connection.name, raw, parking.kiosk_scan)
+        connection.send(reply)
+
+    @staticmethod
+    def enqueue_kiosk(outbox, name, text):
+        try:
+            outbox.put_nowait(text)
+        except asyncio.QueueFull:
+            log_event("kiosk.push_failed", kiosk=name, error="outbox full")
+
+    @staticmethod
+    async def kiosk_writer(send, outbox):
+        try:
+            while True:
+                await send({"type": "websocket.send", "text": await outbox.get()})
+        except Exception:
+            pass  # the connection is gone; the receive loop sees the disconnect
+
+    async def create_password(self, scope, receive, send):
+        await self.verification(scope, receive, send, resend=False)
+
+    async def resend_verification(self, scope, receive, send):
+        await self.verification(scope, receive, send, resend=True)
+
+    async def verification(self, scope, receive, send, resend):
+        form = parse_qs((await self.read_body(receive)).decode())
+        email = form.get("email", [""])[0].strip()
+        template = "verify_email.html" if resend else "create_password.html"
+        async with self.admitted(scope, send, "email", email.lower() or None, ("smtp", "disk"), template, email) as ok:
+            if not ok:
+                return
+            # Code generation rewrites a CSV, so it stays off the event loop
+            page, code = await self.run_blocking(parking.prepare_verification, email, resend)
+            if page is None:
+                sent = await self.send_verification_email(email, code)
+                page = parking.verification_sent_page(email, sent, resend)
+            await self.send_html(send, self.render(*page))
+
+    async def send_verification_email(self, email, code):
+        if aiosmtplib is None:
+            return await self.run_blocking(parking.send_verification_email, email, code)
+        config = self.flask_app.config
+        msg = EmailMessage()
+        msg["Subject"] = parking.VERIFICATION_SUBJECT
+        msg["From"] = config["MAIL_USERNAME"]
+        msg["To"] = email
+        msg.set_content(parking.verification_email_body(code))
+        try:
+            await aiosmtplib.send(
+                msg,
+                hostname=config["MAIL_SERVER"],
+                port=config["MAIL_PORT"],
+                start_tls=config["MAIL_USE_TLS"],
+                username=config["MAIL_USERNAME"],
+                password=config["MAIL_PASSWORD"],
+            )
+            return True
+        except Exception as e:
+            log_event("email.error", email=email, error=str(e))
+            return False
+
+    # ---- helpers -------------------------------------------------------------
+
+    async def traced(self, scope, send, name, handler):
+        """Run `handler(send)` as a trace; the response carries X-Trace-Id"""
+        if tracing.sink is None:
+            return await handler(send)
+        trace = tracing.Trace(name, self.header(scope, tracing.TRACE_HEADER.lower().encode()))
+        token = tracing.current.set(trace)
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                headers = [*message.get("headers", []), (tracing.TRACE_HEADER.lower().encode(), trace.trace_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+        try:
+            await handler(traced_send)
+        finally:
+            tracing.current.reset(token)
+            trace.attrs.setdefault("status", 500)  # the handler raised before responding
+            tracing.sink.end_request(trace)
+
+    async def idempotent(self, scope, send, idem_scope, user, body, handler):
+        """Run `handler(send)` once per Idempotency-Key; repeats get the stored response"""
+        key = self.header(scope, b"idempotency-key")
+        if not key or idempotency.cache is None:
+            return await handler(send)
+        rejected = idempotency.invalid_key(key)
+        if rejected:
+            return await self.send_stored(send, rejected)
+        cache_key = (idem_scope, user, key)
+        request_fingerprint = idempotency.fingerprint(body)
+        entry, first = idempotency.cache.start(cache_key, request_fingerprint)
+        if not first:
+            if entry.done.is_set():
+                stored = idempotency.repeat_response(entry, request_fingerprint, timeout=0)
+            else:
+                # The original is still running: wait for it off the event loop
+                stored = await self.run_blocking(idempotency.repeat_response, entry, request_fingerprint)
+            return await self.send_stored(send, stored, replayed=stored is entry.response)
+        recorder = _ResponseRecorder(send)
+        try:
+            await handler(recorder)
+        finally:
+            idempotency.cache.finish(cache_key, entry, recorder.stored())
+
+    @staticmethod
+    async def send_stored(send, stored, replayed=False):
+        headers = [(b"content-type", stored.content_type.encode("latin-1")),
+                   (b"content-length", str(len(stored.body)).encode())]
+        if replayed:
+            headers.append((idempotency.REPLAY_HEADER.lower().encode(), b"true"))
+        await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+        await send({"type": "http.response.body", "body": stored.body})
+
+    def admitted(self, scope, send, limit_scope, user, resources, template=None, email=""):
+        return _Admission(self, scope, send, limit_scope, user, resources, template, email)
+
+    def session_user(self, scope):
+        """Read the user from Flask's signed session cookie"""
+        cookie_name = self.flask_app.config["SESSION_COOKIE_NAME"]
+        raw = self.header(scope, b"cookie")
+        if not raw:
+            return None
+        jar = SimpleCookie()
+        try:
+            jar.load(raw)
+        except Exception:
+            return None
+        if cookie_name not in jar:
+            return None
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        try:
+            data = serializer.loads(
+                jar[cookie_name].value,
+                max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()),
+            )
+        except Exception:
+            return None
+        return data.get("user")
+
+    @staticmethod
+    def header(scope, name):
+        for key, value in scope["headers"]:
+            if key == name:
+                return value.decode("latin-1")
+        return None
+
+    @staticmethod
+    def client_ip(scope):
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def render(self, template, context):
+        with self.flask_app.app_context():
+            return render_template(template, **context)
+
+    @staticmethod
+    async def read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    @staticmethod
+    async def send_json(send, body, status=200, headers=()):
+        payload = json.dumps(body).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+            + list(headers),
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+    @staticmethod
+    async def send_html(send, html, status=200, headers=()):
+        payload = html.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(payload)).encode())]
+            + list(headers),
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+    async def redirect_to_login(self, scope, send):
+        location = "/login?next=" + quote(scope["path"], safe="")
+        await send({"type": "http.response.start", "status": 302, "headers": [(b"location", location.encode())]})
+        await send({"type": "http.response.body", "body": b""})
+
+    # ---- Flask bridge ----------------------------------------------------------
+
+    async def call_wsgi(self, scope, receive, send):
+        """Serve a request through the Flask app on the WSGI pool, streaming the body back"""
+        body = await self.read_body(receive)
+        environ = self.wsgi_environ(scope, body)
+        loop = self.loop
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started[:] = [status, headers]
+
+            def emit(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            result = self.flask_app(environ, start_response)
+            try:
+                head_sent = False
+                for chunk in result:
+                    if not head_sent:
+                        emit(self.start_message(started))
+                        head_sent = True
+                    if chunk:
+                        emit({"type": "http.response.body", "body": chunk, "more_body": True})
+                if not head_sent:
+                    emit(self.start_message(started))
+                emit({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+        await self.run_blocking(run)
+
+    @staticmethod
+    def start_message(started):
+        status, headers = started
+        return {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        }
+
+    @staticmethod
+    def wsgi_environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": Gateway.client_ip(scope),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for key, value in scope["headers"]:
+            name = key.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif name == "CONTENT_LENGTH":
+                environ["CONTENT_LENGTH"] = value
+            else:
+                http_name = "HTTP_" + name
+                environ[http_name] = environ[http_name] + "," + value if http_name in environ else value
+        environ.setdefault("CONTENT_LENGTH", str(len(body)))
+        return environ
+
+
+class _ResponseRecorder:
+    """ASGI `send` wrapper that keeps a copy of the response for the idempotency cache"""
+
+    def __init__(self, send):
+        self.send = send
+        self.status = None
+        self.content_type = ""
+        self.chunks = []
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.content_type = dict(message.get("headers", [])).get(b"content-type", b"").decode("latin-1")
+        elif message["type"] == "http.response.body":
+            self.chunks.append(message.get("body", b""))
+        await self.send(message)
+
+    def stored(self):
+        if self.status is None:
+            return None
+        return idempotency.storable(self.status, b"".join(self.chunks), self.content_type)
+
+
+class _Admission:
+    """async context manager: rate limits + resource slots, answering 429 on rejection"""
+
+    def __init__(self, gateway, scope, send, limit_scope, user, resources, template, email):
+        self.gateway = gateway
+        self.scope = scope
+        self.send = send
+        self.limit_scope = limit_scope
+        self.user = user
+        self.resources = resources
+        self.template = template
+        self.email = email
+        self.held = False
+
+    async def __aenter__(self):
+        rejected = ratelimit.check_limits(
+            self.gateway.flask_app.config, self.limit_scope, self.user, Gateway.client_ip(self.scope)
+        )
+        if rejected is None and ratelimit.resource_slots is not None:
+            if ratelimit.resource_slots.acquire(self.resources):
+                rejected = ("Server is busy. Please try again shortly.", 1)
+            else:
+                self.held = True
+        if rejected is None:
+            return True
+        message, retry_after = rejected
+        headers = [(b"retry-after", str(max(1, int(retry_after + 0.999))).encode())]
+        if self.template:
+            html = self.gateway.render(self.template, {"email": self.email, "error": message})
+            await Gateway.send_html(self.send, html, 429, headers)
+        else:
+            await Gateway.send_json(self.send, {"success": False, "message": message}, 429, headers)
+        return False
+
+    async def __aexit__(self, *exc):
+        if self.held:
+            ratelimit.resource_slots.release(self.resources)
+        return False
+
+
+asgi_app = Gateway(parking.app)
@@ -0,0 +1,159 @@
+"""Idempotency-Key support for retried POSTs (reservations, arrivals).
+
+A client sends the same ``Idempotency-Key`` header on every retry of one
+logical request. The first request runs the view and its response is
+stored. Repeats within the TTL get that stored response back, marked
+``Idempotent-Replayed: true``, without touching state or the serial link.
+A repeat that arrives while the first is still running waits for it.
+
+Keys are scoped per endpoint and per user, so two customers can never
+collide. A key reused with a different body gets 422. Server errors
+(5xx) and 429s are not stored, so a retry after one really runs again.
+Entries live in a bounded TTL cache and the oldest are evicted first.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import current_app, request, session
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+WAIT_FOR_FIRST = 5.0  # seconds a repeat waits for the original to finish
+
+StoredResponse = namedtuple("StoredResponse", "status body content_type")
+
+
+class Entry:
+    __slots__ = ("fingerprint", "expires", "done", "response")
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = threading.Event()
+        self.response = None
+
+
+class IdempotencyCache:
+    def __init__(self, ttl=600, max_keys=10000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.entries = OrderedDict()  # insertion order == expiry order (one TTL for all)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def start(self, key, fingerprint):
+        """Claim `key`: (entry, True) for the first request, (entry, False) for a repeat"""
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest.expires > now:
+                    break
+                self.entries.popitem(last=False)
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = self.entries[key] = Entry(fingerprint, now + self.ttl)
+            if len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+            return entry, True
+
+    def finish(self, key, entry, response):
+        """Store the first request's response (None forgets the key so a retry runs again) and wake repeats"""
+        with self.lock:
+            if response is None:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            else:
+                entry.response = response
+        entry.done.set()
+
+
+cache = None
+
+
+def init_app(app):
+    """Create the cache from app.config['IDEMPOTENCY_TTL'] / ['IDEMPOTENCY_MAX_KEYS']"""
+    global cache
+    cache = IdempotencyCache(app.config.get("IDEMPOTENCY_TTL", 600), app.config.get("IDEMPOTENCY_MAX_KEYS", 10000))
+
+
+def fingerprint(body):
+    return hashlib.sha256(body or b"").hexdigest()
+
+
+def storable(status, body, content_type):
+    """The response to keep for repeats, or None when a retry should run the request again"""
+    if status >= 500 or status == 429:
+        return None
+    return StoredResponse(status, body, content_type)
+
+
+def json_error(message, status):
+    return StoredResponse(status, json.dumps({"success": False, "message": message}).encode(), "application/json")
+
+
+def invalid_key(key):
+    if len(key) > MAX_KEY_LENGTH:
+        return json_error(f"{HEADER} must be at most {MAX_KEY_LENGTH} characters", 400)
+    return None
+
+
+def repeat_response(entry, request_fingerprint, timeout=WAIT_FOR_FIRST):
+    """Framework-agnostic answer for a repeated key: the stored response, or an error (blocks up to `timeout`)"""
+    if entry.fingerprint != request_fingerprint:
+        return json_error(f"{HEADER} was already used for a different request", 422)
+    if not entry.done.wait(timeout) or entry.response is None:
+        return json_error("A request with this Idempotency-Key is still being processed. Retry shortly.", 409)
+    return entry.response
+
+
+def session_user():
+    return session.get("user")
+
+
+def _flask_response(stored, replayed):
+    resp = current_app.response_class(stored.body, status=stored.status, content_type=stored.content_type)
+    if replayed:
+        resp.headers[REPLAY_HEADER] = "true"
+    return resp
+
+
+def idempotent(scope, user_key=session_user):
+    """Honour an Idempotency-Key header on this view (requests without one run normally).
+
+    Place it outside @rate_limit so replays do not spend tokens or resource slots.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or cache is None:
+                return view(*args, **kwargs)
+            rejected = invalid_key(key)
+            if rejected:
+                return _flask_response(rejected, False)
+            cache_key = (scope, user_key(), key)
+            request_fingerprint = fingerprint(request.get_data())
+            entry, first = cache.start(cache_key, request_fingerprint)
+            if not first:
+                stored = repeat_response(entry, request_fingerprint)
+                return _flask_response(stored, stored is entry.response)
+            response = None
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            finally:
+                kept = None
+                if response is not None and not response.is_streamed:
+                    kept = storable(response.status_code, response.get_data(), response.content_type)
+                cache.finish(cache_key, entry, kept)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,177 @@
+"""Write-ahead log plus periodic snapshots for the in-memory reservation state.
+
+The state is a set of sections (``spots``, ``timers``, ``cards``). Each
+section maps keys to JSON values. Every mutation appends one record
+carrying the new values of the keys it touched, with ``None`` meaning
+"delete". Replaying records in order, on top of the latest snapshot,
+rebuilds the state.
+
+Appends never block. A writer thread batches everything that queued up
+while the previous fsync was running and writes it with one ``fsync``
+(group commit). Callers that must not acknowledge before the data is on
+disk call ``flush()``.
+
+Every ``snapshot_every`` records, or after ``snapshot_interval`` seconds
+with new records, the writer starts a new log segment and writes a
+snapshot atomically. It then deletes the segments the snapshot covers, so
+startup replays at most one snapshot's worth of records. A torn last
+line (crash mid-write) is ignored.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PATTERN = "wal-*.log"
+
+
+def apply_record(state, changes):
+    for section, values in changes.items():
+        target = state.setdefault(section, {})
+        for key, value in values.items():
+            if value is None:
+                target.pop(key, None)
+            else:
+                target[key] = value
+
+
+class Journal:
+    def __init__(self, directory, snapshot_every=1000, snapshot_interval=300.0):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.cond = threading.Condition()
+        self.pending = []
+        self.next_seq = 1
+        self.durable_seq = 0
+        self.since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+        self.capture_state = None
+        self.file = None
+        self.closing = False
+        self.thread = None
+
+    def recover(self):
+        """Load the latest snapshot and replay the log after it; returns the state dict"""
+        os.makedirs(self.directory, exist_ok=True)
+        state, snapshot_seq = {}, 0
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            state, snapshot_seq = snapshot["state"], snapshot["seq"]
+        last_seq = snapshot_seq
+        replayed = 0
+        for segment in self.segments():
+            with open(segment, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the tail of a crashed segment
+                    if record["seq"] <= snapshot_seq:
+                        continue
+                    apply_record(state, record["set"])
+                    last_seq = record["seq"]
+                    replayed += 1
+        self.next_seq = last_seq + 1
+        self.durable_seq = last_seq
+        self.since_snapshot = replayed
+        return state
+
+    def start(self, capture_state):
+        """Open a fresh segment and start the writer; capture_state() returns the full state"""
+        self.capture_state = capture_state
+        self.file = self.open_segment(self.next_seq)
+        self.thread = threading.Thread(target=self.run, name="state-journal", daemon=True)
+        self.thread.start()
+
+    def append(self, event, changes):
+        """Queue one mutation record; returns its sequence number (durable after flush())"""
+        with self.cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.append({"seq": seq, "ts": round(time.time(), 3), "event": event, "set": changes})
+            self.cond.notify_all()
+            return seq
+
+    def flush(self, timeout=5.0):
+        """Block until every record appended so far is fsynced; False on timeout"""
+        with self.cond:
+            target = self.next_seq - 1
+            if self.thread is None:
+                return self.durable_seq >= target
+            return self.cond.wait_for(lambda: self.durable_seq >= target, timeout)
+
+    def close(self):
+        """Write out anything pending and stop the writer"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+
+    def open_segment(self, first_seq):
+        return open(os.path.join(self.directory, f"wal-{first_seq:012d}.log"), "a", encoding="utf-8")
+
+    def run(self):
+        if self.since_snapshot:
+            self.snapshot()  # compact what startup just replayed
+        while True:
+            with self.cond:
+                if not self.pending and not self.closing:
+                    self.cond.wait(self.snapshot_interval)
+                batch, self.pending = self.pending, []
+                closing = self.closing
+            if batch:
+                self.write_batch(batch)
+            if self.since_snapshot and (self.since_snapshot >= self.snapshot_every
+                                        or time.monotonic() - self.last_snapshot >= self.snapshot_interval):
+                self.snapshot()
+            if closing and not batch:
+                self.file.close()
+                return
+
+    def write_batch(self, batch):
+        self.file.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.since_snapshot += len(batch)
+        with self.cond:
+            self.durable_seq = batch[-1]["seq"]
+            self.cond.notify_all()
+
+    def snapshot(self):
+        """Rotate the log, write the snapshot atomically, drop the segments it covers"""
+        seq = self.durable_seq
+        try:
+            state = json.loads(json.dumps(self.capture_state()))
+        except RuntimeError:
+            return  # state changed mid-capture; try again after the next batch
+        old_segments = self.segments()
+        self.file.close()
+        self.file = self.open_segment(seq + 1)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "state": state}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.directory, os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for segment in old_segments:
+            if segment != self.file.name:
+                os.remove(segment)
+        self.since_snapshot = 0
+        self.last_snapshot = time.monotonic()
@@ -0,0 +1,135 @@
+"""Gate kiosk channel: one persistent WebSocket per gate terminal.
+
+A kiosk authenticates once, when it connects, with its device token. It
+sends the token as ``Authorization: Bearer <token>`` or as ``?token=``
+for browser kiosks. It then keeps the connection open. Every message is
+a JSON object.
+
+Kiosk -> server::
+
+    {"type": "scan", "rfid": "35E17AD3", "id": 17}
+    {"type": "ping", "id": 18}
+
+Server -> kiosk::
+
+    {"type": "scan_result", "id": 17, "status": 200, "body": {...}, "trace_id": "..."}
+    {"type": "pong", "id": 18}
+    {"type": "event", "event": "spot_assigned", "spot": 2, ...}
+    {"type": "error", "id": 17, "message": "..."}
+
+A scan is answered on the same connection with what POST /api/rfid_scan
+would have returned. Gate events are pushed to every connected kiosk:
+
+- ``spot_assigned``: an arrival was accepted;
+- ``card_dispensed``: the device dispensed a card. When it answers a
+  gate scan it carries that scan's ``trace_id`` and ``kiosk``; walk-in
+  and VIP-card dispenses have neither;
+- ``payment_complete``: a card was paid and returned.
+
+This module is transport-agnostic. It covers token checks, message
+handling and the set of connected kiosks. The asyncio gateway provides
+the WebSocket itself.
+"""
+import hmac
+import json
+import threading
+from urllib.parse import parse_qs
+
+from eventlog import log_event
+
+MAX_MESSAGE_BYTES = 4096
+
+
+def parse_tokens(spec):
+    """'gate-1=secret1,gate-2=secret2' -> {secret: kiosk name}"""
+    tokens = {}
+    for item in (spec or "").split(","):
+        name, sep, token = item.strip().partition("=")
+        if sep and name and token:
+            tokens[token] = name
+    return tokens
+
+
+def presented_token(authorization, query_string):
+    """The token a kiosk connected with, from its Authorization header or ?token="""
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return parse_qs(query_string or "").get("token", [""])[0]
+
+
+def authenticate(tokens, presented):
+    """Kiosk name for a valid token, else None (constant-time per configured token)"""
+    name = None
+    for token, kiosk in tokens.items():
+        if presented and hmac.compare_digest(token.encode(), presented.encode()):
+            name = kiosk
+    return name
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":"))
+
+
+class Connection:
+    """One connected kiosk; `push(text)` must be safe to call from any thread and must not block"""
+
+    def __init__(self, name, push):
+        self.name = name
+        self.push = push
+
+    def send(self, message):
+        self.push(encode(message))
+
+
+class KioskHub:
+    def __init__(self):
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def register(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+        log_event("kiosk.connect", kiosk=connection.name, connected=len(self.connections))
+
+    def unregister(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+        log_event("kiosk.disconnect", kiosk=connection.name, connected=len(self.connections))
+
+    def broadcast(self, event, data):
+        """Push a gate event to every kiosk (called from the serial reader; never blocks)"""
+        with self.lock:
+            connections = list(self.connections)
+        message = {"type": "event", "event": event, **data}
+        for connection in connections:
+            try:
+                connection.send(message)
+            except Exception as e:
+                log_event("kiosk.push_failed", kiosk=connection.name, event=event, error=str(e))
+
+
+hub = KioskHub()
+
+
+def handle_message(kiosk, raw, scan):
+    """Reply (a dict) to one kiosk message; `scan(kiosk, rfid, trace_id)` returns (body, status, trace_id)"""
+    if len(raw) > MAX_MESSAGE_BYTES:
+        return {"type": "error", "message": "Message too large"}
+    try:
+        message = json.loads(raw)
+    except ValueError:
+        return {"type": "error", "message": "Messages must be JSON objects"}
+    if not isinstance(message, dict):
+        return {"type": "error", "message": "Messages must be JSON objects"}
+    msg_id = message.get("id")
+    kind = message.get("type")
+    if kind == "ping":
+        return {"type": "pong", "id": msg_id}
+    if kind == "scan":
+        rfid_code = str(message.get("rfid", "")).strip().replace(" ", "")
+        body, status, trace_id = scan(kiosk, rfid_code, message.get("trace_id"))
+        return {"type": "scan_result", "id": msg_id, "status": status, "body": body, "trace_id": trace_id}
+    return {"type": "error", "id": msg_id, "message": f"Unknown message type {kind!r}"}
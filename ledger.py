@@ -0,0 +1,123 @@
+"""Billing ledger: one CSV row per completed parking session.
+
+Rows are appended, never rewritten. Per-hour, per-day and per-spot
+totals (sessions, revenue, dwell seconds) are kept in memory and updated
+as each session is recorded, so reports never rescan history. The file
+is read once at startup to rebuild them.
+"""
+import csv
+import os
+import threading
+from datetime import datetime
+
+FIELDNAMES = ["spot", "card", "customer", "start", "end", "seconds", "amount_due", "amount_paid"]
+PERIODS = ("hour", "day", "spot")
+
+
+def period_keys(row):
+    """Aggregate keys for a session, bucketed by the local time it ended"""
+    ended = datetime.fromtimestamp(row["end"])
+    return {
+        "hour": ended.strftime("%Y-%m-%d %H:00"),
+        "day": ended.strftime("%Y-%m-%d"),
+        "spot": str(row["spot"]),
+    }
+
+
+class Ledger:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.totals = {period: {} for period in PERIODS}
+        self.overall = self.empty_totals()
+        self.load()
+
+    @staticmethod
+    def empty_totals():
+        return {"sessions": 0, "revenue": 0, "dwell_seconds": 0}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            for raw in csv.DictReader(f):
+                try:
+                    row = {
+                        "spot": int(raw["spot"]), "end": float(raw["end"]), "seconds": int(raw["seconds"]),
+                        "amount_paid": int(raw["amount_paid"]),
+                    }
+                except (TypeError, ValueError):
+                    continue
+                self.add_to_totals(row)
+
+    def record(self, spot, card, customer, start, end, amount_due, amount_paid):
+        """Append one completed session and fold it into the aggregates"""
+        row = {
+            "spot": spot, "card": card, "customer": customer or "",
+            "start": round(start, 3), "end": round(end, 3), "seconds": max(0, int(end - start)),
+            "amount_due": amount_due, "amount_paid": amount_paid,
+        }
+        with self.lock:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+            self.add_to_totals(row)
+        return row
+
+    def iter_rows(self):
+        """Stream the ledger from disk, one dict per session, as of the moment the call starts.
+
+        Sessions appended while the caller is still reading are not included,
+        so a slow reader always sees a consistent prefix and never a torn row.
+        """
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            end = os.path.getsize(self.path)
+        with open(self.path, "rb") as f:
+            def lines():
+                remaining = end
+                for raw in f:
+                    remaining -= len(raw)
+                    if remaining < 0:
+                        return
+                    yield raw.decode("utf-8")
+            yield from csv.DictReader(lines())
+
+    def add_to_totals(self, row):
+        # Caller holds self.lock (or is the constructor)
+        for period, key in period_keys(row).items():
+            bucket = self.totals[period].get(key)
+            if bucket is None:
+                bucket = self.totals[period][key] = self.empty_totals()
+            self.add(bucket, row)
+        self.add(self.overall, row)
+
+    @staticmethod
+    def add(bucket, row):
+        bucket["sessions"] += 1
+        bucket["revenue"] += row["amount_paid"]
+        bucket["dwell_seconds"] += row["seconds"]
+
+    def lookup(self, period, key):
+        """Totals for one hour ('YYYY-MM-DD HH:00'), day ('YYYY-MM-DD') or spot ('1')"""
+        with self.lock:
+            return with_average(dict(self.totals[period].get(key) or self.empty_totals()))
+
+    def report(self, period):
+        """All buckets of a period, in key order"""
+        with self.lock:
+            buckets = {key: dict(value) for key, value in self.totals[period].items()}
+        return {key: with_average(buckets[key]) for key in sorted(buckets)}
+
+    def summary(self):
+        with self.lock:
+            return with_average(dict(self.overall))
+
+
+def with_average(bucket):
+    bucket["average_dwell_seconds"] = round(bucket["dwell_seconds"] / bucket["sessions"]) if bucket["sessions"] else 0
+    return bucket
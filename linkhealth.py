@@ -0,0 +1,191 @@
+"""Serial link health: ping/pong RTT, dropped and late pongs, SLOTS cadence.
+
+The host writes ``PING:<n>`` every ``ping_interval`` seconds and the
+firmware echoes ``PONG:<n>``. A pong slower than ``late_after`` counts as
+late. A ping with no pong after ``drop_after`` counts as dropped. SLOTS
+report gaps are recorded too. Both go into fixed-bucket histograms, so
+recording costs O(1) and memory stays bounded.
+
+Health state from the most recent ``window`` pings:
+
+* ``down``      - ``down_after_drops`` pings in a row went unanswered, or
+  nothing (pong or SLOTS) arrived for ``silence_after`` seconds
+* ``degraded``  - some recent pings dropped or late, or SLOTS reports stalled
+* ``healthy``   - otherwise
+* ``unknown``   - just connected, no evidence yet
+"""
+import threading
+import time
+from collections import deque
+
+RTT_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+CADENCE_BUCKETS_MS = (100, 200, 300, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None when empty)"""
+        if not self.total:
+            return None
+        target = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "mean": round(self.sum / self.total, 1) if self.total else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 1),
+        }
+
+
+class LinkHealth:
+    def __init__(self, ping_interval=2.0, late_after=0.5, drop_after=3.0, window=20,
+                 down_after_drops=3, silence_after=8.0, slots_stall_after=3.0):
+        self.ping_interval = ping_interval
+        self.late_after = late_after
+        self.drop_after = drop_after
+        self.window = window
+        self.down_after_drops = down_after_drops
+        self.silence_after = silence_after
+        self.slots_stall_after = slots_stall_after
+        self.lock = threading.Lock()
+        self.rtt = Histogram(RTT_BUCKETS_MS)
+        self.slots_cadence = Histogram(CADENCE_BUCKETS_MS)
+        self.sent = self.received = self.late = self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the current link (called on connect/disconnect); histograms and totals are kept"""
+        with self.lock:
+            self.connected_at = time.monotonic()
+            self.next_seq = 1
+            self.outstanding = {}
+            self.recent = deque(maxlen=self.window)  # "ok" | "late" | "dropped"
+            self.consecutive_drops = 0
+            self.last_ping_at = 0.0
+            self.last_heard = None
+            self.last_slots = None
+            self.pong_seen = False
+
+    def next_ping(self):
+        """Return the PING line to send now, or None if it is not time yet"""
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            if now - self.last_ping_at < self.ping_interval:
+                return None
+            seq = self.next_seq
+            self.next_seq += 1
+            self.outstanding[seq] = now
+            self.last_ping_at = now
+            self.sent += 1
+        return f"PING:{seq}\n"
+
+    def record_pong(self, payload):
+        now = time.monotonic()
+        try:
+            seq = int(payload)
+        except ValueError:
+            return
+        with self.lock:
+            sent_at = self.outstanding.pop(seq, None)
+            self.last_heard = now
+            self.pong_seen = True
+            if sent_at is None:
+                return  # already counted as dropped
+            rtt = now - sent_at
+            self.rtt.add(rtt * 1000)
+            self.received += 1
+            self.consecutive_drops = 0
+            if rtt > self.late_after:
+                self.late += 1
+                self.recent.append("late")
+            else:
+                self.recent.append("ok")
+
+    def record_slots(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.last_slots is not None:
+                self.slots_cadence.add((now - self.last_slots) * 1000)
+            self.last_slots = now
+            self.last_heard = now
+
+    def expire(self, now):
+        # Caller holds self.lock
+        for seq, sent_at in list(self.outstanding.items()):
+            if now - sent_at > self.drop_after:
+                del self.outstanding[seq]
+                self.dropped += 1
+                self.consecutive_drops += 1
+                self.recent.append("dropped")
+
+    def state(self, connected=True):
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            return self._state(now, connected)
+
+    def _state(self, now, connected):
+        # Caller holds self.lock
+        if not connected:
+            return "down"
+        if self.last_heard is None:
+            return "unknown" if now - self.connected_at < self.silence_after else "down"
+        if now - self.last_heard > self.silence_after:
+            return "down"
+        if self.pong_seen and self.consecutive_drops >= self.down_after_drops:
+            return "down"
+        if self.pong_seen and any(r != "ok" for r in self.recent):
+            return "degraded"
+        if self.last_slots is not None and now - self.last_slots > self.slots_stall_after:
+            return "degraded"
+        return "healthy"
+
+    def should_reconnect(self):
+        """True when a link that was answering has gone down (an unknown device never trips this)"""
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            return self.last_heard is not None and self._state(now, True) == "down"
+
+    def report(self, connected=True):
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            return {
+                "state": self._state(now, connected),
+                "ping_supported": self.pong_seen,
+                "pings": {"sent": self.sent, "received": self.received, "late": self.late, "dropped": self.dropped},
+                "recent": list(self.recent),
+                "rtt_ms": self.rtt.to_dict(),
+                "slots_interval_ms": self.slots_cadence.to_dict(),
+                "seconds_since_heard": round(now - self.last_heard, 1) if self.last_heard else None,
+            }
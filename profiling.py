@@ -0,0 +1,130 @@
+"""On-demand sampling profiler producing collapsed (flame-graph-ready) stacks.
+
+A sampler thread reads ``sys._current_frames()`` at a fixed interval and
+counts root-first stacks as ``thread;module:function;...``. The output
+feeds flamegraph.pl or speedscope directly. Two ways to use it:
+
+* per request: profile one request's thread while the view runs;
+* window: profile every thread (including the serial reader) for N seconds.
+
+Nothing runs unless a profile is requested, so the idle cost is zero.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+MAX_STACK_DEPTH = 64
+MAX_KEPT_PROFILES = 50
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse(frame, thread_name):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", "_"))
+    labels.reverse()
+    return ";".join(labels)
+
+
+class StackSampler:
+    """Sample the stacks of `thread_ids` (None = all threads) until stopped"""
+
+    def __init__(self, interval=0.005, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.duration = time.monotonic() - self.started
+        return self
+
+    @property
+    def running(self):
+        """Started and not yet stopped"""
+        return self.started is not None and not self._stop.is_set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                self.stacks[collapse(frame, names.get(ident, str(ident)))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Collapsed-stack text: one 'frame;frame;frame count' line per distinct stack"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Bounded, thread-safe store of finished profiles keyed by id"""
+
+    def __init__(self, limit=MAX_KEPT_PROFILES):
+        self.limit = limit
+        self.profiles = OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, kind, sampler, **meta):
+        with self.lock:
+            profile_id = next(self.ids)
+            self.profiles[profile_id] = {"id": profile_id, "kind": kind, "sampler": sampler, **meta}
+            while len(self.profiles) > self.limit:
+                self.profiles.popitem(last=False)
+            return profile_id
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def summaries(self):
+        with self.lock:
+            items = list(self.profiles.values())
+        return [summarize(p) for p in reversed(items)]
+
+
+def summarize(profile):
+    sampler = profile["sampler"]
+    summary = {k: v for k, v in profile.items() if k != "sampler"}
+    summary["samples"] = sampler.samples
+    summary["duration_ms"] = round(sampler.duration * 1000, 1)
+    summary["running"] = sampler.running
+    return summary
+
+
+store = ProfileStore()
+
+
+def profile_window(seconds, interval=0.005):
+    """Sample all threads for `seconds` in the background; returns the profile id"""
+    sampler = StackSampler(interval=interval).start()
+    profile_id = store.add("window", sampler, seconds=seconds, interval=interval)
+    timer = threading.Timer(seconds, sampler.stop)
+    timer.daemon = True
+    timer.start()
+    return profile_id
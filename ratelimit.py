@@ -0,0 +1,162 @@
+"""Admission control for expensive endpoints.
+
+Token buckets limit how often one user or one client IP may hit an
+endpoint class. Concurrency caps limit how many requests may use a
+scarce resource class (SMTP, serial link, disk) at once. Both checks
+run before the view does any work, so rejected requests are cheap.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, jsonify, render_template, request, session
+
+MAX_TRACKED_KEYS = 10000  # idle buckets beyond this are evicted LRU-first
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Consume one token; return 0 on success or seconds until one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60
+
+
+class RateLimiter:
+    """Token buckets keyed by (scope, kind, key), bounded in memory"""
+
+    def __init__(self, max_keys=MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, scope, kind, key, rate, burst):
+        """Return 0 if the request is admitted, else the suggested Retry-After in seconds"""
+        now = time.monotonic()
+        bucket_key = (scope, kind, key)
+        with self.lock:
+            bucket = self.buckets.get(bucket_key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self.buckets[bucket_key] = bucket
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(bucket_key)
+            return bucket.take(now)
+
+
+class ResourceSlots:
+    """Per-resource-class concurrency caps (non-blocking acquire)"""
+
+    def __init__(self, limits):
+        self.semaphores = {name: threading.BoundedSemaphore(n) for name, n in limits.items()}
+
+    def acquire(self, names):
+        """Acquire one slot of each resource; on failure release what was taken and return the busy name"""
+        taken = []
+        for name in names:
+            sem = self.semaphores.get(name)
+            if sem is None:
+                continue
+            if not sem.acquire(blocking=False):
+                self.release(taken)
+                return name
+            taken.append(name)
+        return None
+
+    def release(self, names):
+        for name in reversed(names):
+            sem = self.semaphores.get(name)
+            if sem is not None:
+                sem.release()
+
+
+limiter = RateLimiter()
+resource_slots = None
+
+
+def init_app(app):
+    """Create the resource semaphores from app.config['CONCURRENCY_LIMITS']"""
+    global resource_slots
+    resource_slots = ResourceSlots(app.config.get("CONCURRENCY_LIMITS", {}))
+
+
+def client_ip():
+    return request.remote_addr or "unknown"
+
+
+def session_user():
+    return session.get("user")
+
+
+def check_limits(config, scope, user, ip):
+    """Framework-agnostic bucket check; returns None if admitted, else (message, retry_after)"""
+    limits = config.get("RATE_LIMITS", {}).get(scope)
+    if not limits:
+        return None
+    if user:
+        wait = limiter.check(scope, "user", user, limits["rate"], limits["burst"])
+        if wait:
+            return "Too many requests. Please wait and try again.", wait
+    ip_rate = limits.get("ip_rate", limits["rate"])
+    ip_burst = limits.get("ip_burst", limits["burst"])
+    wait = limiter.check(scope, "ip", ip, ip_rate, ip_burst)
+    if wait:
+        return "Too many requests from this address. Please wait and try again.", wait
+    return None
+
+
+def _limited(template, message, retry_after):
+    if template:
+        form = request.form if request.form else {}
+        resp = current_app.make_response(
+            (render_template(template, email=form.get("email", ""), error=message), 429)
+        )
+    else:
+        resp = jsonify({"success": False, "message": message})
+        resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return resp
+
+
+def rate_limit(scope, user_key=session_user, resources=(), template=None, methods=("POST",)):
+    """Admit a request only if the user's and the IP's buckets for `scope` have a token
+    and a slot is free in every resource class it uses.
+
+    Limits come from app.config['RATE_LIMITS'][scope] as {"rate": per_second, "burst": n,
+    "ip_rate": ..., "ip_burst": ...}. Rejections return 429 with Retry-After; `template`
+    renders HTML form endpoints instead of JSON. Only requests using `methods` are limited.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+            rejected = check_limits(current_app.config, scope, user_key(), client_ip())
+            if rejected:
+                return _limited(template, *rejected)
+
+            if not resources or resource_slots is None:
+                return view(*args, **kwargs)
+            busy = resource_slots.acquire(resources)
+            if busy:
+                return _limited(template, "Server is busy. Please try again shortly.", 1)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                resource_slots.release(resources)
+        return wrapped
+    return decorator
@@ -0,0 +1,154 @@
+"""Replay a serial capture through the host's line dispatcher.
+
+Record traffic with PARKING_SERIAL_CAPTURE=capture.log.gz, then:
+
+    python replay_serial.py capture.log.gz --speed max --expect X,O,R,O
+
+The capture header restores the host state from when recording started.
+Inbound device lines go through dispatch_arduino_line with the captured
+timing, divided by --speed. Host-side changes such as reservations and
+arrivals are applied at their recorded times. Outbound lines go to a sink
+that acknowledges them in ack mode.
+
+Prints events per second and per-event latency by line type. Exits with
+status 1 if the final spot states differ from --expect.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+# Isolate the replay from the live journal, ledger, traces, capture and log stream before app is imported
+REPLAY_DIR = tempfile.mkdtemp(prefix="parking-replay-")
+os.environ["PARKING_STATE_DIR"] = REPLAY_DIR
+os.environ["PARKING_LEDGER_CSV"] = os.path.join(REPLAY_DIR, "sessions.csv")
+os.environ["PARKING_TRACE_FILE"] = os.path.join(REPLAY_DIR, "traces.jsonl")
+os.environ.pop("PARKING_SERIAL_CAPTURE", None)
+os.environ.setdefault("PARKING_LOG_LEVEL", "WARNING")
+
+import app  # noqa: E402
+from journal import apply_record  # noqa: E402
+from serial_capture import INBOUND, OUTBOUND, STATE, read_capture  # noqa: E402
+
+# Host events that are consequences of inbound lines; replaying those lines reproduces them
+DEVICE_DRIVEN_EVENTS = {"paid", "disp", "reconcile"}
+
+
+class ReplaySink:
+    """Stands in for the serial port; records writes and queues ACKs in ack mode"""
+
+    is_open = True
+    in_waiting = 0
+
+    def __init__(self, auto_ack):
+        self.auto_ack = auto_ack
+        self.written = 0
+        self.acks = deque()
+
+    def write(self, data):
+        for line in data.decode(errors="ignore").splitlines():
+            self.written += 1
+            if self.auto_ack and line.startswith("@"):
+                self.acks.append("ACK:" + line[1:].split(":", 1)[0])
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def line_type(line):
+    head = line.split(":", 1)[0]
+    return head if head.isupper() and head.isalpha() else "OTHER"
+
+
+def apply_state_changes(changes):
+    state = app.capture_state()
+    apply_record(state, changes)
+    app.restore_state(state)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay(entries, speed, sink):
+    latencies = defaultdict(list)
+    start = time.monotonic()
+    for offset, direction, payload in entries:
+        if speed is not None:
+            delay = start + offset / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if direction == STATE:
+            event, _, changes = payload.partition(" ")
+            if event not in DEVICE_DRIVEN_EVENTS:
+                apply_state_changes(json.loads(changes))
+            continue
+        if direction != INBOUND:
+            continue
+        began = time.perf_counter()
+        app.dispatch_arduino_line(payload)
+        while sink.acks:
+            app.command_channel.handle_line(sink.acks.popleft())
+        latencies[line_type(payload)].append(time.perf_counter() - began)
+        # The reader loop enforces holds between lines
+        app.enforce_holds()
+    return time.monotonic() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture")
+    parser.add_argument("--speed", default="max", help="replay speed multiplier (1, 100, ...) or 'max'")
+    parser.add_argument("--protocol", choices=("ack", "legacy"), default="ack",
+                        help="host send mode; legacy includes the real pacing sleeps")
+    parser.add_argument("--expect", help="expected final spot states, e.g. X,O,R,O")
+    parser.add_argument("--dump", action="store_true", help="print the final spots as JSON")
+    args = parser.parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+
+    header, entries = read_capture(args.capture)
+    app.restore_state(header.get("state", {}))
+    sink = ReplaySink(auto_ack=args.protocol == "ack")
+    app.arduino_serial = sink
+    app.ack_protocol = args.protocol == "ack"
+    app.reader_thread_ident = app.threading.get_ident()
+
+    elapsed, latencies = replay(entries, speed, sink)
+    events = sum(len(v) for v in latencies.values())
+    captured_out = sum(1 for _, direction, _ in entries if direction == OUTBOUND)
+    print(f"{events} inbound events in {elapsed:.3f}s ({events / elapsed if elapsed else 0:.0f} events/s)")
+    print(f"outbound lines: {sink.written} replayed, {captured_out} captured")
+    print(f"{'type':<8}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for kind, values in sorted(latencies.items()):
+        print(f"{kind:<8}{len(values):>8}{sum(values) / len(values) * 1000:>10.3f}"
+              f"{percentile(values, 0.5) * 1000:>10.3f}{percentile(values, 0.95) * 1000:>10.3f}"
+              f"{max(values) * 1000:>10.3f}")
+
+    app.state_journal.close()
+    if args.dump:
+        print(json.dumps(app.spots, indent=2))
+    states = ",".join(s["state"] for s in app.spots)
+    if args.expect is not None:
+        if states != args.expect:
+            print(f"FAIL: spot states {states}, expected {args.expect}")
+            return 1
+        print(f"OK: spot states {states}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
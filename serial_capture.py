@@ -0,0 +1,89 @@
+"""Serial traffic capture for off-site reproduction and benchmarking.
+
+A capture is a text file (gzip-compressed if the name ends in ``.gz``).
+The first line is a ``#`` header holding JSON with the host state at the
+moment capture started. Each later line is
+``<milliseconds since start> <direction> <payload>``. Directions:
+
+* ``<``  line received from the device
+* ``>``  line sent to the device
+* ``=``  host-side state change: ``<event> <journal changes as JSON>``
+
+``replay_serial.py`` feeds a capture back through the dispatcher.
+"""
+import gzip
+import json
+import threading
+import time
+
+INBOUND = "<"
+OUTBOUND = ">"
+STATE = "="
+
+
+def open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class CaptureWriter:
+    def __init__(self, path, header=None):
+        self.path = path
+        self.file = open_text(path, "w")
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.file.write("#" + json.dumps(header or {}, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+    def record(self, direction, text):
+        """Append each non-empty line of `text` with the current timestamp"""
+        ms = (time.monotonic() - self.started) * 1000
+        lines = "".join(f"{ms:.3f} {direction} {line}\n" for line in text.splitlines() if line.strip())
+        if not lines:
+            return
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CapturingSerial:
+    """Wrap a serial handle so every line written or read is captured"""
+
+    def __init__(self, ser, capture):
+        self._ser = ser
+        self._capture = capture
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    def write(self, data):
+        self._capture.record(OUTBOUND, data.decode(errors="ignore") if isinstance(data, bytes) else data)
+        return self._ser.write(data)
+
+    def readline(self, *args, **kwargs):
+        raw = self._ser.readline(*args, **kwargs)
+        if raw:
+            self._capture.record(INBOUND, raw.decode(errors="ignore"))
+        return raw
+
+
+def read_capture(path):
+    """Return (header, [(seconds, direction, payload), ...]) from a capture file"""
+    header = {}
+    entries = []
+    with open_text(path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#"):
+                header = json.loads(line[1:] or "{}")
+                continue
+            parts = line.split(" ", 2)
+            if len(parts) < 3:
+                continue
+            entries.append((float(parts[0]) / 1000, parts[1], parts[2]))
+    return header, entries
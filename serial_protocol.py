@@ -0,0 +1,155 @@
+"""Acknowledged, pipelined command channel for the Arduino link.
+
+Each command goes out as ``@<seq>:<COMMAND>\\n``. The firmware applies it
+and answers ``ACK:<seq>`` (or ``NAK:<seq>`` if it could not apply it).
+Up to ``window`` commands may be in flight, limited further by a byte
+budget so the Uno's 64-byte receive buffer never overflows. Commands
+beyond the window wait in a FIFO. Unacknowledged commands are resent
+with the same sequence number; the firmware deduplicates by sequence, so
+a retried HERE never dispenses twice.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+SEQ_MODULO = 65536
+
+
+class CommandRejected(Exception):
+    """The device answered NAK: it received the command but could not apply it"""
+
+
+class PendingCommand:
+    __slots__ = ("seq", "command", "description", "future", "wire", "deadline", "attempts")
+
+    def __init__(self, seq, command, description, future):
+        self.seq = seq
+        self.command = command
+        self.description = description
+        self.future = future
+        self.wire = f"@{seq}:{command}\n".encode()
+        self.deadline = 0.0
+        self.attempts = 0
+
+
+class CommandChannel:
+    def __init__(self, write, window=4, max_inflight_bytes=60, ack_timeout=1.0, retries=2):
+        self.write = write  # callable(bytes); raises on a dead link
+        self.window = window
+        self.max_inflight_bytes = max_inflight_bytes
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.inflight_bytes = 0
+        self.queued = deque()
+        self.next_seq = 1
+
+    def submit(self, command, description="command", callback=None):
+        """Queue a command and return a Future resolved with True on ACK.
+
+        The future fails with CommandRejected on NAK, TimeoutError after all
+        retries, or ConnectionError if the link drops first. Never blocks.
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq = self.next_seq % (SEQ_MODULO - 1) + 1
+            future.seq = seq  # wire sequence number, for correlating traces with captures
+            self.queued.append(PendingCommand(seq, command.strip(), description, future))
+            to_send = self._fill_window()
+        self._transmit(to_send)
+        return future
+
+    def handle_line(self, line):
+        """Consume an ACK/NAK line from the reader; return False for any other line"""
+        if line.startswith("ACK:"):
+            ok = True
+        elif line.startswith("NAK:"):
+            ok = False
+        else:
+            return False
+        try:
+            seq = int(line[4:].split(":", 1)[0])
+        except ValueError:
+            return True
+        with self.lock:
+            pending = self.inflight.pop(seq, None)
+            if pending is not None:
+                self.inflight_bytes -= len(pending.wire)
+            to_send = self._fill_window()
+        if pending is not None:
+            if ok:
+                pending.future.set_result(True)
+            else:
+                pending.future.set_exception(CommandRejected(f"{pending.description} rejected by device"))
+        self._transmit(to_send)
+        return True
+
+    def check_timeouts(self):
+        """Resend expired commands; fail those out of retries. Call periodically from the reader."""
+        now = time.monotonic()
+        expired = []
+        resend = []
+        with self.lock:
+            for seq, pending in list(self.inflight.items()):
+                if pending.deadline > now:
+                    continue
+                if pending.attempts > self.retries:
+                    del self.inflight[seq]
+                    self.inflight_bytes -= len(pending.wire)
+                    expired.append(pending)
+                else:
+                    self._mark_sent(pending, now)
+                    resend.append(pending)
+            if expired:
+                resend.extend(self._fill_window())
+        for pending in expired:
+            pending.future.set_exception(TimeoutError(f"No acknowledgement for {pending.description}"))
+        self._transmit(resend)
+
+    def pending(self):
+        """Commands still waiting for an acknowledgement (in flight or queued)"""
+        with self.lock:
+            return len(self.inflight) + len(self.queued)
+
+    def reset(self, reason="Arduino disconnected"):
+        """Fail everything in flight or queued (the link went away)"""
+        with self.lock:
+            dropped = list(self.inflight.values()) + list(self.queued)
+            self.inflight.clear()
+            self.queued.clear()
+            self.inflight_bytes = 0
+        for pending in dropped:
+            if not pending.future.done():
+                pending.future.set_exception(ConnectionError(reason))
+
+    def _fill_window(self):
+        # Caller holds self.lock. Always allow one command in flight, however long.
+        ready = []
+        while self.queued and len(self.inflight) < self.window:
+            nxt = self.queued[0]
+            if self.inflight and self.inflight_bytes + len(nxt.wire) > self.max_inflight_bytes:
+                break
+            self.queued.popleft()
+            self.inflight[nxt.seq] = nxt
+            self.inflight_bytes += len(nxt.wire)
+            self._mark_sent(nxt, time.monotonic())
+            ready.append(nxt)
+        return ready
+
+    def _mark_sent(self, pending, now):
+        # Caller holds self.lock
+        pending.attempts += 1
+        pending.deadline = now + self.ack_timeout
+
+    def _transmit(self, commands):
+        for pending in commands:
+            try:
+                self.write(pending.wire)
+            except Exception as e:
+                self.reset(str(e))
+                return
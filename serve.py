@@ -0,0 +1,200 @@
+"""Production entry point: serve the parking app on a multi-threaded WSGI server.
+
+    python serve.py --port 5000 --threads 8 --keepalive 5
+
+Uses waitress when it is installed (``pip install waitress``). Otherwise it
+falls back to a Werkzeug server with the debugger off and a bounded worker
+pool. Both modes run as one process. The process owns the serial port and
+opens it once, before serving starts. Never run this app under a
+multi-process server: the port is opened exclusively, so a second process
+could not open it anyway.
+
+Open spot streams each hold a worker, so ``--reserved-workers`` of the
+threads are kept for ordinary requests. Pages beyond the remaining stream
+slots poll instead. When ``--max-queued`` connections are already waiting
+for a worker, new ones get 503 with Retry-After straight away instead of
+queueing without bound.
+
+SIGTERM or Ctrl-C stops the server gracefully:
+
+1. stop accepting connections;
+2. end open /api/spots/stream responses;
+3. let in-flight requests finish;
+4. wait (up to --drain) for queued device commands to be acknowledged;
+5. close the serial port and flush the state journal.
+
+Every option can also be set with an environment variable (PARKING_HOST,
+PARKING_PORT, PARKING_THREADS, ...).
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import waitress
+except ImportError:  # optional dependency
+    waitress = None
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import app as parking
+import eventlog
+from eventlog import log_event
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """HTTP/1.1 so clients reuse connections; `timeout` closes idle keep-alive sockets"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass  # access logging is the front proxy's job; the event log covers the app
+
+
+SHED_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n"
+                 b"Connection: close\r\n\r\n")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handing each connection to a fixed-size thread pool with a bounded queue"""
+
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads, keepalive, backlog, max_queued=64):
+        self.request_queue_size = backlog
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        # Running plus waiting connections; past this the server sheds load
+        self.slots = threading.BoundedSemaphore(threads + max_queued)
+        handler = type("Handler", (KeepAliveRequestHandler,), {"timeout": keepalive})
+        super().__init__(host, port, wsgi_app, handler=handler)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.shed(request, client_address)
+            return
+        try:
+            self.pool.submit(self.process_request_thread, request, client_address)
+        except RuntimeError:  # pool already shut down
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def shed(self, request, client_address):
+        log_event("server.shed", client=client_address[0])
+        try:
+            request.sendall(SHED_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        # Called by serve_forever on exit: finish in-flight requests, drop queued connections
+        super().server_close()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def env(name, default):
+    return os.environ.get(f"PARKING_{name}", default)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=env("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("PORT", 5000)))
+    parser.add_argument("--threads", type=int, default=int(env("THREADS", 8)),
+                        help="request worker threads (each open spot stream holds one)")
+    parser.add_argument("--reserved-workers", type=int, default=int(env("RESERVED_WORKERS", 4)),
+                        help="workers never given to spot streams; streams beyond threads minus this poll")
+    parser.add_argument("--max-queued", type=int, default=int(env("MAX_QUEUED", 64)),
+                        help="connections waiting for a worker before new ones get 503 (werkzeug pool only)")
+    parser.add_argument("--keepalive", type=float, default=float(env("KEEPALIVE", 5)),
+                        help="seconds an idle keep-alive connection stays open")
+    parser.add_argument("--connection-limit", type=int, default=int(env("CONNECTION_LIMIT", 200)),
+                        help="max open connections (waitress only)")
+    parser.add_argument("--backlog", type=int, default=int(env("BACKLOG", 1024)),
+                        help="listen() backlog")
+    parser.add_argument("--drain", type=float, default=float(env("DRAIN", 3)),
+                        help="seconds to wait for queued device commands on shutdown")
+    parser.add_argument("--no-serial", action="store_true", help="serve without opening the Arduino port")
+    return parser.parse_args(argv)
+
+
+def stream_limit(threads, reserved_workers):
+    """Spot streams allowed at once so `reserved_workers` threads stay free for other requests"""
+    return max(0, threads - reserved_workers)
+
+
+def serve_waitress(args):
+    server = waitress.create_server(
+        parking.app, host=args.host, port=args.port, threads=args.threads,
+        channel_timeout=args.keepalive, connection_limit=args.connection_limit, backlog=args.backlog,
+        ident="parking",
+    )
+
+    def stop(*_):
+        parking.begin_shutdown()
+        # waitress catches this, waits for running tasks and returns from run()
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.run()
+    finally:
+        server.close()
+
+
+def serve_werkzeug(args):
+    server = PooledWSGIServer(args.host, args.port, parking.app, args.threads, args.keepalive, args.backlog,
+                              args.max_queued)
+
+    def stop(*_):
+        parking.begin_shutdown()
+        # shutdown() waits for serve_forever to return, so it cannot run on the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()  # closes the server (and drains the pool) when it returns
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.no_serial:
+        # Opened once, here, before any worker exists; the supervisor keeps it alive
+        ok, msg = parking.connect_arduino()
+        print(f"Arduino: {msg}")
+    parking.start_customer_watcher()
+    parking.app.config["STREAM_MAX"] = stream_limit(args.threads, args.reserved_workers)
+    server_name = "waitress" if waitress is not None else "werkzeug-pool"
+    log_event("server.start", server=server_name, host=args.host, port=args.port,
+              threads=args.threads, keepalive=args.keepalive, stream_max=parking.app.config["STREAM_MAX"])
+    print(f"Serving on http://{args.host}:{args.port} ({server_name}, {args.threads} threads)")
+    try:
+        if waitress is not None:
+            serve_waitress(args)
+        else:
+            serve_werkzeug(args)
+    finally:
+        if parking.customer_watcher is not None:
+            parking.customer_watcher.stop()
+        parking.shutdown_arduino(args.drain)
+        parking.state_journal.close()
+        log_event("server.stop", server=server_name)
+        eventlog.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""Concurrency stress harness for spot, card-queue, waitlist and hold state.
+
+Client threads call /api/reserve, /api/rfid_scan and /api/spots through
+Flask's test client, so every view runs on its own thread as it would under
+a threaded server. A "reader" thread plays the serial reader. It pumps lines
+from an emulated device through dispatch_arduino_line, exactly as
+read_arduino_loop does, but without that loop's 50 ms poll sleep.
+
+    python stress_harness.py --threads 1,4,8 --ops 4000 --seed 7
+
+The emulated device acknowledges commands and answers QUEUE? and PING. It
+follows the host's card-per-spot contract: HERE:n dispenses card n (DISP:n),
+and after a short seeded dwell the driver pays (PAID:n,...).
+
+Each worker draws its operations from its own seeded RNG, so a given
+--seed and thread count always issues the same requests. Only the
+interleaving varies between runs.
+
+Invariants are checked under state_lock throughout the run:
+
+* no user holds two spots, or holds a spot while on the waitlist
+* queued cards are in_dispenser/returned, all others reserved/issued
+* a reserved card's spot is reserved, and a card with a running timer is not queued
+
+After the run goes quiet, further checks apply:
+
+* the host's card queue equals the device's, minus host-reserved cards
+* the device's CAP equals count_capacity_holds()
+* every PAID the device sent reached the billing ledger
+
+Prints throughput and latency per thread count. Exits with status 1 on any
+violation.
+"""
+import argparse
+import heapq
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+# Isolate the run from the live journal, ledger, traces, customer file and capture before app is imported
+STRESS_DIR = tempfile.mkdtemp(prefix="parking-stress-")
+os.environ["PARKING_STATE_DIR"] = STRESS_DIR
+os.environ["PARKING_LEDGER_CSV"] = os.path.join(STRESS_DIR, "sessions.csv")
+os.environ["PARKING_TRACE_FILE"] = os.path.join(STRESS_DIR, "traces.jsonl")
+os.environ.pop("PARKING_SERIAL_CAPTURE", None)
+os.environ.setdefault("PARKING_LOG_LEVEL", "WARNING")
+
+import app  # noqa: E402
+import ratelimit  # noqa: E402
+from card_pool import IN_DISPENSER, RETURNED, RESERVED  # noqa: E402
+
+OPERATIONS = (("reserve", 0.5), ("scan", 0.3), ("spots", 0.2))
+ADVANCE_SHARE = 0.25          # reservations booked 2 hours ahead
+MAX_VIOLATIONS_SHOWN = 10
+
+
+class EmulatedDevice:
+    """Firmware stand-in: write() is the host->device side, `inbound` the device->host lines"""
+
+    is_open = True
+
+    def __init__(self, card_count, seed, dwell):
+        self.card_count = card_count
+        self.rng = random.Random(seed)
+        self.dwell = dwell
+        self.lock = threading.Lock()
+        self.inbound = queue.Queue()
+        self.queue = list(range(card_count))  # 0-based, head first
+        self.counting = set()
+        self.cap = 0
+        self.paying = []  # heap of (due, card)
+        self.paid_sent = 0
+        self.applied_seqs = set()
+        self.received = Counter()
+
+    @property
+    def in_waiting(self):
+        return self.inbound.qsize()
+
+    def write(self, data):
+        for raw in data.decode(errors="ignore").splitlines():
+            self.receive(raw.strip())
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def receive(self, line):
+        seq = None
+        if line.startswith("@"):
+            seq, _, line = line[1:].partition(":")
+        with self.lock:
+            if seq is not None and seq in self.applied_seqs:
+                self.inbound.put(f"ACK:{seq}")  # retry of a command already applied
+                return
+            ok = self.apply(line, seq)
+            if seq is not None:
+                self.applied_seqs.add(seq)
+                self.inbound.put(f"{'ACK' if ok else 'NAK'}:{seq}")
+
+    def apply(self, line, seq=None):
+        # Caller holds self.lock
+        command, _, arg = line.partition(":")
+        self.received[command] += 1
+        if command == "HERE":
+            card = int(arg) - 1
+            if card not in self.queue:
+                return False
+            self.queue.remove(card)
+            self.counting.add(card)
+            self.inbound.put(f"DISP:{card + 1}" + (f"@{seq}" if seq is not None else ""))
+            heapq.heappush(self.paying, (time.monotonic() + self.rng.uniform(*self.dwell), card))
+        elif command == "CAP":
+            self.cap = int(arg)
+        elif line == "QUEUE?":
+            self.inbound.put("QUEUE:" + ",".join(str(c + 1) for c in self.queue))
+        elif command == "PING":
+            self.inbound.put(f"PONG:{arg}")
+        return True
+
+    def release_due(self, everything=False):
+        """The drivers whose dwell is over pay and leave"""
+        now = time.monotonic()
+        with self.lock:
+            while self.paying and (everything or self.paying[0][0] <= now):
+                _, card = heapq.heappop(self.paying)
+                self.counting.discard(card)
+                self.queue.append(card)
+                self.paid_sent += 1
+                self.inbound.put(f"PAID:{card + 1},5,5,1")
+
+    def slots_line(self):
+        with self.lock:
+            return "SLOTS:" + ",".join("X" if c in self.counting else "O" for c in range(self.card_count))
+
+    def idle(self):
+        with self.lock:
+            return self.inbound.empty() and not self.paying
+
+
+class Reader(threading.Thread):
+    """Stands in for read_arduino_loop: dispatch device lines, expire commands, enforce holds"""
+
+    def __init__(self, device, slots_every=0.05):
+        super().__init__(name="stress-reader", daemon=True)
+        self.device = device
+        self.slots_every = slots_every
+        self.stop = threading.Event()
+        self.events = Counter()
+
+    def run(self):
+        app.reader_thread_ident = threading.get_ident()
+        last_slots = 0.0
+        while not self.stop.is_set():
+            app.command_channel.check_timeouts()
+            app.enforce_holds()
+            self.device.release_due()
+            if time.monotonic() - last_slots > self.slots_every:
+                last_slots = time.monotonic()
+                self.device.inbound.put(self.device.slots_line())
+            try:
+                line = self.device.inbound.get(timeout=0.005)
+            except queue.Empty:
+                continue
+            self.events[line.split(":", 1)[0]] += 1
+            app.dispatch_arduino_line(line)
+
+
+def make_customers(count):
+    return {
+        f"stress{i:03d}@example.test": {
+            "name": "Stress", "surname": f"{i:03d}", "password": "x", "rfid": f"5354{i:04d}",
+        } for i in range(count)
+    }
+
+
+def reset_host(device):
+    """Empty lot, full dispenser, no waitlist, nothing in flight"""
+    with app.state_lock:
+        for s in app.spots:
+            app.clear_reservation(s)
+            s["state"] = "O"
+        app.card_pool.load({"queue": list(range(app.CARD_COUNT)),
+                            "states": {str(i): IN_DISPENSER for i in range(app.CARD_COUNT)}})
+        app.active_card_timers.clear()
+        app.waitlist.clear()
+    app.command_channel.reset("stress round reset")
+    app.last_resv_line = app.last_cap_sent = None
+    app.last_slots_applied = None
+    app.arduino_serial = device
+    app.ack_protocol = True
+
+
+def check_invariants():
+    """Violations of the always-true state invariants (empty list when consistent)"""
+    problems = []
+    with app.state_lock:
+        holders = [s["reserved_by"] for s in app.spots if s.get("reserved_by")]
+        for user, count in Counter(holders).items():
+            if count > 1:
+                problems.append(f"{user} holds {count} spots")
+            if user in app.waitlist:
+                problems.append(f"{user} holds a spot and is on the waitlist")
+        queued = set(app.card_pool.order())
+        for idx in range(app.CARD_COUNT):
+            state = app.card_pool.state_of(idx)
+            if (idx in queued) != (state in (IN_DISPENSER, RETURNED)):
+                problems.append(f"card {idx + 1} is {state} but {'in' if idx in queued else 'not in'} the queue")
+            if state == RESERVED and not app.spots[idx].get("reserved_by"):
+                problems.append(f"card {idx + 1} is reserved but spot {idx + 1} is not")
+            if idx in app.active_card_timers and idx in queued:
+                problems.append(f"card {idx + 1} has a running timer but is queued")
+    return problems
+
+
+def check_quiescent(device, paid_before):
+    """Invariants that only hold once no command or device event is in flight"""
+    problems = []
+    with app.state_lock, device.lock:
+        expected = [c for c in device.queue if app.card_pool.state_of(c) != RESERVED]
+        if app.card_pool.order() != expected:
+            problems.append(f"host card queue {app.card_pool.order()} != device queue {expected} (reserved excluded)")
+        if set(app.active_card_timers) != device.counting:
+            problems.append(f"host timers {sorted(app.active_card_timers)} != device sessions {sorted(device.counting)}")
+        holds = app.count_capacity_holds()
+        if device.cap != holds:
+            problems.append(f"device CAP {device.cap} != {holds} capacity holds")
+    recorded = app.billing_ledger.summary()["sessions"] - paid_before
+    if recorded != device.paid_sent:
+        problems.append(f"{device.paid_sent} PAID sent but {recorded} sessions in the ledger")
+    return problems
+
+
+def worker(worker_id, seed, ops, users, results):
+    rng = random.Random(seed * 1000 + worker_id)
+    names, weights = zip(*OPERATIONS)
+    client = app.app.test_client()
+    for _ in range(ops):
+        email = rng.choice(users)
+        op = rng.choices(names, weights)[0]
+        if op == "scan":
+            call = lambda: client.post("/api/rfid_scan", json={"rfid": app.CUSTOMERS[email]["rfid"]})
+        else:
+            with client.session_transaction() as sess:
+                sess["user"] = email
+            if op == "reserve":
+                arrival = time.time() + 2 * 3600 if rng.random() < ADVANCE_SHARE else 0
+                call = lambda: client.post("/api/reserve", json={"arrival_ts": arrival})
+            else:
+                call = lambda: client.get("/api/spots")
+        began = time.perf_counter()
+        status = call().status_code
+        results.append((op, status, time.perf_counter() - began))
+
+
+def checker(stop, violations):
+    """Sample the invariants continuously while the clients run"""
+    while not stop.is_set():
+        violations.extend(check_invariants())
+        time.sleep(0.001)
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+
+
+def run_round(threads, ops, users, seed, dwell):
+    device = EmulatedDevice(app.CARD_COUNT, seed, dwell)
+    reset_host(device)
+    paid_before = app.billing_ledger.summary()["sessions"]
+    reader = Reader(device)
+    reader.start()
+
+    results, violations = [], []
+    per_thread = max(1, ops // threads)
+    workers = [threading.Thread(target=worker, args=(i, seed, per_thread, users, results))
+               for i in range(threads)]
+    checking = threading.Event()
+    sampler = threading.Thread(target=checker, args=(checking, violations), daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    checking.set()
+    sampler.join()
+
+    # Let every driver leave, then wait for the host to absorb it all
+    device.release_due(everything=True)
+    settled = wait_until(lambda: device.idle() and not app.command_channel.pending(), timeout=30)
+    app.enforce_holds()
+    settled = settled and wait_until(lambda: device.idle() and not app.command_channel.pending(), timeout=10)
+    reader.stop.set()
+    reader.join()
+    if not settled:
+        violations.append("host did not settle within 40s")
+    violations.extend(check_invariants())
+    violations.extend(check_quiescent(device, paid_before))
+    return elapsed, results, reader.events, violations
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated client thread counts, one round each")
+    parser.add_argument("--ops", type=int, default=2000, help="requests per round, split across the threads")
+    parser.add_argument("--users", type=int, default=24, help="customers competing for the 4 spots")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dwell-ms", default="5,50", help="min,max time a driver stays parked")
+    parser.add_argument("--respect-limits", action="store_true",
+                        help="keep the configured rate limits (requests may be answered 429)")
+    args = parser.parse_args()
+    thread_counts = [int(n) for n in args.threads.split(",")]
+    dwell = tuple(float(ms) / 1000 for ms in args.dwell_ms.split(","))
+
+    customers = make_customers(args.users)
+    app.CUSTOMERS.clear()
+    app.CUSTOMERS.update(customers)
+    app.rebuild_rfid_index()
+    app.CUSTOMERS_CSV = os.path.join(STRESS_DIR, "customers.csv")
+    app.mail.state.suppress = True
+    if not args.respect_limits:
+        app.app.config["RATE_LIMITS"] = {}
+        app.app.config["CONCURRENCY_LIMITS"] = {}
+        ratelimit.init_app(app.app)
+    users = sorted(customers)
+
+    failed = False
+    print(f"{'threads':>7}{'requests':>10}{'seconds':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'max ms':>9}{'device':>8}  statuses")
+    for threads in thread_counts:
+        elapsed, results, events, violations = run_round(threads, args.ops, users, args.seed, dwell)
+        latencies = [r[2] for r in results]
+        statuses = Counter(f"{op}:{status}" for op, status, _ in results)
+        print(f"{threads:>7}{len(results):>10}{elapsed:>9.2f}{len(results) / elapsed:>9.0f}"
+              f"{percentile(latencies, 0.5) * 1000:>9.2f}{percentile(latencies, 0.95) * 1000:>9.2f}"
+              f"{max(latencies) * 1000:>9.2f}{sum(events.values()):>8}  "
+              + " ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+        by_op = defaultdict(list)
+        for op, _, latency in results:
+            by_op[op].append(latency)
+        for op, values in sorted(by_op.items()):
+            print(f"{'':>7}  {op:<8} p50 {percentile(values, 0.5) * 1000:.2f} ms"
+                  f"  p95 {percentile(values, 0.95) * 1000:.2f} ms  n={len(values)}")
+        if violations:
+            failed = True
+            unique = list(dict.fromkeys(violations))
+            print(f"  FAIL: {len(violations)} invariant violations ({len(unique)} distinct)")
+            for problem in unique[:MAX_VIOLATIONS_SHOWN]:
+                print(f"    - {problem}")
+
+    app.state_journal.close()
+    if not failed:
+        print("OK: all invariants held")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
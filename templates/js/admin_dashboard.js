@@ -0,0 +1,90 @@
+let customerToDelete = null;
+
+document.getElementById('createCustomerForm').addEventListener('submit', async (e) => {
+  e.preventDefault();
+
+  const formData = new FormData(e.target);
+  const data = {
+    surname: formData.get('surname'),
+    name: formData.get('name'),
+    middle_name: formData.get('middle_name'),
+    phone: formData.get('phone'),
+    email: formData.get('email'),
+    rfid: formData.get('rfid')
+  };
+
+  try {
+    const response = await fetch('/admin/create_customer', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(data)
+    });
+
+    const result = await response.json();
+
+    if (result.success) {
+      alert('Customer account created successfully!');
+      location.reload();
+    } else {
+      alert('Error: ' + result.message);
+    }
+  } catch (error) {
+    alert('Error creating customer account');
+    console.error('Error:', error);
+  }
+});
+
+function deleteCustomer(email) {
+  customerToDelete = email;
+  showModal('deleteModal');
+}
+
+function confirmDelete() {
+  if (customerToDelete) {
+    // In a real application, you would make an API call to delete the customer
+    alert('Delete functionality would be implemented here');
+    closeModal('deleteModal');
+    customerToDelete = null;
+  }
+}
+
+function resetPassword(email) {
+  // In a real application, you would make an API call to reset the password
+  alert('Reset password functionality would be implemented here for: ' + email);
+}
+
+function showModal(modalId) {
+  document.getElementById(modalId).style.display = 'flex';
+}
+
+function closeModal(modalId) {
+  document.getElementById(modalId).style.display = 'none';
+}
+
+// Close modal when clicking outside
+document.getElementById('deleteModal').addEventListener('click', (e) => {
+  if (e.target.id === 'deleteModal') {
+    closeModal('deleteModal');
+  }
+});
+
+// Arduino link health badge
+async function refreshLinkBadge() {
+  const badge = document.getElementById('linkBadge');
+  try {
+    const r = await fetch('/admin/link');
+    const h = await r.json();
+    const rtt = h.rtt_ms && h.rtt_ms.p95 !== null ? ` · p95 ${h.rtt_ms.p95}ms` : '';
+    badge.textContent = `Arduino: ${h.state}${rtt}`;
+    badge.className = `status-badge link-${h.state}`;
+    badge.title = `pings sent ${h.pings.sent}, late ${h.pings.late}, dropped ${h.pings.dropped}`;
+  } catch (error) {
+    badge.textContent = 'Arduino: unknown';
+    badge.className = 'status-badge link-unknown';
+  }
+}
+
+refreshLinkBadge();
+setInterval(refreshLinkBadge, 5000);
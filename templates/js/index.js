@@ -0,0 +1,196 @@
+let pendingReserveId = null;
+let myAssignedId = null;
+
+let myWaitlistPosition = null;
+
+async function fetchSpots() {
+  const r = await fetch('/api/spots');
+  const data = await r.json();
+  renderLot(data);
+}
+
+function renderLot(data) {
+  renderSpots(data.spots);
+  const position = data.waitlist_position;
+  if (myWaitlistPosition && !position && data.spots.some(s => s.reserved_by_me)) {
+    alert('✅ A spot freed up!\n\nYou have been moved off the waitlist and your spot is reserved.');
+  }
+  myWaitlistPosition = position || null;
+  const note = document.getElementById('waitlistNote');
+  if (note) {
+    note.style.display = myWaitlistPosition ? 'block' : 'none';
+    note.textContent = myWaitlistPosition ? `You are #${myWaitlistPosition} on the waitlist.` : '';
+  }
+}
+
+function formatDuration(seconds) {
+  if (!seconds || seconds < 0) return '';
+  const m = Math.floor(seconds / 60);
+  const s = Math.floor(seconds % 60);
+  return `${m}m ${s}s`;
+}
+
+function getTimeUntilArrival(arrivalTs) {
+  if (!arrivalTs) return null;
+  const now = Math.floor(Date.now() / 1000);
+  return arrivalTs - now;
+}
+
+function isLastMinuteReservation(arrivalTs) {
+  const timeUntil = getTimeUntilArrival(arrivalTs);
+  if (!timeUntil) return false;
+  const oneHour = 60 * 60; // 1 hour in seconds
+  return timeUntil < oneHour && timeUntil > 0;
+}
+
+function renderSpots(spots) {
+  const grid = document.getElementById('grid');
+  grid.innerHTML = '';
+  spots.forEach(s => {
+    const div = document.createElement('div');
+    div.className = 'spot';
+    const since = s.reserved_at ? Math.max(0, Math.floor(Date.now()/1000 - s.reserved_at)) : null;
+
+    // Build the visual slot with overlays
+    let overlays = '';
+    if (s.state === 'X') {
+      overlays += `<img class="car-img" alt="Car" src="${CAR_IMG_URL}">`;
+    } else if (s.state === 'R') {
+      const timeUntil = getTimeUntilArrival(s.arrival_ts);
+      const isLastMinute = isLastMinuteReservation(s.arrival_ts);
+      let timeInfo = '';
+      let badgeClass = 'reserved-badge';
+
+      if (timeUntil && timeUntil > 0) {
+        if (isLastMinute) {
+          timeInfo = ` · ${formatDuration(timeUntil)} (Last-minute)`;
+          badgeClass = 'reserved-badge last-minute';
+        } else {
+          timeInfo = ` · ${formatDuration(timeUntil)} (Advance)`;
+          badgeClass = 'reserved-badge advance';
+        }
+      } else if (since) {
+        timeInfo = ` · Reserved ${formatDuration(since)} ago`;
+      }
+
+      overlays += `
+        <div class="${badgeClass}" title="Reserved${timeInfo}">
+          <span class="reserved-dot"></span>
+          <span class="reserve-text">Reserved</span>
+        </div>
+      `;
+    }
+
+    div.innerHTML = `
+      <div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:8px;">
+        <div style="font-weight:600; color:#334155;">Spot ${s.id}</div>
+        <div></div>
+      </div>
+      <div class="slot">
+        <div class="slot-label">P${s.id}</div>
+        <div class="slot-inner">${overlays}</div>
+      </div>
+      ${s.state === 'R' ? `<div class="muted">Reserved ${since ? '(' + formatDuration(since) + ')' : ''}</div>` : ''}
+      <div style="margin-top:10px; display:flex; gap:8px; flex-wrap:wrap;"></div>
+    `;
+    grid.appendChild(div);
+  });
+
+  // Update assignment UI
+  const me = spots.find(s => s.reserved_by_me);
+  myAssignedId = me ? me.id : null;
+}
+
+// Modal functions
+function showModal(modalId) {
+  document.getElementById(modalId).style.display = 'flex';
+}
+
+function hideModal(modalId) {
+  document.getElementById(modalId).style.display = 'none';
+}
+
+// Retries of one action reuse its Idempotency-Key, so the server applies it only once
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+async function postWithRetry(url, payload, attempts = 3) {
+  const key = newIdempotencyKey();
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await fetch(url, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json', 'Idempotency-Key': key},
+        body: JSON.stringify(payload)
+      });
+    } catch (error) {
+      if (attempt >= attempts) throw error;
+      await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+    }
+  }
+}
+
+// Reserve button - show confirmation modal
+document.getElementById('reserveAny').onclick = () => {
+  showModal('reserveModal');
+};
+
+// Reserve confirmation
+document.getElementById('reserveConfirmBtn').onclick = async () => {
+  hideModal('reserveModal');
+  const input = document.getElementById('arrival').value;
+  let arrivalTs = 0;
+  if (input) {
+    const dt = new Date(input);
+    if (!isNaN(dt.getTime())) arrivalTs = Math.floor(dt.getTime()/1000);
+  }
+
+  try {
+    const r = await postWithRetry('/api/reserve', { arrival_ts: arrivalTs });
+    const data = await r.json();
+
+    if (data.waitlisted) {
+      alert('⏳ Parking Is Full\n\n' + data.message);
+    } else if (!data.success) {
+      // Show specific error message for time-based policy
+      if (data.message && data.message.includes('Less than 1 hour notice')) {
+        alert('❌ Reservation Rejected!\n\n' + data.message + '\n\n💡 Tip: Book at least 1 hour in advance to guarantee your spot!');
+      } else {
+        alert('❌ Reservation Failed!\n\n' + (data.message || 'Unable to reserve. Please try again.'));
+      }
+    } else {
+      alert('✅ Reserved Successfully!\n\nWe\'ll hold a slot for you. Please arrive on time!');
+    }
+  } catch (error) {
+    alert('❌ Network Error!\n\nUnable to process reservation. Please check your connection and try again.');
+  }
+
+  fetchSpots();
+};
+
+// Reserve cancel
+document.getElementById('reserveCancelBtn').onclick = () => {
+  hideModal('reserveModal');
+};
+
+
+// Close modals when clicking outside
+document.getElementById('reserveModal').onclick = (e) => {
+  if (e.target.id === 'reserveModal') hideModal('reserveModal');
+};
+
+fetchSpots();
+// Live updates: the server pushes the lot on every change; poll if streaming is unavailable
+// (a Flask server with all stream slots taken answers 204, which also lands in onerror)
+if (window.EventSource) {
+  const stream = new EventSource('/api/spots/stream');
+  stream.onmessage = (e) => renderLot(JSON.parse(e.data));
+  stream.onerror = () => {
+    stream.close();
+    setInterval(fetchSpots, 3000);
+  };
+} else {
+  setInterval(fetchSpots, 3000);
+}
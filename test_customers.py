@@ -0,0 +1,27 @@
+from customers import FIELDS, Customer, CustomerStore
+
+ROW = ("a@example.com", "Doe", "Jane", "", "+15550000000", "AB CD", "", "admin", "2024-01-10 10:20:30")
+
+
+def make_store():
+    store = CustomerStore()
+    store.put_row(ROW)
+    return store
+
+
+def test_customer_reads_like_a_dict():
+    customer = make_store()["a@example.com"]
+    assert isinstance(customer, Customer)
+    expected = dict(zip(FIELDS, ROW), password=None)
+    assert dict(customer) == expected
+    assert list(customer.values()) == list(expected.values())
+    assert list(customer.items()) == list(expected.items())
+    assert customer.name == "Jane"
+
+
+def test_customer_writes_through_to_the_store():
+    store = make_store()
+    store["a@example.com"]["rfid"] = "EF 01"
+    assert store["a@example.com"]["rfid"] == "EF 01"
+    assert store.row("a@example.com")[FIELDS.index("rfid")] == "EF 01"
+    assert store.row("a@example.com")[-1] == ROW[-1]
@@ -0,0 +1,81 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+
+# Keep the app's journal, ledger and traces out of the live data directory
+TEST_DIR = tempfile.mkdtemp(prefix="parking-serve-test-")
+os.environ["PARKING_STATE_DIR"] = TEST_DIR
+os.environ["PARKING_LEDGER_CSV"] = os.path.join(TEST_DIR, "sessions.csv")
+os.environ["PARKING_TRACE_FILE"] = os.path.join(TEST_DIR, "traces.jsonl")
+os.environ.pop("PARKING_SERIAL_CAPTURE", None)
+os.environ.setdefault("PARKING_LOG_LEVEL", "WARNING")
+
+import app as parking  # noqa: E402
+import serve  # noqa: E402
+
+
+def session_cookie():
+    client = parking.app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = "driver@example.com"
+    return client.get_cookie("session").value
+
+
+def open_request(port, path, cookie):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: test\r\nCookie: session={cookie}\r\n\r\n".encode())
+    return sock
+
+
+def status_of(sock):
+    return int(sock.recv(4096).split(b" ", 2)[1])
+
+
+def run_server(threads, reserved_workers, max_queued):
+    parking.app.config["STREAM_MAX"] = serve.stream_limit(threads, reserved_workers)
+    server = serve.PooledWSGIServer("127.0.0.1", 0, parking.app, threads, keepalive=5, backlog=16,
+                                    max_queued=max_queued)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server, sockets):
+    parking.begin_shutdown()  # ends the open streams so the pool can drain
+    for sock in sockets:
+        sock.close()
+    server.shutdown()
+    deadline = time.monotonic() + 5
+    while parking.open_streams and time.monotonic() < deadline:
+        time.sleep(0.01)
+    parking.shutting_down.clear()
+
+
+def test_requests_complete_with_every_thread_asked_for_a_stream():
+    threads = 3
+    server = run_server(threads, reserved_workers=1, max_queued=8)
+    cookie = session_cookie()
+    streams = [open_request(server.port, "/api/spots/stream", cookie) for _ in range(threads)]
+    try:
+        statuses = sorted(status_of(sock) for sock in streams)
+        assert statuses == [200, 200, 204]  # one worker stays reserved; the extra page polls
+        sock = open_request(server.port, "/api/spots", cookie)
+        streams.append(sock)
+        assert status_of(sock) == 200
+    finally:
+        stop_server(server, streams)
+
+
+def test_connections_beyond_the_queue_are_shed():
+    server = run_server(1, reserved_workers=0, max_queued=0)
+    cookie = session_cookie()
+    stream = open_request(server.port, "/api/spots/stream", cookie)
+    sockets = [stream]
+    try:
+        assert status_of(stream) == 200  # holds the only worker
+        sock = open_request(server.port, "/api/spots", cookie)
+        sockets.append(sock)
+        assert status_of(sock) == 503
+    finally:
+        stop_server(server, sockets)
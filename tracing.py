@@ -0,0 +1,299 @@
+"""Span tracing for the gate path: RFID scan -> HERE command -> device dispense.
+
+A trace starts at the HTTP boundary. Its ID comes from ``X-Trace-Id`` when
+the caller sends a valid one; otherwise a new ID is generated. The ID is
+returned in the same header. Code on the request path wraps its stages in
+``span(name)``. Outside a trace, span() costs one context-variable read.
+
+A gate trace also waits for the device. ``device_sent()`` is called just
+before HERE goes out and ``device_command(seq)`` once its sequence number
+is known. The firmware answers with ``DISP:<card>@<seq>``, echoing the
+sequence number of the HERE that dispensed the card, and that line
+(``device_response``) closes the dispense stage of the matching trace.
+DISP lines without a sequence number come from walk-in buttons or VIP
+cards at the reader and belong to no trace. The answer may arrive before
+the HTTP reply, or even before the sequence number is bound. Either way,
+the trace finishes once both the response and the device answer are in,
+so the dispense stage counts toward gate latency. If the device never
+answers, the trace is closed after ``device_timeout`` seconds.
+
+Finished traces go to a TraceSink. The sink appends each trace to a
+JSON-lines file, rotating it at ``max_bytes``. It also keeps a window of
+recent durations per stage for percentile summaries and an SLO hit rate.
+"""
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+
+TRACE_HEADER = "X-Trace-Id"
+VALID_TRACE_ID = re.compile(r"^[A-Za-z0-9-]{8,64}$")
+
+current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, name, trace_id=None):
+        self.name = name
+        self.trace_id = trace_id if trace_id and VALID_TRACE_ID.match(trace_id) else uuid.uuid4().hex[:16]
+        self.wall_start = time.time()
+        self.started = time.perf_counter()
+        self.spans = []  # (name, offset_ms, duration_ms)
+        self.attrs = {}
+        self.total_ms = None
+        self.waiting = {"response"}  # parts still outstanding before the trace can finish
+        self.device_seq = None  # sequence number of the gate command the device answers
+
+    def add_span(self, name, start, end):
+        self.spans.append((name, round((start - self.started) * 1000, 3), round((end - start) * 1000, 3)))
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id, "name": self.name, "start": round(self.wall_start, 3),
+            "total_ms": self.total_ms, "attrs": self.attrs,
+            "spans": [{"name": n, "offset_ms": o, "duration_ms": d} for n, o, d in self.spans],
+        }
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the current trace (no-op when the request is not traced)"""
+    trace = current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter())
+
+
+def annotate(**attrs):
+    trace = current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def current_id():
+    trace = current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p95": pick(0.95), "p99": pick(0.99),
+            "max": ordered[-1]}
+
+
+class TraceSink:
+    def __init__(self, path=None, window=1000, max_bytes=10 * 1024 * 1024, slo_ms=None, device_timeout=10.0):
+        self.path = path
+        self.window = window
+        self.max_bytes = max_bytes
+        self.slo_ms = slo_ms
+        self.device_timeout = device_timeout
+        self.lock = threading.Lock()
+        self.stages = defaultdict(lambda: defaultdict(lambda: deque(maxlen=self.window)))  # name -> stage -> ms
+        self.recent = deque(maxlen=50)
+        self.awaiting = {}  # trace -> sent_at, waiting for the device's answer
+        self.by_seq = {}  # gate command sequence number -> trace
+        self.answered = OrderedDict()  # seq -> (outcome, at): answers that beat device_command()
+        self.finished = 0
+        self.slo_met = 0
+        self.listeners = []  # callables(trace) run after each finished trace
+
+    def end_request(self, trace):
+        """The HTTP response is out"""
+        trace.attrs["response_ms"] = round((time.perf_counter() - trace.started) * 1000, 3)
+        self.complete(trace, "response")
+        self.expire()
+
+    def device_sent(self, trace):
+        """`trace` is about to send its gate command; the device's answer becomes part of it"""
+        with self.lock:
+            trace.waiting.add("device")
+            self.awaiting[trace] = time.perf_counter()
+
+    def device_command(self, trace, seq):
+        """`trace`'s gate command went out as `seq`; the DISP echoing `seq` is its answer"""
+        with self.lock:
+            if trace not in self.awaiting or trace.device_seq is not None:
+                return  # not a gate command, or the trace already has one
+            trace.device_seq = seq
+            early = self.answered.pop(seq, None)
+            if early is None:
+                self.by_seq[seq] = trace
+                return
+        self.answer(trace, *early)
+
+    def device_cancelled(self, trace):
+        """The gate command was not delivered; stop waiting for an answer"""
+        with self.lock:
+            self.awaiting.pop(trace, None)
+            self.by_seq.pop(trace.device_seq, None)
+        trace.attrs["device"] = "not_sent"
+        self.complete(trace, "device")
+
+    def device_response(self, outcome, seq):
+        """The device dispensed card `outcome` for command `seq`; the matching trace, if any
+
+        Dispenses without a sequence number (walk-in button, VIP card at the
+        reader) answer no gate command and are ignored.
+        """
+        if seq is None:
+            return None
+        now = time.perf_counter()
+        with self.lock:
+            trace = self.by_seq.pop(seq, None)
+            if trace is None:
+                # The reader can see the answer before the sender binds the sequence number
+                self.answered[seq] = (outcome, now)
+                while len(self.answered) > 16:
+                    self.answered.popitem(last=False)
+                return None
+        self.answer(trace, outcome, now)
+        return trace
+
+    def answer(self, trace, outcome, at):
+        with self.lock:
+            sent_at = self.awaiting.pop(trace, None)
+        if sent_at is None:
+            return  # cancelled or expired meanwhile
+        trace.add_span("device.dispense", sent_at, at)
+        trace.attrs["device"] = outcome
+        self.complete(trace, "device")
+
+    def expire(self):
+        now = time.perf_counter()
+        with self.lock:
+            expired = [trace for trace, sent_at in self.awaiting.items() if now - sent_at > self.device_timeout]
+            for trace in expired:
+                del self.awaiting[trace]
+                self.by_seq.pop(trace.device_seq, None)
+        for trace in expired:
+            trace.attrs["device"] = "timeout"
+            self.complete(trace, "device")
+
+    def complete(self, trace, part):
+        with self.lock:
+            if part not in trace.waiting:
+                return
+            trace.waiting.discard(part)
+            if trace.waiting:
+                return
+        self.finish(trace)
+
+    def finish(self, trace):
+        trace.total_ms = round((time.perf_counter() - trace.started) * 1000, 3)
+        record = trace.to_dict()
+        with self.lock:
+            self.finished += 1
+            stages = self.stages[trace.name]
+            stages["total"].append(trace.total_ms)
+            for name, _, duration in trace.spans:
+                stages[name].append(duration)
+            # A server error never meets the SLO, however fast it failed
+            if self.slo_ms is not None and trace.total_ms <= self.slo_ms and trace.attrs.get("status", 200) < 500:
+                self.slo_met += 1
+            self.recent.append(record)
+            if self.path:
+                self.write(record)
+        for listener in list(self.listeners):
+            try:
+                listener(trace)
+            except Exception:
+                pass
+
+    def write(self, record):
+        # Caller holds self.lock
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        except OSError:
+            pass  # tracing must never break the gate
+
+    def summary(self):
+        """Per-trace-name stage percentiles (ms) over the recent window, plus the SLO hit rate"""
+        self.expire()
+        with self.lock:
+            result = {
+                name: {stage: percentiles(values) for stage, values in stages.items()}
+                for name, stages in self.stages.items()
+            }
+            slo = None
+            if self.slo_ms is not None:
+                slo = {"target_ms": self.slo_ms, "finished": self.finished,
+                       "met_ratio": round(self.slo_met / self.finished, 4) if self.finished else None}
+            return {"traces": result, "slo": slo, "awaiting_device": len(self.awaiting)}
+
+    def recent_traces(self, limit=20):
+        with self.lock:
+            return list(self.recent)[-limit:]
+
+
+sink = None
+
+
+def init_app(app):
+    """Create the sink from app.config['TRACE_FILE'] / ['GATE_SLO_MS'] / ['TRACE_DEVICE_TIMEOUT']"""
+    global sink
+    sink = TraceSink(app.config.get("TRACE_FILE"), slo_ms=app.config.get("GATE_SLO_MS"),
+                     device_timeout=app.config.get("TRACE_DEVICE_TIMEOUT", 10.0))
+
+
+def device_sent():
+    """Call just before the gate command goes out: the trace will wait for the device's answer"""
+    trace = current.get()
+    if trace is not None and sink is not None:
+        sink.device_sent(trace)
+
+
+def device_command(seq):
+    """Bind the current trace's gate command to its wire sequence number"""
+    trace = current.get()
+    if trace is not None and sink is not None:
+        sink.device_command(trace, seq)
+
+
+def device_cancelled():
+    trace = current.get()
+    if trace is not None and sink is not None:
+        sink.device_cancelled(trace)
+
+
+def traced(name):
+    """Trace this view: start at the HTTP boundary, return X-Trace-Id, keep the trace open for the device"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if sink is None:
+                return view(*args, **kwargs)
+            trace = Trace(name, request.headers.get(TRACE_HEADER))
+            token = current.set(trace)
+            trace.attrs["status"] = 500  # unless the view returns: a failed gate still counts against the SLO
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+                response.headers[TRACE_HEADER] = trace.trace_id
+                trace.attrs["status"] = response.status_code
+                return response
+            finally:
+                current.reset(token)
+                sink.end_request(trace)
+        return wrapped
+    return decorator
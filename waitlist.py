@@ -0,0 +1,76 @@
+"""Fair waitlist for a full lot: a binary heap ordered by requested arrival, then join time.
+
+Leaving is lazy. The entry is dropped from the index and skipped when it
+reaches the head, so join, leave and pop_next stay O(log n) or better.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+class Waitlist:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # user -> heap entry (the live one)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, user):
+        return user in self.entries
+
+    def join(self, user, arrival_ts=0, joined_at=None):
+        """Queue `user` (or update their requested arrival); returns their 1-based position"""
+        joined_at = joined_at or time.time()
+        with self.lock:
+            previous = self.entries.get(user)
+            if previous is not None:
+                joined_at = previous[1]  # re-joining never costs your place
+            # ASAP requests (no arrival time) rank by when they joined
+            entry = [arrival_ts if arrival_ts > 0 else joined_at, joined_at, next(self.counter), user, arrival_ts]
+            self.entries[user] = entry
+            heapq.heappush(self.heap, entry)
+            self._compact()
+        return self.position(user)
+
+    def leave(self, user):
+        with self.lock:
+            left = self.entries.pop(user, None) is not None
+            self._compact()
+            return left
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+            self.entries = {}
+
+    def _compact(self):
+        # Caller holds self.lock. Drop stale entries once they outnumber live ones.
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+    def pop_next(self):
+        """Remove and return (user, arrival_ts, joined_at) for the head of the line, or None"""
+        with self.lock:
+            while self.heap:
+                entry = heapq.heappop(self.heap)
+                if self.entries.get(entry[3]) is entry:
+                    del self.entries[entry[3]]
+                    return entry[3], entry[4], entry[1]
+            return None
+
+    def position(self, user):
+        """1-based place in line, or None (O(n); for status display only)"""
+        with self.lock:
+            entry = self.entries.get(user)
+            if entry is None:
+                return None
+            return 1 + sum(1 for other in self.entries.values() if other[:3] < entry[:3])
+
+    def dump(self):
+        with self.lock:
+            return {user: {"arrival_ts": e[4], "joined_at": e[1]} for user, e in self.entries.items()}